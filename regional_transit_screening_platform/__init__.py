@@ -1,11 +1,8 @@
 import os
+import threading
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 
-import pg_data_etl as pg
-
-# from .step_00_helpers.database import PostgreSQL
-
 load_dotenv(find_dotenv())
 DB_USER = os.getenv("DB_USER")
 DB_PW = os.getenv("DB_PW")
@@ -13,12 +10,72 @@ SQL_DB_NAME = os.getenv("SQL_DB_NAME")
 
 DAISY_DB_USER = os.getenv("DAISY_DB_USER")
 DAISY_DB_PW = os.getenv("DAISY_DB_PW")
+DAISY_DB_HOST = os.getenv("DAISY_DB_HOST", "localhost")
+DAISY_DB_NAME = os.getenv("DAISY_DB_NAME", "gtfs_from_daisy")
 
 GDRIVE_PROJECT_FOLDER = os.getenv("GDRIVE_PROJECT_FOLDER")
 
-# db = PostgreSQL(SQL_DB_NAME, un=DB_USER, pw=DB_PW)
-db = pg.Database(SQL_DB_NAME, **pg.connections["localhost"])
-file_root = Path(GDRIVE_PROJECT_FOLDER)
+# Optional folder for cached query results, see step_00_helpers/readme.md
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR")
+
+# Optional local folder for Parquet copies of the inputs, see step_01_import_data/readme.md
+INPUT_MIRROR_DIR = os.getenv("INPUT_MIRROR_DIR")
+
+
+# The objects below pull in pandas, geopandas, sqlalchemy, etc.
+# They're built the first time they're used (e.g. ``from regional_transit_screening_platform
+# import db``), so that ``rtsp --help`` and other light imports stay fast.
+_lock = threading.RLock()
+
+
+def _make_db():
+    from .step_00_helpers.database import PostgreSQL
+
+    db = PostgreSQL(SQL_DB_NAME, un=DB_USER, pw=DB_PW)
+    if QUERY_CACHE_DIR:
+        db.enable_query_cache(QUERY_CACHE_DIR)
+    return db
+
+
+def _make_file_root():
+    return Path(GDRIVE_PROJECT_FOLDER)
+
+
+def _make_input_mirror():
+    if not INPUT_MIRROR_DIR:
+        return None
+
+    from .step_01_import_data.mirror import InputMirror
+
+    return InputMirror(INPUT_MIRROR_DIR)
+
+
+def _make_match_features_with_osm():
+    # Helper function that requires db to be defined first
+    from .step_00_helpers.interpolation import match_features_with_osm
+
+    return match_features_with_osm
+
+
+_LAZY_ATTRIBUTES = {
+    "db": _make_db,
+    "file_root": _make_file_root,
+    "input_mirror": _make_input_mirror,
+    "match_features_with_osm": _make_match_features_with_osm,
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    with _lock:
+        # Another thread may have built it while this one waited
+        if name not in globals():
+            globals()[name] = _LAZY_ATTRIBUTES[name]()
+
+    return globals()[name]
+
 
-# Load up helper functions that require DB to be defined first
-from .step_00_helpers.interpolation import match_features_with_osm
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
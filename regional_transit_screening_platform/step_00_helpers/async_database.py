@@ -0,0 +1,209 @@
+"""
+An ``asyncio`` counterpart to the ``PostgreSQL`` class, backed by ``asyncpg``.
+
+Every helper in ``PostgreSQL`` blocks until its query finishes. When a stage
+has several statements that don't depend on each other, this class lets them
+run at the same time on a small pool of connections. The connection details
+come from an existing ``PostgreSQL`` object.
+"""
+import asyncio
+from functools import partial
+
+import asyncpg
+import pandas as pd
+
+from .database import PostgreSQL
+
+
+class AsyncPostgreSQL:
+    """
+    Async access to the same database as a ``PostgreSQL`` object.
+
+    Usage:
+        async with AsyncPostgreSQL(db) as adb:
+            await adb.execute(...)
+    """
+
+    def __init__(self, db: PostgreSQL, pool_size: int = 5):
+
+        self.db = db
+        self.POOL_SIZE = pool_size
+        self._pool = None
+
+    async def open(self) -> None:
+        """
+        Create the connection pool
+        """
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                self.db.uri(), min_size=1, max_size=self.POOL_SIZE
+            )
+
+    async def close(self) -> None:
+        """
+        Close every connection in the pool
+        """
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # Make a permanent change to the database
+    # ---------------------------------------
+
+    async def execute(self, query: str) -> str:
+        """
+        Execute a query for a persistent result in the database.
+
+        :param query: any valid SQL query string
+        :type query: str
+        :return: status of the last statement, e.g. "UPDATE 12"
+        :rtype: str
+        """
+        await self.open()
+        return await self._pool.execute(query)
+
+    # Extract data from the database
+    # ------------------------------
+
+    async def query_as_list(self, query: str) -> list:
+        """
+        Query the database and get the result as a ``list`` of tuples
+
+        :param query: any valid SQL query string
+        :type query: str
+        :return: list with each item being a row from the query result
+        :rtype: list
+        """
+        await self.open()
+        records = await self._pool.fetch(query)
+        return [tuple(record) for record in records]
+
+    async def query_as_df(self, query: str) -> pd.DataFrame:
+        """
+        Query the database and get the result as a ``pandas.DataFrame``
+
+        :param query: any valid SQL query string
+        :type query: str
+        :return: dataframe with the query result
+        :rtype: pd.DataFrame
+        """
+        await self.open()
+
+        async with self._pool.acquire() as connection:
+            statement = await connection.prepare(query)
+            columns = [attr.name for attr in statement.get_attributes()]
+            records = await statement.fetch()
+
+        return pd.DataFrame([tuple(record) for record in records], columns=columns)
+
+    # IMPORT data into the database
+    # -----------------------------
+
+    async def import_dataframe(
+        self,
+        dataframe: pd.DataFrame,
+        table_name: str,
+        if_exists: str = "fail",
+        schema: str = None,
+        index: bool = True,
+        dtype: dict = None,
+    ) -> None:
+        """
+        Bulk load an in-memory ``pandas.DataFrame`` with a binary ``COPY``.
+        The table is created with the same rules as ``PostgreSQL.import_dataframe()``,
+        including writing the index as a column unless ``index=False``.
+
+        :param dataframe: dataframe with data you want to save
+        :type dataframe: pd.DataFrame
+        :param table_name: name of the table that will get created
+        :type table_name: str
+        :param if_exists: "fail", "replace" or "append", defaults to "fail"
+        :type if_exists: str, optional
+        :param index: write the dataframe's index as a column, defaults to True
+        :type index: bool, optional
+        :param dtype: SQL types for specific columns, e.g. ``{"geom": Geometry(...)}``
+        :type dtype: dict, optional
+        """
+
+        table_name, schema = self.db._split_table_name(table_name, schema)
+
+        print(f"\t -> SQL tablename: {schema}.{table_name}")
+
+        await self.open()
+
+        PostgreSQL.clean_column_names(dataframe)
+
+        if index:
+            dataframe = dataframe.reset_index()
+
+        # Creating the table is quick, but blocking. Keep it off the event loop.
+        loop = asyncio.get_running_loop()
+        create_table = partial(
+            self.db._create_table_for_dataframe, dataframe, table_name, schema, if_exists, dtype
+        )
+        await loop.run_in_executor(None, self.db.add_schema, schema)
+        await loop.run_in_executor(None, create_table)
+
+        # asyncpg needs plain python values, with None for nulls
+        values = dataframe.astype(object).where(dataframe.notna(), None)
+
+        await self._pool.copy_records_to_table(
+            table_name,
+            records=values.itertuples(index=False, name=None),
+            columns=list(dataframe.columns),
+            schema_name=schema,
+        )
+
+        if schema == self.db.SCRATCH_SCHEMA:
+            await self.execute(f"ANALYZE {schema}.{table_name};")
+
+
+async def gather_with_limit(coroutines: list, limit: int = 4) -> list:
+    """
+    Await a list of coroutines, running no more than ``limit`` at the same time.
+
+    :param coroutines: coroutines to run
+    :type coroutines: list
+    :param limit: maximum number running at once, defaults to 4
+    :type limit: int, optional
+    :return: results, in the same order as ``coroutines``
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+
+def execute_concurrently(db: PostgreSQL, queries: list, limit: int = 4) -> list:
+    """
+    Run independent SQL statements concurrently from synchronous code.
+
+    Usage:
+        execute_concurrently(db, [query_septa, query_njt], limit=2)
+
+    :param db: database to run the queries against
+    :type db: PostgreSQL
+    :param queries: SQL statements that don't depend on each other
+    :type queries: list
+    :param limit: maximum number of statements running at once, defaults to 4
+    :type limit: int, optional
+    :return: status of each statement, in the same order as ``queries``
+    :rtype: list
+    """
+
+    async def run_all():
+        async with AsyncPostgreSQL(db, pool_size=limit) as adb:
+            return await gather_with_limit([adb.execute(q) for q in queries], limit)
+
+    return asyncio.run(run_all())
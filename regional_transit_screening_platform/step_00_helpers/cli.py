@@ -1,6 +1,10 @@
 """
 This module uses `click` to create a command-line-interface (CLI)
 for the `regional_transit_screening_platform`
+
+The step modules (and the database handle they use) are only imported
+once a command actually runs, so ``rtsp --help`` doesn't have to load
+pandas, geopandas, osmnx, etc.
 """
 
 import click
@@ -10,19 +14,217 @@ from regional_transit_screening_platform.step_02_average_speed import cmd as cmd
 from regional_transit_screening_platform.step_05_ridership import cmd as cmd_05
 
 
+# Session tuning profile that each command runs with (see database.TUNING_PROFILES)
+COMMAND_PROFILES = {
+    "db-setup-from-shp": "bulk-load",
+    "db-import-osm": "bulk-load",
+    "db-import-from-daisy-db": "bulk-load",
+    "db-feature-engineering": "spatial-join",
+    "db-scrape-septa-report": "bulk-load",
+    "speed-match-osm": "spatial-join",
+    "speed-analysis": "spatial-join",
+    "ridership-match-osm-w-septa": "spatial-join",
+    "ridership-match-osm-w-njt": "spatial-join",
+    "ridership-analysis": "spatial-join",
+    "ridership-combine-loads": "bulk-load",
+    "ridership-assign-loads": "spatial-join",
+}
+
+# Commands that don't build any tables of their own
+NO_MAINTENANCE = ["db-clean-scratch", "run"]
+
+
+def start_command(db, name: str) -> dict:
+    """
+    Take the snapshot that ``finish_command()`` compares against,
+    right before a command runs
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param name: name of the command
+    :type name: str
+    :return: result of ``indexes.scan_counts()``, or None if the command has no follow-up
+    :rtype: dict
+    """
+    from regional_transit_screening_platform.step_00_helpers.indexes import scan_counts
+
+    if name in NO_MAINTENANCE:
+        return None
+
+    return scan_counts(db)
+
+
+def finish_command(db, name: str, before: dict, tables: list = None, written: list = None) -> None:
+    """
+    Add registered indexes and fresh statistics, and record the tables
+    a command wrote for ``rtsp run``. Only call this once the command has
+    returned without an error, or its tables would look up to date.
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param name: name of the command
+    :type name: str
+    :param before: result of ``start_command()``
+    :type before: dict
+    :param tables: only maintain these "schema.table" names, defaults to every table
+    :type tables: list, optional
+    :param written: what the command returned: the tables it wrote, as named in
+                    ``PIPELINE_STEPS``, or None if it wrote all of them
+    :type written: list, optional
+    """
+    from regional_transit_screening_platform.step_00_helpers.indexes import run_maintenance
+    from regional_transit_screening_platform.step_00_helpers.pipeline import record_outputs
+
+    if name in NO_MAINTENANCE:
+        return
+
+    run_maintenance(db, before, tables=tables)
+    record_outputs(db, name, tables=written)
+
+
 @click.group()
-def main():
+@click.option(
+    "--explain-threshold",
+    type=float,
+    default=None,
+    help="Capture query plans for statements slower than this many seconds"
+    " (queries are run again with EXPLAIN ANALYZE, writes only get EXPLAIN)",
+)
+@click.option(
+    "--staging",
+    is_flag=True,
+    help="Write intermediate tables UNLOGGED to the scratch schema (use on every step of a run)",
+)
+@click.option(
+    "--run-log",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Save stage timings and a per-statement summary to this JSON file",
+)
+def main(explain_threshold, staging, run_log):
     """RTSP allows command-line execution of the analysis. """
-    pass
-
-
-main.add_command(cmd_01.db_setup_from_shp)
-main.add_command(cmd_01.db_import_osm)
-main.add_command(cmd_01.db_import_from_daisy_db)
-main.add_command(cmd_01.db_feature_engineering)
-# main.add_command(cmd_01.db_scrape_septa_report)
-main.add_command(cmd_02.speed_match_osm)
-main.add_command(cmd_02.speed_analysis)
-main.add_command(cmd_05.ridership_match_osm_w_septa)
-main.add_command(cmd_05.ridership_match_osm_w_njt)
-main.add_command(cmd_05.ridership_analysis)
+
+    # The options are applied by in_stage(), once the command's own
+    # arguments have been parsed. click runs this before that, so setting
+    # up the database here would connect even for ``rtsp <cmd> --help``
+
+
+def run_command(db, command: click.Command, ctx: click.Context, tables: list = None):
+    """
+    Run a command's callback as one stage: take the index snapshot first,
+    then add registered indexes, fresh statistics and the ``rtsp run``
+    record once it returns without an error.
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param command: the command to run
+    :type command: click.Command
+    :param ctx: the command's context, with its arguments already parsed
+    :type ctx: click.Context
+    :param tables: passed on to ``finish_command()``, defaults to None
+    :type tables: list, optional
+    :return: what the command returned
+    """
+    name = ctx.info_name
+
+    with db.stage(name, profile=COMMAND_PROFILES.get(name)):
+        before = start_command(db, name)
+        written = ctx.invoke(command.callback, **ctx.params)
+
+        # Not reached if the command raised
+        finish_command(db, name, before, tables=tables, written=written)
+
+    return written
+
+
+def in_stage(command: click.Command) -> click.Command:
+    """
+    Set up the database for a command only when it actually runs.
+
+    click calls ``command.invoke()`` after the command's arguments are
+    parsed, so ``--help`` (or a bad option) exits before anything connects.
+    The group's options are applied, the command runs through
+    ``run_command()``, and the timings are saved once it finishes (or fails).
+    Invoking the command on its own, outside of ``main``, works as before.
+
+    :param command: a command to add to ``main``
+    :type command: click.Command
+    :return: the same command
+    :rtype: click.Command
+    """
+    invoke_alone = command.invoke
+
+    def invoke(ctx):
+        if ctx.parent is None or ctx.parent.command is not main:
+            return invoke_alone(ctx)
+
+        from regional_transit_screening_platform import db
+
+        options = ctx.find_root().params
+        db.metrics.explain_threshold = options["explain_threshold"]
+        db.STAGING = options["staging"]
+
+        try:
+            return run_command(db, command, ctx)
+        finally:
+            db.write_metrics(run_log=options["run_log"])
+
+    command.invoke = invoke
+    return command
+
+
+@click.command()
+def db_clean_scratch():
+    """Drop the scratch schema and every intermediate table in it"""
+    from regional_transit_screening_platform import db
+
+    db.clean_scratch()
+
+
+@click.command()
+@click.option(
+    "--workers",
+    default=2,
+    show_default=True,
+    help="Number of steps run at the same time",
+)
+@click.option("--force", is_flag=True, help="Run every step, even the ones that are up to date")
+@click.option("--dry-run", is_flag=True, help="Only show which steps would run, and why")
+@click.option(
+    "--keep-scratch",
+    is_flag=True,
+    help="Don't drop the scratch schema at the end of a --staging run",
+)
+@click.pass_context
+def run(ctx, workers, force, dry_run, keep_scratch):
+    """Run every step of the analysis that isn't up to date"""
+    from regional_transit_screening_platform import db
+    from regional_transit_screening_platform.step_00_helpers.pipeline import run_pipeline
+
+    # Each step gets its own context, since the steps can run in different threads
+    # (the timings are saved once, when ``run`` itself finishes)
+    def run_step(name, tables):
+        command = main.get_command(ctx.parent, name)
+        with command.make_context(name, [], parent=ctx.parent) as step_ctx:
+            run_command(db, command, step_ctx, tables=tables)
+
+    run_pipeline(db, run_step, workers=workers, dry_run=dry_run, force=force)
+
+    if db.STAGING and not dry_run and not keep_scratch:
+        db.clean_scratch()
+
+
+main.add_command(in_stage(db_clean_scratch))
+main.add_command(in_stage(run))
+main.add_command(in_stage(cmd_01.db_setup_from_shp))
+main.add_command(in_stage(cmd_01.db_import_osm))
+main.add_command(in_stage(cmd_01.db_import_from_daisy_db))
+main.add_command(in_stage(cmd_01.db_feature_engineering))
+main.add_command(in_stage(cmd_01.db_scrape_septa_report))
+main.add_command(in_stage(cmd_02.speed_match_osm))
+main.add_command(in_stage(cmd_02.speed_analysis))
+main.add_command(in_stage(cmd_05.ridership_match_osm_w_septa))
+main.add_command(in_stage(cmd_05.ridership_match_osm_w_njt))
+main.add_command(in_stage(cmd_05.ridership_analysis))
+main.add_command(in_stage(cmd_05.ridership_combine_loads))
+main.add_command(in_stage(cmd_05.ridership_assign_loads))
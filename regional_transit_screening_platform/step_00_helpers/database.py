@@ -6,18 +6,66 @@ It is included here (instead of listed as a dependency) to keep this
 project as stand-alone as possible, and also to serve as a teaching
 tool for DVRPC team members.
 """
+import io
+import itertools
+import json
+import re
+import threading
+import uuid
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import sqlalchemy
 from geoalchemy2 import Geometry, WKTElement
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyogrio
+import shapely
 
 from typing import Union
 from pathlib import Path
 
+from .metrics import QueryMetrics
+from .query_cache import QueryCache
+
+
+# Session settings for the kinds of work the pipeline does.
+# A stage picks one with ``db.stage(name, profile=...)``, and every
+# connection it checks out runs with these settings until it's returned.
+TUNING_PROFILES = {
+    # COPY and large INSERT ... SELECT: skip waiting on the WAL flush,
+    # and leave memory for the index builds that follow
+    "bulk-load": {
+        "work_mem": "64MB",
+        "maintenance_work_mem": "1GB",
+        "max_parallel_workers_per_gather": 0,
+        "synchronous_commit": "off",
+    },
+    # ST_DWithin / ST_Intersects joins and large sorts & hashes
+    "spatial-join": {
+        "work_mem": "256MB",
+        "maintenance_work_mem": "256MB",
+        "max_parallel_workers_per_gather": 4,
+        "synchronous_commit": "on",
+    },
+    # CREATE INDEX, ALTER TABLE ... TYPE and ANALYZE
+    "index-build": {
+        "work_mem": "64MB",
+        "maintenance_work_mem": "2GB",
+        "max_parallel_workers_per_gather": 2,
+        "synchronous_commit": "on",
+    },
+}
+
+# Every setting that any profile touches, so they can all be reset together
+TUNED_SETTINGS = sorted({param for profile in TUNING_PROFILES.values() for param in profile})
+
 
 class PostgreSQL:
     """
@@ -29,6 +77,20 @@ class PostgreSQL:
         - host & port
         - superusername & password
         - the SQL cluster's master database
+
+    Connections are borrowed from a bounded pool, and ``pandas`` reads/writes
+    share one long-lived ``sqlalchemy`` engine. Pass ``use_pool=False`` to
+    open (and close) a fresh connection for every call instead.
+    Use ``with db.transaction():`` to run several statements on a single
+    connection and commit them together.
+    Pass a ``QueryCache`` (or call ``enable_query_cache()``) to let reads
+    with ``cache=True`` reuse results saved on disk.
+    Every call is timed into ``db.metrics``; wrap the steps of a run in
+    ``with db.stage(name):`` and save the results with ``write_metrics()``.
+    Pass ``profile=`` to a stage to run it with one of the ``TUNING_PROFILES``.
+    With ``staging=True``, tables resolved through ``intermediate()`` are
+    written UNLOGGED to a scratch schema, and deliverables are moved out of
+    it with ``promote_table()``.
     """
 
     def __init__(
@@ -43,6 +105,12 @@ class PostgreSQL:
         active_schema: str = "public",
         super_un=None,
         super_pw=None,
+        pool_size: int = 5,
+        use_pool: bool = True,
+        query_cache: QueryCache = None,
+        explain_threshold: float = None,
+        staging: bool = False,
+        scratch_schema: str = "scratch",
     ):
 
         self.DATABASE = working_db
@@ -64,6 +132,32 @@ class PostgreSQL:
 
         self.ACTIVE_SCHEMA = active_schema
 
+        self.POOL_SIZE = pool_size
+        self.USE_POOL = use_pool
+
+        # Intermediate tables go to an UNLOGGED scratch schema in staging mode
+        self.STAGING = staging
+        self.SCRATCH_SCHEMA = scratch_schema
+        self._scratch_ready = False
+
+        # The pool and engine are created the first time they're needed
+        self._pool = None
+        self._engine = None
+        self._pool_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(pool_size)
+
+        # Tracks the connection of an open transaction, per thread
+        self._local = threading.local()
+
+        # Names of the statements prepared on each connection: {conn: {name: query}}
+        self._prepared = weakref.WeakKeyDictionary()
+
+        # Optional on-disk cache for query_as_df / query_as_geo_df
+        self.query_cache = query_cache
+
+        # Timing of every call, plus plans for calls slower than explain_threshold
+        self.metrics = QueryMetrics(explain_threshold=explain_threshold)
+
         if not self.exists():
             print(f"!!! WARNING !!!\n\t--> Database '{working_db}' does not exist on {host}")
 
@@ -98,6 +192,145 @@ class PostgreSQL:
 
         return connection_string
 
+    @property
+    def pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """
+        Bounded pool of ``psycopg2`` connections to the working database
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                # psycopg2 closes returned connections beyond ``minconn``,
+                # so keep the full pool open to actually reuse them
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.POOL_SIZE, self.POOL_SIZE, self.uri()
+                )
+        return self._pool
+
+    @property
+    def engine(self) -> sqlalchemy.engine.Engine:
+        """
+        Long-lived ``sqlalchemy`` engine for the working database.
+        Without pooling, the engine connects on every use.
+        """
+        with self._pool_lock:
+            if self._engine is None:
+                if self.USE_POOL:
+                    self._engine = sqlalchemy.create_engine(
+                        self.uri(),
+                        pool_size=self.POOL_SIZE,
+                        max_overflow=0,
+                        pool_pre_ping=True,
+                    )
+                else:
+                    self._engine = sqlalchemy.create_engine(
+                        self.uri(), poolclass=sqlalchemy.pool.NullPool
+                    )
+
+                sqlalchemy.event.listen(self._engine, "checkout", self._on_engine_checkout)
+                sqlalchemy.event.listen(self._engine, "checkin", self._on_engine_checkin)
+
+        return self._engine
+
+    @property
+    def in_transaction(self) -> bool:
+        """
+        Is this thread inside a ``with db.transaction():`` block?
+        """
+        return getattr(self._local, "connection", None) is not None
+
+    @contextmanager
+    def connection(self, super_uri: bool = False):
+        """
+        Borrow a ``psycopg2`` connection for the duration of a ``with`` block.
+
+        Inside a transaction this yields the transaction's connection.
+        Otherwise the connection comes from the pool (and waits for a
+        free slot if all are in use), or is opened fresh when pooling is
+        off or ``super_uri`` is True.
+
+        :param super_uri: connect to the super db/user, defaults to False
+        :type super_uri: bool, optional
+        """
+
+        if self.in_transaction and not super_uri:
+            yield self._local.connection
+            return
+
+        if super_uri or not self.USE_POOL:
+            connection = psycopg2.connect(self.uri(super_uri=super_uri))
+            try:
+                if not super_uri:
+                    self._apply_tuning(connection, self.active_profile)
+                yield connection
+            finally:
+                connection.close()
+            return
+
+        self._pool_slots.acquire()
+        try:
+            connection = self.pool.getconn()
+        except Exception:
+            # Nothing was borrowed, so give the slot back
+            self._pool_slots.release()
+            raise
+
+        tuned = False
+        try:
+            tuned = self._apply_tuning(connection, self.active_profile)
+            yield connection
+        finally:
+            # Hand back a clean connection: drop anything left uncommitted,
+            # and put the session settings back to the server defaults
+            if not connection.closed:
+                connection.rollback()
+                if tuned:
+                    self._reset_tuning(connection)
+            self.pool.putconn(connection, close=bool(connection.closed))
+            self._pool_slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run several statements on one connection as a single transaction.
+
+        Calls to ``execute()`` and the ``query_*()`` helpers made inside
+        the block share the connection. Everything is committed when the
+        block exits, or rolled back if it raises. Nested blocks join the
+        outer transaction.
+
+        Usage:
+            with db.transaction():
+                db.execute(...)
+                db.execute(...)
+        """
+
+        if self.in_transaction:
+            yield self._local.connection
+            return
+
+        with self.connection() as connection:
+            self._local.connection = connection
+            try:
+                yield connection
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                self._local.connection = None
+
+    def close(self) -> None:
+        """
+        Close all pooled connections and dispose of the engine
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            if self._engine is not None:
+                self._engine.dispose()
+                self._engine = None
+
     def exists(self) -> bool:
         """
         Does this database exist yet? Returns True or False
@@ -149,7 +382,7 @@ class PostgreSQL:
     # Make a permanent change to the database
     # ---------------------------------------
 
-    def execute(self, query: str, autocommit: bool = False):
+    def execute(self, query: str, autocommit: bool = False, params: tuple = None):
         """
         Execute a query for a persistent result in the database.
         Use ``autocommit=True`` when creating and deleting databases.
@@ -159,6 +392,9 @@ class PostgreSQL:
         :param autocommit: flag that will execute against the
                            super db/user, defaults to False
         :type autocommit: bool, optional
+        :param params: values for any ``%s`` placeholders in the query,
+                       defaults to None
+        :type params: tuple, optional
         """
 
         # print("... executing ...\n")
@@ -166,24 +402,36 @@ class PostgreSQL:
         # if len(query) < 5000:
         #     print(query)
 
-        uri = self.uri(super_uri=autocommit)
-
-        connection = psycopg2.connect(uri)
         if autocommit:
+            connection = psycopg2.connect(self.uri(super_uri=True))
             connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
 
-        cursor = connection.cursor()
+            with self.metrics.timed(query, "execute") as record:
+                cursor = connection.cursor()
+                cursor.execute(query, params)
+                record["rows"] = cursor.rowcount
+                cursor.close()
+
+            connection.close()
+            return
 
-        cursor.execute(query)
+        with self._timed(query, "execute", params=params) as record:
+            with self.connection() as connection:
+                cursor = connection.cursor()
 
-        cursor.close()
-        connection.commit()
-        connection.close()
+                cursor.execute(query, params)
+                record["rows"] = cursor.rowcount
+
+                cursor.close()
+
+                # Inside a transaction, the commit happens when the block exits
+                if not self.in_transaction:
+                    connection.commit()
 
     # Extract data from the database in a variety of formats
     # ------------------------------------------------------
 
-    def query_as_list(self, query: str, super_uri: bool = False) -> list:
+    def query_as_list(self, query: str, super_uri: bool = False, params: tuple = None) -> list:
         """
         Query the database and get the result as a ``list``
         :param query: any valid SQL query string
@@ -191,25 +439,29 @@ class PostgreSQL:
         :param super_uri: flag that will execute against the
                           super db/user, defaults to False
         :type super_uri: bool, optional
+        :param params: values for any ``%s`` placeholders in the query,
+                       defaults to None
+        :type params: tuple, optional
         :return: list with each item being a row from the query result
         :rtype: list
         """
-        uri = self.uri(super_uri=super_uri)
-
-        connection = psycopg2.connect(uri)
+        with self._timed(query, "query", params=params, super_uri=super_uri) as record:
+            with self.connection(super_uri=super_uri) as connection:
+                cursor = connection.cursor()
 
-        cursor = connection.cursor()
+                cursor.execute(query, params)
 
-        cursor.execute(query)
+                result = cursor.fetchall()
 
-        result = cursor.fetchall()
+                cursor.close()
 
-        cursor.close()
-        connection.close()
+            record["rows"] = len(result)
 
         return result
 
-    def query_as_df(self, query: str, super_uri: bool = False) -> pd.DataFrame:
+    def query_as_df(
+        self, query: str, super_uri: bool = False, cache: bool = False
+    ) -> pd.DataFrame:
         """
         Query the database and get the result as a ``pandas.DataFrame``
         :param query: any valid SQL query string
@@ -217,19 +469,48 @@ class PostgreSQL:
         :param super_uri: flag that will execute against the
                           super db/user, defaults to False
         :type super_uri: bool, optional
+        :param cache: reuse a saved result if none of the tables the
+                      query reads have changed, defaults to False
+        :type cache: bool, optional
         :return: dataframe with the query result
         :rtype: pd.DataFrame
         """
 
-        uri = self.uri(super_uri=super_uri)
+        key = None
+        if cache and self._can_use_cache(super_uri):
+            key = self.query_cache.key(query, self._table_state(query))
+            df = self.query_cache.get(key)
+            if df is not None:
+                return df
+
+        with self._timed(query, "query_df", super_uri=super_uri) as record:
+            if super_uri:
+                engine = sqlalchemy.create_engine(self.uri(super_uri=True))
+                df = pd.read_sql(query, engine)
+                engine.dispose()
+
+            # pandas can't read through a raw psycopg2 connection,
+            # so build the dataframe from the transaction's cursor
+            elif self.in_transaction:
+                cursor = self._local.connection.cursor()
+                cursor.execute(query)
+                columns = [col[0] for col in cursor.description]
+                df = pd.DataFrame(cursor.fetchall(), columns=columns)
+                cursor.close()
+
+            else:
+                df = pd.read_sql(query, self.engine)
+
+            record["rows"] = len(df)
 
-        engine = sqlalchemy.create_engine(uri)
-        df = pd.read_sql(query, engine)
-        engine.dispose()
+        if key:
+            self.query_cache.put(key, df)
 
         return df
 
-    def query_as_geo_df(self, query: str, geom_col: str = "geom") -> gpd.GeoDataFrame:
+    def query_as_geo_df(
+        self, query: str, geom_col: str = "geom", cache: bool = False
+    ) -> gpd.GeoDataFrame:
         """
         Query the database and get the result as a ``geopandas.GeoDataFrame``
         :param query: any valid SQL query string
@@ -237,18 +518,496 @@ class PostgreSQL:
         :param geom_col: name of the column that holds the geometry,
                          defaults to 'geom'
         :type geom_col: str
+        :param cache: reuse a saved result if none of the tables the
+                      query reads have changed, defaults to False
+        :type cache: bool, optional
         :return: geodataframe with the query result
         :rtype: gpd.GeoDataFrame
         """
 
-        connection = psycopg2.connect(self.uri())
+        key = None
+        if cache and self._can_use_cache():
+            key = self.query_cache.key(query, self._table_state(query), geom_col=geom_col)
+            gdf = self.query_cache.get(key, geo=True)
+            if gdf is not None:
+                return gdf
 
-        gdf = gpd.GeoDataFrame.from_postgis(query, connection, geom_col=geom_col)
+        with self._timed(query, "query_geo_df") as record, self.connection() as connection:
+            gdf = gpd.GeoDataFrame.from_postgis(query, connection, geom_col=geom_col)
+            record["rows"] = len(gdf)
 
-        connection.close()
+        if key:
+            self.query_cache.put(key, gdf)
 
         return gdf
 
+    # Staging mode: intermediate tables in an UNLOGGED scratch schema
+    # ---------------------------------------------------------------
+
+    def _split_table_name(self, table_name: str, schema: str = None) -> tuple:
+        """
+        Accept either ``table_name`` + ``schema``, or a "schema.table" name
+
+        :return: (table_name, schema)
+        :rtype: tuple
+        """
+        if schema is None and "." in table_name:
+            schema, table_name = table_name.split(".", 1)
+
+        return table_name, schema or self.ACTIVE_SCHEMA
+
+    def intermediate(self, table_name: str) -> str:
+        """
+        Get the name to use for an intermediate table.
+
+        Outside of staging mode the name is returned as-is. In staging mode
+        the table is moved to the scratch schema, with its original schema
+        kept as a prefix, e.g. "ridership.lrid_portions" becomes
+        "scratch.ridership_lrid_portions".
+
+        :param table_name: "table" or "schema.table"
+        :type table_name: str
+        :return: the name to use in SQL
+        :rtype: str
+        """
+        if not self.STAGING:
+            return table_name
+
+        # Hand-written SQL can't create tables in a schema that doesn't exist yet
+        if not self._scratch_ready:
+            self.add_schema(self.SCRATCH_SCHEMA)
+            self._scratch_ready = True
+
+        return f"{self.SCRATCH_SCHEMA}.{table_name.replace('.', '_')}"
+
+    @property
+    def unlogged(self) -> str:
+        """
+        Keyword for hand-written ``CREATE ... TABLE`` statements that
+        make intermediate tables, e.g. ``f"CREATE {db.unlogged} TABLE ..."``
+        """
+        return "UNLOGGED" if self.STAGING else ""
+
+    def analyze_scratch_tables(self) -> None:
+        """
+        ANALYZE every table in the scratch schema that has no statistics yet.
+        Run this after hand-written SQL that creates intermediate tables.
+        """
+        if not self.STAGING:
+            return
+
+        query = f"""
+            SELECT relname
+            FROM pg_stat_user_tables
+            WHERE schemaname = '{self.SCRATCH_SCHEMA}'
+              AND last_analyze IS NULL
+              AND last_autoanalyze IS NULL
+        """
+        for (table_name,) in self.query_as_list(query):
+            self.execute(f'ANALYZE {self.SCRATCH_SCHEMA}."{table_name}";')
+
+    def promote_table(self, table_name: str, new_table_name: str, schema: str = None) -> None:
+        """
+        Turn a scratch table into a permanent, logged table.
+        Any existing table with the new name is replaced.
+        Nothing happens outside of staging mode.
+
+        :param table_name: "scratch.table" name given by ``intermediate()``
+        :type table_name: str
+        :param new_table_name: final name of the table
+        :type new_table_name: str
+        :param schema: final schema of the table, defaults to the active schema
+        :type schema: str, optional
+        """
+        if not self.STAGING:
+            return
+
+        scratch_table, _ = self._split_table_name(table_name)
+        new_table_name, schema = self._split_table_name(new_table_name, schema)
+
+        print(f"\t -> Promoting {table_name} to {schema}.{new_table_name}")
+
+        with self.transaction():
+            self.execute(
+                f"""
+                DROP TABLE IF EXISTS {schema}.{new_table_name};
+                ALTER TABLE {self.SCRATCH_SCHEMA}.{scratch_table} SET LOGGED;
+                ALTER TABLE {self.SCRATCH_SCHEMA}.{scratch_table} SET SCHEMA {schema};
+            """
+            )
+            if scratch_table != new_table_name:
+                self.execute(
+                    f"ALTER TABLE {schema}.{scratch_table} RENAME TO {new_table_name};"
+                )
+
+    def clean_scratch(self) -> None:
+        """
+        Drop the scratch schema and every intermediate table in it
+        """
+        print("-" * 80, f"\nDROPPING SCRATCH SCHEMA: {self.SCRATCH_SCHEMA}")
+        self.execute(f"DROP SCHEMA IF EXISTS {self.SCRATCH_SCHEMA} CASCADE;")
+        self._scratch_ready = False
+
+    # Timing & query plans
+    # --------------------
+
+    @contextmanager
+    def stage(self, name: str, profile: str = None):
+        """
+        Group every call made inside the block under a named stage,
+        and record how long the whole stage took.
+
+        Usage:
+            with db.stage("feature_engineering", profile="spatial-join"):
+                ...
+
+        :param name: name of the stage
+        :type name: str
+        :param profile: key of ``TUNING_PROFILES`` to run the stage with,
+                        defaults to None (keep the current settings)
+        :type profile: str, optional
+        """
+        with self.tuning_profile(profile):
+            with self.metrics.stage(name, profile=self.active_profile) as stage:
+                yield stage
+
+    # Session tuning
+    # --------------
+
+    @property
+    def active_profile(self) -> str:
+        """
+        Name of the tuning profile in effect for this thread, if any
+        """
+        return getattr(self._local, "profile", None)
+
+    @contextmanager
+    def tuning_profile(self, profile: str = None):
+        """
+        Apply one of the ``TUNING_PROFILES`` to every connection checked
+        out inside the block. Passing None keeps whatever is active.
+
+        A transaction that's already open keeps the settings it started with.
+
+        :param profile: key of ``TUNING_PROFILES``
+        :type profile: str, optional
+        """
+
+        if profile is None:
+            yield
+            return
+
+        if profile not in TUNING_PROFILES:
+            raise ValueError(
+                f"Unknown tuning profile '{profile}'. Options are: {list(TUNING_PROFILES)}"
+            )
+
+        previous = self.active_profile
+        self._local.profile = profile
+        print(f"\t -> Tuning profile: {profile}")
+        try:
+            yield
+        finally:
+            self._local.profile = previous
+
+    @staticmethod
+    def _apply_tuning(connection, profile: str) -> bool:
+        """
+        Set a profile's session settings on a DB-API connection.
+        The change is committed so a later rollback doesn't undo it.
+
+        :return: True if any settings were changed
+        :rtype: bool
+        """
+        if profile is None:
+            return False
+
+        cursor = connection.cursor()
+        for param, value in TUNING_PROFILES[profile].items():
+            cursor.execute("SELECT set_config(%s, %s, false)", (param, str(value)))
+        cursor.close()
+        connection.commit()
+
+        return True
+
+    @staticmethod
+    def _reset_tuning(connection) -> None:
+        """
+        Put every tuned setting back to the server default
+        """
+        cursor = connection.cursor()
+        cursor.execute("; ".join(f"RESET {param}" for param in TUNED_SETTINGS))
+        cursor.close()
+        connection.commit()
+
+    def _on_engine_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        """
+        ``sqlalchemy`` pool event: tune connections used by ``pandas``
+        """
+        if self._apply_tuning(dbapi_connection, self.active_profile):
+            connection_record.info["tuned"] = True
+
+    def _on_engine_checkin(self, dbapi_connection, connection_record):
+        """
+        ``sqlalchemy`` pool event: reset connections on their way back to the pool
+        """
+        if dbapi_connection is not None and connection_record.info.pop("tuned", False):
+            self._reset_tuning(dbapi_connection)
+
+    @contextmanager
+    def _timed(self, query: str, kind: str, params: tuple = None, **kwargs):
+        """
+        Time a call, then capture its plan if it ran longer than
+        ``metrics.explain_threshold``. Keyword arguments are passed on
+        to ``_explain()``.
+        """
+        with self.metrics.timed(query, kind) as record:
+            yield record
+
+        if self.metrics.should_explain(record):
+            record["plan"] = self._explain(query, params, **kwargs)
+
+    def _explain(
+        self, query: str, params: tuple = None, super_uri: bool = False, prepared_name: str = None
+    ):
+        """
+        Capture the plan of a statement that already ran.
+
+        Queries get ``EXPLAIN (ANALYZE, BUFFERS)``, which runs them a second
+        time, so this happens on its own connection and is always rolled back.
+        Writes (``INSERT``/``UPDATE``/``DELETE`` and ``CREATE TABLE ... AS``,
+        for which the plan of the ``SELECT`` is captured) only get a plain
+        ``EXPLAIN``, so a slow write isn't paid for twice. Scripts with several
+        statements, other DDL, and calls made inside ``db.transaction()``
+        (whose uncommitted tables the second connection can't see) are skipped.
+
+        :return: the plan as parsed JSON, or None if it was skipped or failed
+        """
+
+        if super_uri or self.in_transaction:
+            return None
+
+        statement = query.strip().rstrip(";").strip()
+        if ";" in statement:
+            return None
+
+        create_table_as = re.match(
+            r"create\s+(?:unlogged\s+)?table\s+(?:if\s+not\s+exists\s+)?\S+\s+as\s+(.*)",
+            statement,
+            flags=re.I | re.S,
+        )
+        if create_table_as:
+            statement = create_table_as.group(1)
+
+        if not re.match(r"\(*\s*(select|with|insert|update|delete|values)\b", statement, re.I):
+            return None
+
+        writes = create_table_as or re.match(r"\(*\s*(insert|update|delete)\b", statement, re.I)
+        options = "FORMAT JSON" if writes else "ANALYZE, BUFFERS, FORMAT JSON"
+
+        try:
+            with self.connection() as connection:
+                if prepared_name:
+                    self._prepare(connection, prepared_name, query)
+                    placeholders = ", ".join(["%s"] * len(params))
+                    statement = f"EXECUTE {prepared_name} ({placeholders})"
+
+                cursor = connection.cursor()
+                cursor.execute(f"EXPLAIN ({options}) {statement}", params)
+                plan = cursor.fetchone()[0]
+                cursor.close()
+                connection.rollback()
+
+        except psycopg2.Error as e:
+            print(f"\t -> Couldn't capture a plan: {e}".strip())
+            return None
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return plan
+
+    def write_metrics(
+        self,
+        run_log: Union[Path, str] = None,
+        table_name: str = "query_metrics",
+        schema: str = None,
+    ) -> None:
+        """
+        Append this run's call timings to a table in the database, and
+        optionally save a JSON run log with the stage timings, a summary
+        of each statement and any captured plans.
+
+        :param run_log: filepath for the JSON log, defaults to None
+        :type run_log: Union[Path, str], optional
+        :param table_name: table to append the timings to, defaults to "query_metrics"
+        :type table_name: str, optional
+        :param schema: schema of the metrics table, defaults to the active schema
+        :type schema: str, optional
+        """
+
+        if run_log:
+            self.metrics.write_run_log(run_log)
+            print(f"\t -> Run log saved to {run_log}")
+
+        # Only append calls that haven't been saved by an earlier write
+        df = self.metrics.to_dataframe(since=self.metrics.records_written)
+        self.metrics.records_written += len(df)
+
+        if not df.empty:
+            self.import_dataframe(df, table_name, if_exists="append", schema=schema, index=False)
+
+    # Result cache
+    # ------------
+
+    def enable_query_cache(self, cache_dir: Union[Path, str], max_bytes: int = 2 * 1024 ** 3):
+        """
+        Turn on the on-disk result cache used by ``cache=True`` reads.
+
+        :param cache_dir: folder to hold the cached results
+        :type cache_dir: Union[Path, str]
+        :param max_bytes: size cap for the folder, defaults to 2 GB
+        :type max_bytes: int, optional
+        """
+        self.query_cache = QueryCache(cache_dir, max_bytes=max_bytes)
+
+    def _can_use_cache(self, super_uri: bool = False) -> bool:
+        """
+        The cache is skipped when it isn't set up, for the super db,
+        and inside a transaction (uncommitted writes don't show up
+        in the table statistics the cache key is built from).
+        """
+        return self.query_cache is not None and not super_uri and not self.in_transaction
+
+    def _table_state(self, query: str) -> list:
+        """
+        Find the tables a query reads and get their current modification state.
+
+        The tables come from the query plan, so views are resolved to the
+        tables underneath them. A table's state changes whenever rows are
+        inserted, updated or deleted, or when it is rewritten / replaced.
+
+        :param query: any valid SQL query string
+        :type query: str
+        :return: sorted list of [schema, table, oid, relfilenode, ins, upd, del]
+        :rtype: list
+        """
+
+        # Plan nodes only include the "Schema" key with VERBOSE. Without it,
+        # raw.*, ridership.* etc. would be looked up in the active schema
+        plan = self.query_as_single_item(f"EXPLAIN (VERBOSE, FORMAT JSON) {query}")
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        tables = set()
+
+        def walk(node):
+            if isinstance(node, dict):
+                if "Relation Name" in node:
+                    tables.add((node["Schema"], node["Relation Name"]))
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(plan)
+
+        if not tables:
+            return []
+
+        schemas, names = zip(*sorted(tables))
+
+        state = self.query_as_list(
+            """
+            SELECT n.nspname, c.relname, c.oid, c.relfilenode,
+                   coalesce(s.n_tup_ins, 0),
+                   coalesce(s.n_tup_upd, 0),
+                   coalesce(s.n_tup_del, 0)
+            FROM unnest(%s::text[], %s::text[]) AS t(nspname, relname)
+            JOIN pg_namespace n ON n.nspname = t.nspname
+            JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.relname
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        """,
+            params=(list(schemas), list(names)),
+        )
+
+        return sorted([list(row) for row in state])
+
+    def query_as_geo_df_chunks(
+        self, query: str, geom_col: str = "geom", chunk_size: int = 10000
+    ):
+        """
+        Query the database and get the result as a stream of
+        ``geopandas.GeoDataFrame`` chunks, so that large tables can be
+        processed without holding everything in memory at once.
+
+        Rows are fetched through a named (server-side) cursor, and each
+        chunk's geometries are sent as binary EWKB and decoded together.
+        The connection is held until the generator is exhausted.
+
+        Usage:
+            for gdf in db.query_as_geo_df_chunks("SELECT * FROM osm_edges_drive"):
+                ...
+
+        :param query: any valid SQL query string
+        :type query: str
+        :param geom_col: name of the column that holds the geometry,
+                         defaults to 'geom'
+        :type geom_col: str
+        :param chunk_size: number of rows in each chunk, defaults to 10000
+        :type chunk_size: int, optional
+        :return: generator of geodataframes
+        """
+
+        query = query.strip().rstrip(";")
+        columns = self._query_columns(query)
+
+        select_list = ", ".join(
+            f'ST_AsEWKB(q."{col}") AS "{col}"' if col == geom_col else f'q."{col}"'
+            for col in columns
+        )
+
+        with self.connection() as connection:
+            cursor = connection.cursor(name=f"rtsp_{uuid.uuid4().hex}")
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {select_list} FROM ({query}) q")
+
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+
+                    df = pd.DataFrame(rows, columns=columns)
+
+                    wkb = np.array(
+                        [None if x is None else bytes(x) for x in df[geom_col]], dtype=object
+                    )
+                    geoms = shapely.from_wkb(wkb)
+
+                    # EWKB carries the SRID, so use it to set the CRS
+                    srids = shapely.get_srid(geoms[~shapely.is_missing(geoms)])
+                    crs = f"epsg:{srids[0]}" if len(srids) and srids[0] > 0 else None
+
+                    df[geom_col] = geoms
+                    yield gpd.GeoDataFrame(df, geometry=geom_col, crs=crs)
+            finally:
+                cursor.close()
+
+    def _query_columns(self, query: str) -> list:
+        """
+        Get the names of the columns that a query returns, without running it
+        """
+
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+            columns = [col[0] for col in cursor.description]
+            cursor.close()
+
+        return columns
+
     def query_as_single_item(self, query: str, super_uri: bool = False):
         """
         Query the database and get the result as a SINGLETON.
@@ -267,6 +1026,109 @@ class PostgreSQL:
 
         return result[0][0]
 
+    # Prepared statements, for queries that get run over and over
+    # ------------------------------------------------------------
+
+    def _prepare(self, connection, name: str, query: str) -> None:
+        """
+        Make sure ``name`` is prepared on this connection as ``query``.
+        Each connection only parses and plans the statement once.
+        """
+
+        prepared = self._prepared.setdefault(connection, {})
+
+        if prepared.get(name) == query:
+            return
+
+        cursor = connection.cursor()
+        if name in prepared:
+            cursor.execute(f"DEALLOCATE {name}")
+        cursor.execute(f"PREPARE {name} AS {query}")
+        cursor.close()
+
+        prepared[name] = query
+
+    def query_prepared(self, name: str, query: str, params: tuple) -> list:
+        """
+        Run a parameterized query as a named prepared statement and
+        get the result as a ``list``. Write the parameters in the query
+        as ``$1``, ``$2``, etc.
+
+        Usage:
+            db.query_prepared("speed_by_uid", "SELECT * FROM speed WHERE uid = $1", (uid,))
+
+        :param name: name for the prepared statement
+        :type name: str
+        :param query: SQL query with ``$n`` placeholders
+        :type query: str
+        :param params: values for the placeholders
+        :type params: tuple
+        :return: list with each item being a row from the query result
+        :rtype: list
+        """
+
+        placeholders = ", ".join(["%s"] * len(params))
+
+        with self._timed(query, "prepared", params=params, prepared_name=name) as record:
+            with self.connection() as connection:
+                self._prepare(connection, name, query)
+
+                cursor = connection.cursor()
+                cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+                result = cursor.fetchall() if cursor.description else []
+                record["rows"] = len(result) if cursor.description else cursor.rowcount
+                cursor.close()
+
+                if not self.in_transaction:
+                    connection.commit()
+
+        return result
+
+    def execute_batch(
+        self, name: str, query: str, params_list: list, page_size: int = 100
+    ) -> None:
+        """
+        Run a parameterized statement once for every set of parameters.
+        The statement is prepared once, and ``page_size`` executions are
+        sent to the server in each round trip.
+        Write the parameters in the query as ``$1``, ``$2``, etc.
+
+        Usage:
+            db.execute_batch(
+                "set_speed", "UPDATE osm_speed SET avgspeed = $1 WHERE uid = $2", updates
+            )
+
+        :param name: name for the prepared statement
+        :type name: str
+        :param query: SQL statement with ``$n`` placeholders
+        :type query: str
+        :param params_list: one tuple of values per execution
+        :type params_list: list
+        :param page_size: executions per round trip, defaults to 100
+        :type page_size: int, optional
+        """
+
+        if len(params_list) == 0:
+            return
+
+        placeholders = ", ".join(["%s"] * len(params_list[0]))
+
+        # A slow batch has the plan of its first execution captured
+        timed = self._timed(query, "batch", params=params_list[0], prepared_name=name)
+
+        with timed as record, self.connection() as connection:
+            self._prepare(connection, name, query)
+
+            cursor = connection.cursor()
+            psycopg2.extras.execute_batch(
+                cursor, f"EXECUTE {name} ({placeholders})", params_list, page_size=page_size
+            )
+            record["rows"] = len(params_list)
+            cursor.close()
+
+            if not self.in_transaction:
+                connection.commit()
+
     # IMPORT data into the database
     # -----------------------------
 
@@ -276,11 +1138,18 @@ class PostgreSQL:
         table_name: str,
         if_exists: str = "fail",
         schema: str = None,
+        index: bool = True,
+        use_copy: bool = True,
+        chunk_size: int = 50000,
+        dtype: dict = None,
     ) -> None:
         """
         Import an in-memory ``pandas.DataFrame`` to the SQL database.
         Enforce clean column names (without spaces, caps, or weird symbols).
 
+        By default the rows are streamed in with ``COPY ... FROM STDIN``.
+        Set ``use_copy=False`` to write with ``pandas.to_sql()`` instead.
+
         :param dataframe: dataframe with data you want to save
         :type dataframe: pd.DataFrame
         :param table_name: name of the table that will get created
@@ -288,27 +1157,42 @@ class PostgreSQL:
         :param if_exists: pandas argument to handle overwriting data,
                           defaults to "fail"
         :type if_exists: str, optional
+        :param index: write the dataframe's index as a column, defaults to True
+        :type index: bool, optional
+        :param use_copy: bulk load with ``COPY``, defaults to True
+        :type use_copy: bool, optional
+        :param chunk_size: number of rows sent per ``COPY``, defaults to 50000
+        :type chunk_size: int, optional
+        :param dtype: SQL types for specific columns, e.g. ``{"geom": Geometry(...)}``
+        :type dtype: dict, optional
         """
 
-        if not schema:
-            schema = self.ACTIVE_SCHEMA
+        table_name, schema = self._split_table_name(table_name, schema)
 
         print(f"\t -> SQL tablename: {schema}.{table_name}")
 
-        # Replace "Column Name" with "column_name"
-        dataframe.columns = dataframe.columns.str.replace(" ", "_")
-        dataframe.columns = [x.lower() for x in dataframe.columns]
-
-        # Remove '.' and '-' from column names.
-        # i.e. 'geo.display-label' becomes 'geodisplaylabel'
-        for s in [".", "-", "(", ")", "+", "%"]:
-            dataframe.columns = dataframe.columns.str.replace(s, "", regex=False)
+        self.clean_column_names(dataframe)
 
         # Write to database
         self.add_schema(schema)
-        engine = sqlalchemy.create_engine(self.uri())
-        dataframe.to_sql(table_name, engine, if_exists=if_exists, schema=schema)
-        engine.dispose()
+
+        if use_copy:
+            if index:
+                dataframe = dataframe.reset_index()
+            self._create_table_for_dataframe(dataframe, table_name, schema, if_exists, dtype)
+            self._copy_dataframe(dataframe, table_name, schema, chunk_size)
+        else:
+            dataframe.to_sql(
+                table_name,
+                self.engine,
+                if_exists=if_exists,
+                schema=schema,
+                index=index,
+                dtype=dtype,
+            )
+
+        if schema == self.SCRATCH_SCHEMA:
+            self.execute(f"ANALYZE {schema}.{table_name};")
 
     def import_geodataframe(
         self,
@@ -318,10 +1202,18 @@ class PostgreSQL:
         if_exists: str = "replace",
         schema: str = None,
         uid_col: str = "uid",
+        use_copy: bool = True,
+        chunk_size: int = 50000,
     ):
         """
         Import an in-memory ``geopandas.GeoDataFrame`` to the SQL database.
 
+        By default the geometries are converted to hex EWKB in one
+        vectorized pass and the rows are streamed in with ``COPY``.
+        Set ``use_copy=False`` to write ``WKTElement`` values with
+        ``pandas.to_sql()`` instead.
+        The uid column and spatial index are added once the data is loaded.
+
         :param gdf: geodataframe with data you want to save
         :type gdf: gpd.GeoDataFrame
         :param table_name: name of the table that will get created
@@ -335,15 +1227,17 @@ class PostgreSQL:
         :param if_exists: pandas argument to handle overwriting data,
                           defaults to "replace"
         :type if_exists: str, optional
+        :param use_copy: bulk load with ``COPY``, defaults to True
+        :type use_copy: bool, optional
+        :param chunk_size: number of rows sent per ``COPY``, defaults to 50000
+        :type chunk_size: int, optional
         """
         if not schema:
             schema = self.ACTIVE_SCHEMA
 
         # Read the geometry type. It's possible there are
         # both MULTIPOLYGONS and POLYGONS. This grabs the MULTI variant
-
-        geom_types = list(gdf.geometry.geom_type.unique())
-        geom_typ = max(geom_types, key=len).upper()
+        geom_typ = self._geometry_type(gdf)
 
         print(f"\t -> SQL tablename: {schema}.{table_name}")
         print(f"\t -> Geometry type: {geom_typ}")
@@ -351,19 +1245,69 @@ class PostgreSQL:
 
         start_time = datetime.now()
 
+        epsg_code = self._epsg_code(gdf, src_epsg)
+
+        self._load_geodataframe(
+            gdf, table_name, schema, epsg_code, geom_typ, if_exists, uid_col, use_copy, chunk_size
+        )
+
+        end_time = datetime.now()
+
+        runtime = end_time - start_time
+        print(f"\t -> ... import completed in {runtime}")
+
+        self.table_add_uid_column(table_name, schema=schema, uid_col=uid_col)
+        self.table_add_spatial_index(table_name, schema=schema)
+
+    @staticmethod
+    def _geometry_type(gdf: gpd.GeoDataFrame) -> str:
+        """
+        The longest geometry type name in the geodataframe,
+        so "MULTIPOLYGON" wins over "POLYGON"
+        """
+        geom_types = list(gdf.geometry.geom_type.unique())
+        return max(geom_types, key=len).upper()
+
+    @staticmethod
+    def _epsg_code(gdf: gpd.GeoDataFrame, src_epsg: Union[int, bool] = False) -> int:
+        """
+        Get the EPSG code of a geodataframe. If ``src_epsg`` is passed,
+        the geodataframe's CRS is overwritten with it first.
+        """
+
         # Manually set the EPSG if the user passes one
         if src_epsg:
             gdf.crs = f"epsg:{src_epsg}"
-            epsg_code = src_epsg
+            return src_epsg
 
         # Otherwise, try to get the EPSG value directly from the geodataframe
-        else:
-            # Older gdfs have CRS stored as a dict: {'init': 'epsg:4326'}
-            if type(gdf.crs) == dict:
-                epsg_code = int(gdf.crs["init"].split(" ")[0].split(":")[1])
-            # Now geopandas has a different approach
-            else:
-                epsg_code = int(str(gdf.crs).split(":")[1])
+        # Older gdfs have CRS stored as a dict: {'init': 'epsg:4326'}
+        if type(gdf.crs) == dict:
+            return int(gdf.crs["init"].split(" ")[0].split(":")[1])
+
+        # Now geopandas has a different approach. CRSs read back from
+        # GeoParquet are stored as PROJJSON, so ask pyproj for the code
+        if hasattr(gdf.crs, "to_epsg") and gdf.crs.to_epsg():
+            return gdf.crs.to_epsg()
+
+        return int(str(gdf.crs).split(":")[1])
+
+    def _load_geodataframe(
+        self,
+        gdf: gpd.GeoDataFrame,
+        table_name: str,
+        schema: str,
+        epsg_code: int,
+        geom_typ: str,
+        if_exists: str,
+        uid_col: str = "uid",
+        use_copy: bool = True,
+        chunk_size: int = 50000,
+    ) -> None:
+        """
+        Write the rows of a geodataframe to a table with a ``geom`` column of
+        ``geom_typ``. The uid column and spatial index are left to the caller.
+        """
 
         # Sanitize the columns before writing to the database
         # Make all column names lower case
@@ -372,44 +1316,127 @@ class PostgreSQL:
         # Replace the 'geom' column with 'geometry'
         if "geom" in gdf.columns:
             gdf["geometry"] = gdf["geom"]
-            gdf.drop("geom", 1, inplace=True)
+            gdf.drop("geom", axis=1, inplace=True)
 
         # Drop the 'gid' column
         if "gid" in gdf.columns:
-            gdf.drop("gid", 1, inplace=True)
+            gdf.drop("gid", axis=1, inplace=True)
 
         # Rename 'uid' to 'old_uid'
         if uid_col in gdf.columns:
             gdf[f"old_{uid_col}"] = gdf[uid_col]
-            gdf.drop(uid_col, 1, inplace=True)
+            gdf.drop(uid_col, axis=1, inplace=True)
 
-        # Build a 'geom' column using geoalchemy2
-        # and drop the source 'geometry' column
-        gdf["geom"] = gdf["geometry"].apply(lambda x: WKTElement(x.wkt, srid=epsg_code))
-        gdf.drop("geometry", 1, inplace=True)
+        geom_dtype = {"geom": Geometry(geom_typ, srid=epsg_code)}
 
         # Write geodataframe to SQL database
         self.add_schema(schema)
 
-        engine = sqlalchemy.create_engine(self.uri())
-        gdf.to_sql(
-            table_name,
-            engine,
-            if_exists=if_exists,
-            # index=True,
-            # index_label=uid_col,
-            schema=schema,
-            dtype={"geom": Geometry(geom_typ, srid=epsg_code)},
+        if use_copy:
+            # Build a 'geom' column of hex EWKB for every feature at once
+            # and drop the source 'geometry' column
+            geoms = shapely.set_srid(np.asarray(gdf["geometry"].values), epsg_code)
+            df = pd.DataFrame(gdf.drop("geometry", axis=1))
+            df["geom"] = shapely.to_wkb(geoms, hex=True, include_srid=True)
+            df = df.reset_index()
+
+            self._create_table_for_dataframe(df, table_name, schema, if_exists, dtype=geom_dtype)
+            self._copy_dataframe(df, table_name, schema, chunk_size)
+
+        else:
+            # Build a 'geom' column using geoalchemy2
+            # and drop the source 'geometry' column
+            gdf["geom"] = gdf["geometry"].apply(lambda x: WKTElement(x.wkt, srid=epsg_code))
+            gdf.drop("geometry", axis=1, inplace=True)
+
+            gdf.to_sql(
+                table_name,
+                self.engine,
+                if_exists=if_exists,
+                # index=True,
+                # index_label=uid_col,
+                schema=schema,
+                dtype=geom_dtype,
+            )
+
+    @staticmethod
+    def clean_column_names(dataframe: pd.DataFrame) -> None:
+        """
+        Make the dataframe's column names SQL-friendly, in place.
+        """
+
+        # Replace "Column Name" with "column_name"
+        dataframe.columns = dataframe.columns.str.replace(" ", "_")
+        dataframe.columns = [x.lower() for x in dataframe.columns]
+
+        # Remove '.' and '-' from column names.
+        # i.e. 'geo.display-label' becomes 'geodisplaylabel'
+        for s in [".", "-", "(", ")", "+", "%"]:
+            dataframe.columns = dataframe.columns.str.replace(s, "", regex=False)
+
+    def _create_table_for_dataframe(
+        self,
+        dataframe: pd.DataFrame,
+        table_name: str,
+        schema: str,
+        if_exists: str,
+        dtype: dict = None,
+    ) -> None:
+        """
+        Create an empty table that matches the dataframe's columns,
+        following the same ``if_exists`` rules as ``pandas.to_sql()``
+        """
+
+        exists = table_name in self.all_tables_as_list(schema=schema)
+
+        if exists and if_exists == "fail":
+            raise ValueError(f"Table '{schema}.{table_name}' already exists.")
+
+        if exists and if_exists == "append":
+            return
+
+        sql_create_table = pd.io.sql.get_schema(
+            dataframe, table_name, con=self.engine, schema=schema, dtype=dtype
         )
-        engine.dispose()
 
-        end_time = datetime.now()
+        if schema == self.SCRATCH_SCHEMA:
+            sql_create_table = sql_create_table.replace("CREATE TABLE", "CREATE UNLOGGED TABLE", 1)
 
-        runtime = end_time - start_time
-        print(f"\t -> ... import completed in {runtime}")
+        with self.transaction():
+            self.execute(f"DROP TABLE IF EXISTS {schema}.{table_name};")
+            self.execute(sql_create_table)
 
-        self.table_add_uid_column(table_name, schema=schema, uid_col=uid_col)
-        self.table_add_spatial_index(table_name, schema=schema)
+    def _copy_dataframe(
+        self, dataframe: pd.DataFrame, table_name: str, schema: str, chunk_size: int
+    ) -> None:
+        """
+        Stream the rows of a dataframe into an existing table
+        with ``COPY ... FROM STDIN``, ``chunk_size`` rows at a time.
+        Everything is committed together once the last chunk is sent.
+
+        Missing values are written as ``\\N``. In CSV format, COPY reads an
+        unquoted empty field as NULL by default, which would turn ``""`` into NULL.
+        """
+
+        columns = ", ".join(f'"{col}"' for col in dataframe.columns)
+        sql_copy = (
+            f"COPY {schema}.{table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        )
+
+        with self.metrics.timed(sql_copy, "copy") as record, self.transaction() as connection:
+            record["rows"] = len(dataframe)
+            cursor = connection.cursor()
+
+            for start in range(0, len(dataframe), chunk_size):
+                buffer = io.StringIO()
+                dataframe.iloc[start : start + chunk_size].to_csv(
+                    buffer, header=False, index=False, na_rep="\\N"
+                )
+                buffer.seek(0)
+
+                cursor.copy_expert(sql_copy, buffer)
+
+            cursor.close()
 
     def import_csv(
         self,
@@ -451,20 +1478,33 @@ class PostgreSQL:
         src_epsg: Union[int, bool] = False,
         if_exists: str = "fail",
         schema: str = None,
+        chunk_size: int = 100000,
+        dst_epsg: int = None,
     ):
         """
-        Load geographic data into a geodataframe, then save to SQL.
+        Stream geographic data into SQL, ``chunk_size`` features at a time.
+
+        Each batch is read, exploded to singlepart, optionally reprojected
+        and bulk-loaded before the next one is read, so memory use depends
+        on ``chunk_size`` instead of the size of the file. The uid column
+        and spatial index are added once every batch is in.
+
         :param table_name: Name of the table you want to create
         :type table_name: str
         :param data_path: Path to the data. Anything accepted by Geopandas
-                          works here.
+                          works here, as does a folder of GeoParquet parts.
         :type data_path: Path
         :param src_epsg: Manually declare the source EPSG if needed,
                          defaults to False
         :type src_epsg: Union[int, bool], optional
         :param if_exists: pandas argument to handle overwriting data,
-                          defaults to "replace"
+                          defaults to "fail"
         :type if_exists: str, optional
+        :param chunk_size: number of features read per batch, defaults to 100000
+        :type chunk_size: int, optional
+        :param dst_epsg: reproject each batch to this EPSG before loading,
+                         defaults to None (keep the source projection)
+        :type dst_epsg: int, optional
         """
 
         if not schema:
@@ -472,21 +1512,116 @@ class PostgreSQL:
 
         print("-" * 80, "\nLOAD GEODATA INTO DATABASE")
         print(f"\t -> Reading source file: {data_path.name}")
+        print(f"\t -> SQL tablename: {schema}.{table_name}")
 
-        # Read the data into a geodataframe
-        gdf = gpd.read_file(data_path)
+        start_time = datetime.now()
 
-        # Drop null geometries
-        gdf = gdf[gdf["geometry"].notnull()]
+        # The table is created from the first batch that has any geometries
+        epsg_code, geom_typ = None, None
+        features = 0
 
-        # Explode multipart to singlepart and reset the index
-        gdf = gdf.explode()
-        gdf["explode"] = gdf.index
-        gdf = gdf.reset_index()
+        for start, batch in self._read_geodata_batches(data_path, chunk_size):
 
-        self.import_geodataframe(
-            gdf, table_name, src_epsg=src_epsg, if_exists=if_exists, schema=schema
-        )
+            # Keep the feature numbers from the source file
+            batch.index = pd.RangeIndex(start, start + len(batch))
+
+            # Drop null geometries
+            batch = batch[batch["geometry"].notnull()]
+
+            if batch.empty:
+                continue
+
+            # Explode multipart to singlepart and reset the index
+            batch = batch.explode()
+            batch["explode"] = batch.index
+            batch = batch.reset_index()
+
+            source_epsg = self._epsg_code(batch, src_epsg)
+
+            if dst_epsg:
+                batch = batch.to_crs(epsg=dst_epsg)
+
+            # Later batches are appended to the table made by the first one
+            if epsg_code is None:
+                epsg_code = dst_epsg or source_epsg
+                geom_typ = self._geometry_type(batch)
+                batch_if_exists = if_exists
+
+                print(f"\t -> Geometry type: {geom_typ}")
+                print(f"\t -> Beginning DB import...")
+            else:
+                batch_if_exists = "append"
+
+            self._load_geodataframe(batch, table_name, schema, epsg_code, geom_typ, batch_if_exists)
+
+            features += len(batch)
+            print(f"\t -> ... {features} features loaded")
+
+        if epsg_code is None:
+            raise ValueError(f"{data_path.name} has no features with a geometry")
+
+        end_time = datetime.now()
+
+        runtime = end_time - start_time
+        print(f"\t -> ... import completed in {runtime}")
+
+        self.table_add_uid_column(table_name, schema=schema, uid_col="uid")
+        self.table_add_spatial_index(table_name, schema=schema)
+
+    @staticmethod
+    def _nullable_dtypes(dtypes: dict) -> dict:
+        """
+        Swap integer and boolean dtypes for pandas' nullable versions,
+        which can hold nulls without turning into floats / objects
+        """
+        nullable = {}
+        for col, dtype in dtypes.items():
+            dtype = str(dtype)
+            if dtype.startswith(("int", "uint")):
+                # "int32" -> "Int32"
+                nullable[col] = dtype[0].upper() + dtype[1:]
+            elif dtype == "bool":
+                nullable[col] = "boolean"
+        return nullable
+
+    @classmethod
+    def _read_geodata_batches(cls, data_path: Path, chunk_size: int):
+        """
+        Yield (position of the first feature, GeoDataFrame) for each batch of a file.
+        A folder is read as a set of GeoParquet parts, one part per batch.
+
+        Every batch is cast to one set of column types. Otherwise an integer
+        column with nulls only in a later batch would come back as float64,
+        and COPY would send "4.0" to the INTEGER column made from the first one.
+        For a file the types come from its field definitions. For a folder
+        they come from the first part.
+        """
+
+        if data_path.is_dir():
+            start = 0
+            dtypes = None
+            for part in sorted(data_path.glob("*.parquet")):
+                batch = gpd.read_parquet(part)
+
+                if dtypes is None:
+                    columns = batch.drop(columns=batch.geometry.name)
+                    dtypes = columns.dtypes.to_dict()
+                    dtypes.update(cls._nullable_dtypes(dtypes))
+
+                yield start, batch.astype(dtypes)
+                start += len(batch)
+            return
+
+        info = pyogrio.read_info(data_path)
+        dtypes = cls._nullable_dtypes(dict(zip(info["fields"], info["dtypes"])))
+
+        for start in itertools.count(0, chunk_size):
+            batch = gpd.read_file(data_path, rows=slice(start, start + chunk_size))
+
+            if batch.empty:
+                return
+
+            yield start, batch.astype(dtypes)
 
     # CREATE data within the database
     # -------------------------------
@@ -501,11 +1636,29 @@ class PostgreSQL:
         uid_col: str = "uid",
     ) -> None:
         """
-        TODO: docstring
+        Make a new spatial table from the result of a query.
+
+        The table is written in one pass: the ``CREATE TABLE AS`` emits the
+        serial ``uid`` and a ``geom`` column that is already typed with the
+        ``geom_type`` and ``epsg``. The primary key and spatial index are built
+        once the rows are in, the table is analyzed, and all of it happens
+        inside a single transaction.
+
+        :param query: SQL query with a column named 'geom'.
+                      Any existing ``uid_col`` column is replaced.
+        :type query: str
+        :param new_table_name: name of the table to create, optionally
+                               prefixed with its schema ("schema.table")
+        :type new_table_name: str
+        :param geom_type: PostGIS geometry type, e.g. "LINESTRING"
+        :type geom_type: str
+        :param epsg: EPSG code of the geometry
+        :type epsg: int
+        :param uid_col: name of the serial primary key, defaults to "uid"
+        :type uid_col: str, optional
         """
 
-        if not schema:
-            schema = self.ACTIVE_SCHEMA
+        new_table_name, schema = self._split_table_name(new_table_name, schema)
 
         print("-" * 80, "\nMAKE NEW TABLE VIA QUERY")
         print(f"\t -> SQL tablename: {new_table_name}")
@@ -530,19 +1683,49 @@ class PostgreSQL:
                 print(msg)
             return
 
-        sql_make_table_from_query = f"""
-            DROP TABLE IF EXISTS {schema}.{new_table_name};
-            CREATE TABLE {schema}.{new_table_name} AS
-            {query}
-        """
+        geom_type = geom_type.upper()
+        query = query.strip().rstrip(";")
 
-        self.execute(sql_make_table_from_query)
+        tbl = f"{schema}.{new_table_name}"
+        seq = f"{tbl}_{uid_col}_seq"
 
-        self.table_add_uid_column(new_table_name, schema=schema, uid_col=uid_col)
-        self.table_add_spatial_index(new_table_name, schema=schema)
-        self.table_reproject_spatial_data(
-            new_table_name, epsg, epsg, geom_type=geom_type.upper(), schema=schema
-        )
+        # Intermediate tables in the scratch schema skip the WAL
+        unlogged = "UNLOGGED" if schema == self.SCRATCH_SCHEMA else ""
+
+        # Run every step on one connection, committing once at the end
+        with self.transaction():
+
+            if schema == self.SCRATCH_SCHEMA:
+                self.add_schema(schema)
+
+            # Cast the geometry as it's written, instead of rewriting the table later
+            select_list = ", ".join(
+                f"ST_SetSRID(q.geom, {epsg})::geometry({geom_type}, {epsg}) AS geom"
+                if col == "geom"
+                else f'q."{col}"'
+                for col in self._query_columns(query)
+                if col != uid_col
+            )
+
+            sql_make_table_from_query = f"""
+                DROP TABLE IF EXISTS {tbl};
+                CREATE {unlogged} TABLE {tbl} AS
+                SELECT
+                    (row_number() OVER ())::integer AS {uid_col},
+                    {select_list}
+                FROM ({query}) q;
+
+                -- Give the uid the same default as a serial column
+                CREATE SEQUENCE {seq} OWNED BY {tbl}.{uid_col};
+                SELECT setval('{seq}', (SELECT coalesce(max({uid_col}), 0) + 1 FROM {tbl}), false);
+                ALTER TABLE {tbl} ALTER COLUMN {uid_col} SET DEFAULT nextval('{seq}');
+
+                ALTER TABLE {tbl} ADD PRIMARY KEY ({uid_col});
+                CREATE INDEX ON {tbl} USING GIST (geom);
+
+                ANALYZE {tbl};
+            """
+            self.execute(sql_make_table_from_query)
 
     # TABLE-level operations
     # ----------------------
@@ -585,6 +1768,56 @@ class PostgreSQL:
         """
         self.execute(sql_make_spatial_index)
 
+    def swap_table(self, shadow_table: str, table_name: str, schema: str = None) -> None:
+        """
+        Replace a table with a fully-loaded copy of it, in one transaction.
+        Readers see either the old table or the new one, never a half-loaded one.
+
+        Indexes, constraints and sequences that were named after the shadow
+        table are renamed to match, so the next shadow load can reuse the names.
+
+        :param shadow_table: name of the table holding the new data
+        :type shadow_table: str
+        :param table_name: name of the table to replace
+        :type table_name: str
+        :param schema: schema of both tables, defaults to the active schema
+        :type schema: str, optional
+        """
+
+        if not schema:
+            schema = self.ACTIVE_SCHEMA
+
+        print(f"\t -> Swapping {schema}.{shadow_table} in as {schema}.{table_name}")
+
+        with self.transaction():
+            self.execute(
+                f"""
+                DROP TABLE IF EXISTS {schema}.{table_name};
+                ALTER TABLE {schema}.{shadow_table} RENAME TO {table_name};
+            """
+            )
+
+            # Indexes (including the ones behind constraints) and owned sequences
+            query = f"""
+                SELECT c.relkind, c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema}'
+                  AND c.relname LIKE '{shadow_table}%'
+                  AND (
+                    c.oid IN (SELECT indexrelid FROM pg_index
+                              WHERE indrelid = '{schema}.{table_name}'::regclass)
+                    OR c.oid IN (SELECT objid FROM pg_depend
+                                 WHERE refobjid = '{schema}.{table_name}'::regclass
+                                   AND classid = 'pg_class'::regclass
+                                   AND deptype IN ('a', 'i'))
+                  )
+            """
+            for relkind, relname in self.query_as_list(query):
+                new_name = table_name + relname[len(shadow_table) :]
+                kind = "INDEX" if relkind == "i" else "SEQUENCE"
+                self.execute(f'ALTER {kind} {schema}."{relname}" RENAME TO "{new_name}";')
+
     def table_reproject_spatial_data(
         self,
         table_name: str,
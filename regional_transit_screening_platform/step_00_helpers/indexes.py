@@ -0,0 +1,299 @@
+"""
+The indexes each pipeline table should carry, and the housekeeping
+that keeps the planner's view of those tables up to date.
+
+``INDEX_REGISTRY`` lists the join keys the pipeline relies on. After a
+stage runs, ``apply_index_registry()`` adds any index that's missing,
+``refresh_statistics()`` analyzes tables that changed, and
+``report_seq_scans()`` lists large tables that were read with a
+sequential scan during the stage.
+"""
+from contextlib import contextmanager
+from fnmatch import fnmatch
+
+from .database import PostgreSQL
+
+
+# (pattern for "schema.table", columns to index)
+# A leading "*" lets a pattern also match the tables in the scratch schema.
+INDEX_REGISTRY = [
+    # OSM network and the tables matched to it
+    ("*.osm_edges_drive", ["edge_id"]),
+    ("*.osm_edges_drive", ["osmuuid"]),
+    ("*osm_matched_*", ["edge_id"]),
+    ("*osm_matched_*", ["data_uid"]),
+    ("*.osm_speed", ["edge_id"]),
+    ("*.osm_ridership", ["edge_id"]),
+    # Model line routes and stops
+    ("raw.lineroutes", ["lrid"]),
+    # Stops are joined to links on CONCAT(fromonode, tonode), which can't be
+    # indexed (CONCAT isn't immutable), so there's no entry for fromonode
+    ("raw.stoppoints", ["gtfsid"]),
+    ("*.model_2015base_link", ["fromto"]),
+    # Loads assigned to links
+    ("ridership.surface_transit_loads", ["stop_id"]),
+    ("*lineroutes_linkseq", ["lrid"]),
+    ("*lineroutes_linkseq", ["fromto"]),
+    ("*lrid_portions", ["lrid"]),
+    ("*linkseq_stops_*", ["fromto"]),
+    ("*linkseq_cleanloads_*", ["lrid", "lrseq"]),
+]
+
+# Tables smaller than this aren't worth reporting on
+LARGE_TABLE_ROWS = 100000
+
+
+def registered_indexes(schema: str, table_name: str) -> list:
+    """
+    Get the column lists that the registry wants indexed on one table
+    """
+    full_name = f"{schema}.{table_name}"
+
+    return [columns for pattern, columns in INDEX_REGISTRY if fnmatch(full_name, pattern)]
+
+
+def _table_columns(db: PostgreSQL) -> dict:
+    """
+    {(schema, table): set of columns} for every user table
+    """
+    query = """
+        SELECT c.table_schema, c.table_name, c.column_name
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+            ON t.table_schema = c.table_schema
+           AND t.table_name = c.table_name
+        WHERE t.table_type = 'BASE TABLE'
+          AND c.table_schema NOT IN ('pg_catalog', 'information_schema')
+    """
+    tables = {}
+    for schema, table_name, column in db.query_as_list(query):
+        tables.setdefault((schema, table_name), set()).add(column)
+
+    return tables
+
+
+def _existing_indexes(db: PostgreSQL) -> dict:
+    """
+    {(schema, table): list of column lists} for every existing index
+    """
+    query = """
+        SELECT n.nspname, c.relname, array_agg(a.attname::text ORDER BY k.ord)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        WHERE n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+        GROUP BY i.indexrelid, n.nspname, c.relname
+    """
+    indexes = {}
+    for schema, table_name, columns in db.query_as_list(query):
+        indexes.setdefault((schema, table_name), []).append(list(columns))
+
+    return indexes
+
+
+def apply_index_registry(db: PostgreSQL, tables: list = None) -> list:
+    """
+    Create every registered index that doesn't exist yet. An index is
+    skipped if the table doesn't have the columns, or if an existing
+    index already starts with them (e.g. the primary key).
+
+    :param db: database to update
+    :type db: PostgreSQL
+    :param tables: only look at these "schema.table" names, defaults to every table
+    :type tables: list, optional
+    :return: "schema.table (columns)" for each index that was created
+    :rtype: list
+    """
+
+    existing = _existing_indexes(db)
+    created = []
+
+    with db.tuning_profile("index-build"):
+        for (schema, table_name), table_columns in _table_columns(db).items():
+            if tables is not None and f"{schema}.{table_name}" not in tables:
+                continue
+
+            for columns in registered_indexes(schema, table_name):
+
+                if not set(columns).issubset(table_columns):
+                    continue
+
+                table_indexes = existing.get((schema, table_name), [])
+                already_indexed = any(index[: len(columns)] == columns for index in table_indexes)
+                if already_indexed:
+                    continue
+
+                index_name = f"{table_name}_{'_'.join(columns)}_idx"[:63]
+                column_list = ", ".join(f'"{col}"' for col in columns)
+
+                db.execute(
+                    f"""
+                    CREATE INDEX IF NOT EXISTS "{index_name}"
+                    ON {schema}."{table_name}" ({column_list});
+                """
+                )
+
+                existing.setdefault((schema, table_name), []).append(columns)
+                created.append(f"{schema}.{table_name} ({', '.join(columns)})")
+
+                # New indexes have no statistics until the table is analyzed
+                db.execute(f'ANALYZE {schema}."{table_name}";')
+
+    for index in created:
+        print(f"\t -> Added index on {index}")
+
+    return created
+
+
+def refresh_statistics(db: PostgreSQL, changed_fraction: float = 0.1, tables: list = None) -> list:
+    """
+    ANALYZE every user table that has never been analyzed, or where more
+    than ``changed_fraction`` of its rows changed since the last ANALYZE.
+
+    :param db: database to update
+    :type db: PostgreSQL
+    :param changed_fraction: share of modified rows that triggers
+                             a refresh, defaults to 0.1
+    :type changed_fraction: float, optional
+    :param tables: only look at these "schema.table" names, defaults to every table
+    :type tables: list, optional
+    :return: "schema.table" for each table that was analyzed
+    :rtype: list
+    """
+
+    query = f"""
+        SELECT schemaname, relname
+        FROM pg_stat_user_tables
+        WHERE (last_analyze IS NULL AND last_autoanalyze IS NULL)
+           OR n_mod_since_analyze > {changed_fraction} * greatest(n_live_tup, 1)
+    """
+
+    analyzed = []
+    for schema, table_name in db.query_as_list(query):
+        if tables is not None and f"{schema}.{table_name}" not in tables:
+            continue
+
+        db.execute(f'ANALYZE {schema}."{table_name}";')
+        analyzed.append(f"{schema}.{table_name}")
+
+    if analyzed:
+        print(f"\t -> Refreshed statistics on {len(analyzed)} table(s)")
+
+    return analyzed
+
+
+def scan_counts(db: PostgreSQL) -> dict:
+    """
+    Snapshot the sequential scan counter of every user table.
+    A database that hasn't been created yet (e.g. before ``db-setup-from-shp``)
+    has no tables, so the snapshot is empty.
+
+    :return: {"schema.table": (seq_scan, seq_tup_read, n_live_tup)}
+    :rtype: dict
+    """
+    if not db.exists():
+        return {}
+
+    query = """
+        SELECT schemaname, relname,
+               coalesce(seq_scan, 0), coalesce(seq_tup_read, 0), n_live_tup
+        FROM pg_stat_user_tables
+    """
+    return {
+        f"{schema}.{table_name}": (seq_scan, seq_tup_read, n_live_tup)
+        for schema, table_name, seq_scan, seq_tup_read, n_live_tup in db.query_as_list(query)
+    }
+
+
+def report_seq_scans(db: PostgreSQL, before: dict, min_rows: int = LARGE_TABLE_ROWS) -> list:
+    """
+    Print the large tables that were read with a sequential scan
+    since the ``before`` snapshot was taken.
+
+    PostgreSQL publishes these counters with a short delay, so scans
+    from the last second or so may not show up yet.
+
+    :param db: database to check
+    :type db: PostgreSQL
+    :param before: result of ``scan_counts()`` from the start of the stage
+    :type before: dict
+    :param min_rows: only report tables with at least this many rows
+    :type min_rows: int, optional
+    :return: one dict per table, with the most rows read first
+    :rtype: list
+    """
+
+    report = []
+
+    for table, (seq_scan, seq_tup_read, n_live_tup) in scan_counts(db).items():
+        scans_before, rows_before, _ = before.get(table, (0, 0, 0))
+
+        if n_live_tup >= min_rows and seq_scan > scans_before:
+            report.append(
+                {
+                    "table": table,
+                    "seq_scans": seq_scan - scans_before,
+                    "rows_read": seq_tup_read - rows_before,
+                    "table_rows": n_live_tup,
+                }
+            )
+
+    report.sort(key=lambda row: row["rows_read"], reverse=True)
+
+    for row in report:
+        print(
+            f"\t -> Sequential scan: {row['table']} was scanned {row['seq_scans']} time(s),"
+            f" {row['rows_read']} rows read ({row['table_rows']} rows in table)"
+        )
+
+    return report
+
+
+def run_maintenance(
+    db: PostgreSQL, before: dict, min_rows: int = LARGE_TABLE_ROWS, tables: list = None
+) -> None:
+    """
+    The housekeeping ``maintain_indexes()`` does once a stage finishes,
+    for callers that can't wrap the stage in a ``with`` block.
+
+    :param db: database to update
+    :type db: PostgreSQL
+    :param before: result of ``scan_counts()`` from the start of the stage
+    :type before: dict
+    :param min_rows: only report tables with at least this many rows
+    :type min_rows: int, optional
+    :param tables: only look at these "schema.table" names, defaults to every table
+    :type tables: list, optional
+    """
+
+    print("-" * 80, "\nINDEXES & STATISTICS")
+
+    # Report before building indexes, since building one scans the table
+    report_seq_scans(db, before, min_rows=min_rows)
+    apply_index_registry(db, tables=tables)
+    refresh_statistics(db, tables=tables)
+
+
+@contextmanager
+def maintain_indexes(db: PostgreSQL, min_rows: int = LARGE_TABLE_ROWS, tables: list = None):
+    """
+    Wrap a stage so that, once it finishes, large tables it read with
+    sequential scans are reported, registered indexes are added to
+    any tables it made, and stale statistics are refreshed.
+    Nothing is done if the stage raises.
+
+    Pass the stage's own ``tables`` when other stages are running at
+    the same time, so it doesn't index or analyze tables they're rebuilding.
+
+    Usage:
+        with maintain_indexes(db):
+            analyze_speed()
+    """
+
+    before = scan_counts(db)
+
+    yield
+
+    run_maintenance(db, before, min_rows=min_rows, tables=tables)
@@ -25,36 +25,39 @@ def match_features_with_osm(
     # Iterate over features and identify matching OSM features
     # --------------------------------------------------------
 
-    result_df = pd.DataFrame(columns=["osmuuid", "data_uid"])
+    result_rows = []
+
+    # Inner query that gives the geometry(/buffer) of one feature.
+    # The feature's uid is bound as $1 so the statement is only planned once.
+    inner_query = f"""
+        SELECT geom
+        FROM {data_table}
+        WHERE uid = $1
+    """
+    inner_buffer = inner_query.replace("geom", "st_buffer(geom, 20)")
+
+    query_matching_osm_features = f"""
+        select
+            edge_id,
+            st_length(geom) as original_geom,
+            st_length(
+                st_intersection(geom, ({inner_buffer}))
+            ) as intersected_geom,
+            degrees(st_angle(geom, ({inner_query}))) as angle_diff
+        from
+            {osm_table}
+        where
+            st_intersects(geom, ({inner_buffer}))
+    """
+    columns = ["edge_id", "original_geom", "intersected_geom", "angle_diff"]
 
-    uid_list = db.query_via_psycopg2(f"SELECT uid FROM {data_table}")
+    uid_list = db.query_as_list(f"SELECT uid FROM {data_table}")
 
     for uid in tqdm(uid_list, total=len(uid_list)):
         uid = uid[0]
 
-        # Inner query that gives the geometry(/buffer) of one feature
-        inner_query = f"""
-            SELECT geom
-            FROM {data_table}
-            WHERE uid = {uid}
-        """
-        inner_buffer = inner_query.replace("geom", "st_buffer(geom, 20)")
-
-        query_matching_osm_features = f"""
-            select
-                osmuuid,
-                st_length(geom) as original_geom,
-                st_length(
-                    st_intersection(geom, ({inner_buffer}))
-                ) as intersected_geom,
-                degrees(st_angle(geom, ({inner_query}))) as angle_diff
-            from
-                {osm_table}
-            where
-                st_intersects(geom, ({inner_buffer}))
-        """
-
-        df = db.query(query_matching_osm_features, geo=False).df
+        rows = db.query_prepared("match_features_with_osm", query_matching_osm_features, (uid,))
+        df = pd.DataFrame(rows, columns=columns)
 
         # Flag features that match the geometry test:
         #   1) The intersection is at least 25 meters, OR
@@ -86,14 +89,22 @@ def match_features_with_osm(
             matching_df = df[(df.geom_match == "Yes")]
 
         # Insert a result row for each unique combo of osm & speed uids
-        for _, osm_row in matching_df.iterrows():
-            new_row = {"osmuuid": osm_row.osmuuid, "data_uid": uid}
-            result_df = result_df.append(new_row, ignore_index=True)
+        for edge_id in matching_df.edge_id:
+            result_rows.append({"edge_id": edge_id, "data_uid": uid})
 
     # ----------------------------------
     # After iterating over all features,
     # write the result to the DB
 
-    sql_tablename = f"osm_matched_{data_table.replace('.', '_')}"
+    # int32 columns are written as INTEGER, matching osm_edges_drive.edge_id
+    result_df = (
+        pd.DataFrame(result_rows, columns=["edge_id", "data_uid"])
+        .drop_duplicates()
+        .astype("int32")
+    )
+
+    sql_tablename = db.intermediate(f"osm_matched_{data_table.replace('.', '_')}")
+
+    db.import_dataframe(result_df, sql_tablename, if_exists="replace", index=False)
 
-    db.import_dataframe(result_df, sql_tablename, df_import_kwargs={"if_exists": "replace"})
+    db.execute(f"ALTER TABLE {sql_tablename} ADD PRIMARY KEY (edge_id, data_uid);")
@@ -0,0 +1,258 @@
+"""
+Timing records for the statements sent through ``PostgreSQL``.
+
+Every call records its wall time, the number of rows it returned or
+affected, and a fingerprint of the SQL. The fingerprint ignores literal
+values and formatting, so the same statement can be compared across runs.
+Calls are grouped under the pipeline stage that was active when they ran.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+
+def fingerprint(query: str) -> str:
+    """
+    Hash a SQL statement with its comments, literal values and
+    formatting removed, so that statements that only differ by
+    their parameters share a fingerprint.
+
+    :param query: any valid SQL query string
+    :type query: str
+    :return: 16-character hex digest
+    :rtype: str
+    """
+    sql = re.sub(r"--[^\n]*", " ", query)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.S)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\s+", " ", sql).strip().rstrip(";").strip().lower()
+
+    return hashlib.sha1(sql.encode()).hexdigest()[:16]
+
+
+class QueryMetrics:
+    """
+    Collects a record for each statement and each stage of a run.
+
+    :param explain_threshold: statements slower than this many seconds
+                              get their plan captured, defaults to None (never)
+    :type explain_threshold: float, optional
+    """
+
+    def __init__(self, explain_threshold: float = None):
+
+        self.explain_threshold = explain_threshold
+
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now()
+
+        # Full SQL text, stored once per fingerprint
+        self.statements = {}
+
+        self.records = []
+        self.stages = []
+
+        # Number of records already saved to the database
+        self.records_written = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def current_stage(self) -> str:
+        """
+        Name of the innermost stage running in this thread
+        """
+        stack = getattr(self._local, "stages", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def timed(self, query: str, kind: str):
+        """
+        Time a single call. The caller fills in ``record["rows"]`` if it knows it.
+
+        Usage:
+            with metrics.timed(query, "execute") as record:
+                cursor.execute(query)
+                record["rows"] = cursor.rowcount
+        """
+
+        fp = fingerprint(query)
+
+        record = {
+            "run_id": self.run_id,
+            "stage": self.current_stage,
+            "fingerprint": fp,
+            "kind": kind,
+            "started_at": datetime.now(),
+            "seconds": None,
+            "rows": None,
+            "failed": False,
+            "plan": None,
+        }
+
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["failed"] = True
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+
+            with self._lock:
+                self.statements.setdefault(fp, query.strip())
+                self.records.append(record)
+
+    def should_explain(self, record: dict) -> bool:
+        """
+        Check if a finished call was slow enough to capture its plan
+        """
+        return (
+            self.explain_threshold is not None
+            and not record["failed"]
+            and record["seconds"] >= self.explain_threshold
+        )
+
+    @contextmanager
+    def stage(self, name: str, **details):
+        """
+        Group the calls made inside the block under a named stage,
+        and record how long the stage took.
+
+        :param name: name of the stage, e.g. "feature_engineering"
+        :type name: str
+        :param details: anything else to log alongside the stage timing
+        """
+
+        if not hasattr(self._local, "stages"):
+            self._local.stages = []
+
+        self._local.stages.append(name)
+        first_record = len(self.records)
+
+        stage = {"stage": name, "started_at": datetime.now(), **details}
+
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage["seconds"] = time.perf_counter() - start
+            stage["statements"] = sum(
+                1 for r in self.records[first_record:] if r["stage"] == name
+            )
+            self._local.stages.pop()
+
+            with self._lock:
+                self.stages.append(stage)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Total time, call count and slowest call for each fingerprint,
+        with the most expensive statements first
+        """
+
+        df = self.to_dataframe()
+
+        if df.empty:
+            return df
+
+        summary = (
+            df.groupby(["stage", "fingerprint"], dropna=False)
+            .agg(
+                calls=("seconds", "size"),
+                total_seconds=("seconds", "sum"),
+                max_seconds=("seconds", "max"),
+                rows=("rows", "sum"),
+            )
+            .reset_index()
+            .sort_values("total_seconds", ascending=False)
+        )
+        summary["statement"] = summary["fingerprint"].map(self.statements)
+
+        return summary
+
+    def to_dataframe(self, since: int = 0) -> pd.DataFrame:
+        """
+        One row per recorded call, with plans stored as JSON text
+
+        :param since: skip this many of the earliest records, defaults to 0
+        :type since: int, optional
+        """
+
+        with self._lock:
+            records = self.records[since:]
+
+        df = pd.DataFrame(
+            records,
+            columns=[
+                "run_id",
+                "stage",
+                "fingerprint",
+                "kind",
+                "started_at",
+                "seconds",
+                "rows",
+                "failed",
+                "plan",
+            ],
+        )
+        df["statement"] = df["fingerprint"].map(self.statements)
+        df["plan"] = df["plan"].map(lambda p: None if p is None else json.dumps(p))
+
+        return df
+
+    def write_run_log(self, path: Union[Path, str]) -> None:
+        """
+        Save the stage timings, the per-fingerprint summary and any
+        captured plans to a JSON file that can be diffed against other runs.
+
+        :param path: filepath for the JSON log
+        :type path: Union[Path, str]
+        """
+
+        with self._lock:
+            plans = [
+                {"stage": r["stage"], "fingerprint": r["fingerprint"], "plan": r["plan"]}
+                for r in self.records
+                if r["plan"] is not None
+            ]
+            stages = list(self.stages)
+
+        log = {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": datetime.now(),
+            "explain_threshold": self.explain_threshold,
+            "stages": stages,
+            "statements": self.summary().to_dict(orient="records"),
+            "plans": plans,
+        }
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path, "w") as f:
+            json.dump(log, f, indent=2, default=str)
+
+    def reset(self) -> None:
+        """
+        Forget everything recorded so far and start a new run
+        """
+        with self._lock:
+            self.run_id = uuid.uuid4().hex
+            self.started_at = datetime.now()
+            self.statements = {}
+            self.records = []
+            self.stages = []
+            self.records_written = 0
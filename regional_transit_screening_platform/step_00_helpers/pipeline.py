@@ -0,0 +1,509 @@
+"""
+Run the whole analysis with one command, the way ``make`` would.
+
+Each CLI command is a step, listed in ``PIPELINE_STEPS`` with the tables
+it reads and writes. A step is skipped when all of its outputs are newer
+than all of its inputs, and steps that don't depend on each other (e.g.
+the speed and ridership branches) run at the same time.
+
+When each table was last written is kept in ``PIPELINE_STATE_TABLE``.
+Every CLI command records its outputs there when it returns without an
+error, whether it was started by ``rtsp run`` or by hand. Tables loaded by
+``db-setup-from-shp`` use the import manifest instead, which only moves
+forward when a file actually changed.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from regional_transit_screening_platform.step_01_import_data.transfer import DAISY_TABLES
+from regional_transit_screening_platform.step_05_ridership.seasons import (
+    RIDERSHIP_SEASONS,
+    SHARED_TABLES,
+    season_tables,
+    stop_tables,
+)
+
+from .database import PostgreSQL
+
+
+PIPELINE_STATE_TABLE = "public.pipeline_state"
+
+# The analysis, in the order the steps would be run by hand
+#   command: name of the CLI command
+#   inputs: tables the step reads
+#   outputs: tables the step writes
+#   intermediates: outputs written through ``db.intermediate()``, named
+#                  the same way as in the code. In staging mode they're
+#                  dropped with the scratch schema, and are only rebuilt
+#                  when a step that reads them has to run again.
+#   always: run the step every time, since it works out for itself what
+#           needs to be done (e.g. the import manifest)
+# The ridership tables are listed for every season in RIDERSHIP_SEASONS.
+
+# ridership-assign-loads writes every table through db.intermediate().
+# The clean loads for each season are what the step is run for, so they're
+# outputs: a season that's missing them makes the step run again.
+CLEAN_LOADS_TABLES = [f"ridership.linkseq_cleanloads_{season}" for season in RIDERSHIP_SEASONS]
+
+PIPELINE_STEPS = [
+    {
+        "command": "db-setup-from-shp",
+        "outputs": [
+            "raw.linkspeed_byline",
+            "raw.linkspeedbylinenamecode",
+            "raw.passloads_segmentlevel_2020_07",
+            "raw.statsbyline_allgeom",
+        ],
+        "always": True,
+    },
+    {
+        "command": "db-import-from-daisy-db",
+        "outputs": [table["target"] for table in DAISY_TABLES],
+    },
+    {
+        "command": "db-import-osm",
+        "outputs": ["public.osm_edges_drive"],
+    },
+    {
+        "command": "db-scrape-septa-report",
+        "outputs": ["public.septa_report_scrape_2019"],
+    },
+    {
+        "command": "db-feature-engineering",
+        "inputs": [
+            "raw.linkspeed_byline",
+            "raw.linkspeedbylinenamecode",
+            "raw.passloads_segmentlevel_2020_07",
+            "raw.statsbyline_allgeom",
+        ],
+        "outputs": [
+            "speed.rtsp_input_speed",
+            "ridership.rtsp_input_ridership_septa",
+            "ridership.rtsp_input_ridership_njt",
+        ],
+    },
+    {
+        "command": "speed-match-osm",
+        "inputs": ["speed.rtsp_input_speed", "public.osm_edges_drive"],
+        "intermediates": ["osm_matched_speed_rtsp_input_speed"],
+    },
+    {
+        "command": "speed-analysis",
+        "inputs": [
+            "speed.rtsp_input_speed",
+            "public.osm_edges_drive",
+            "osm_matched_speed_rtsp_input_speed",
+        ],
+        "outputs": ["public.osm_speed"],
+        "intermediates": ["osm_speed_qaqc"],
+    },
+    {
+        "command": "ridership-match-osm-w-septa",
+        "inputs": ["ridership.rtsp_input_ridership_septa", "public.osm_edges_drive"],
+        "intermediates": ["osm_matched_rtsp_input_ridership_septa"],
+    },
+    {
+        "command": "ridership-match-osm-w-njt",
+        "inputs": ["ridership.rtsp_input_ridership_njt", "public.osm_edges_drive"],
+        "intermediates": ["osm_matched_rtsp_input_ridership_njt"],
+    },
+    {
+        "command": "ridership-analysis",
+        "inputs": [
+            "ridership.rtsp_input_ridership_septa",
+            "public.osm_edges_drive",
+            "osm_matched_rtsp_input_ridership_septa",
+            "osm_matched_rtsp_input_ridership_njt",
+        ],
+        "outputs": ["public.osm_ridership"],
+    },
+    {
+        "command": "ridership-combine-loads",
+        "inputs": stop_tables(),
+        "outputs": ["ridership.surface_transit_loads"],
+    },
+    {
+        "command": "ridership-assign-loads",
+        "inputs": ["ridership.surface_transit_loads", "raw.lineroutes", "raw.stoppoints"],
+        "outputs": CLEAN_LOADS_TABLES,
+        "intermediates": [f"ridership.{name}" for name in SHARED_TABLES]
+        + [
+            table
+            for season in RIDERSHIP_SEASONS
+            for table in season_tables(season)
+            if table not in CLEAN_LOADS_TABLES
+        ],
+    },
+]
+
+
+# Tables written through db.intermediate(), as named in PIPELINE_STEPS
+INTERMEDIATE_TABLES = {
+    table for step in PIPELINE_STEPS for table in step.get("intermediates", [])
+} | set(CLEAN_LOADS_TABLES)
+
+
+def pipeline_step(command: str) -> dict:
+    """
+    Get the ``PIPELINE_STEPS`` entry for a CLI command, or None
+    """
+    for step in PIPELINE_STEPS:
+        if step["command"] == command:
+            return step
+    return None
+
+
+def step_tables(step: dict) -> list:
+    """
+    Every table a step writes, as named in ``PIPELINE_STEPS``
+    """
+    return step.get("outputs", []) + step.get("intermediates", [])
+
+
+def sql_table_name(db: PostgreSQL, table_name: str) -> str:
+    """
+    Get the "schema.table" that a table named in ``PIPELINE_STEPS`` is
+    really written to. In staging mode, intermediates are in the scratch schema.
+    """
+    if table_name in INTERMEDIATE_TABLES:
+        table_name = db.intermediate(table_name)
+
+    if "." not in table_name:
+        table_name = f"public.{table_name}"
+
+    return table_name
+
+
+def existing_tables(db: PostgreSQL, table_names: list) -> set:
+    """
+    Get the tables from ``table_names`` that exist in the database
+    """
+    sql_names = {sql_table_name(db, table_name): table_name for table_name in table_names}
+
+    query = "SELECT t FROM unnest(%s) AS t WHERE to_regclass(t) IS NOT NULL"
+    rows = db.query_as_list(query, params=(list(sql_names),))
+
+    return {sql_names[sql_name] for (sql_name,) in rows}
+
+
+def _create_state_table(db: PostgreSQL) -> None:
+    db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PIPELINE_STATE_TABLE} (
+            table_name text PRIMARY KEY,
+            command text,
+            updated_at timestamptz DEFAULT now()
+        );
+    """
+    )
+
+
+def record_outputs(db: PostgreSQL, command: str, tables: list = None) -> None:
+    """
+    Save the time that each of a CLI command's tables was written to
+    ``PIPELINE_STATE_TABLE``. Only call this once the command has returned
+    without an error, or a failed run would look up to date.
+    Commands that aren't in ``PIPELINE_STEPS`` aren't recorded, and neither
+    are steps that always run, since they keep their own record of what
+    changed (e.g. the import manifest).
+
+    Usage:
+        analyze_speed()
+        record_outputs(db, "speed-analysis")
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param command: name of the CLI command
+    :type command: str
+    :param tables: only record these tables, as named in ``PIPELINE_STEPS``,
+                   e.g. when a command was run for some of the seasons.
+                   Defaults to every table the step writes.
+    :type tables: list, optional
+    """
+
+    step = pipeline_step(command)
+    if step is None or step.get("always"):
+        return
+
+    written = step_tables(step)
+    if tables is not None:
+        written = [table for table in written if table in tables]
+
+    if not written:
+        return
+
+    _create_state_table(db)
+
+    for table_name in existing_tables(db, written):
+        db.execute(
+            f"""
+            INSERT INTO {PIPELINE_STATE_TABLE} (table_name, command, updated_at)
+            VALUES (%s, %s, now())
+            ON CONFLICT (table_name) DO UPDATE
+            SET command = EXCLUDED.command,
+                updated_at = EXCLUDED.updated_at;
+        """,
+            params=(table_name, command),
+        )
+
+
+def table_timestamps(db: PostgreSQL) -> dict:
+    """
+    Get when each table was last written: from the import manifest for
+    the input files, otherwise from ``PIPELINE_STATE_TABLE``
+
+    :return: {table name: datetime}
+    :rtype: dict
+    """
+    from regional_transit_screening_platform.step_01_import_data.manifest import MANIFEST_TABLE
+
+    _create_state_table(db)
+
+    query = f"SELECT table_name, updated_at FROM {PIPELINE_STATE_TABLE}"
+    timestamps = dict(db.query_as_list(query))
+
+    if db.query_as_single_item(f"SELECT to_regclass('{MANIFEST_TABLE}') IS NOT NULL"):
+        query = f"SELECT table_name, max(imported_at) FROM {MANIFEST_TABLE} GROUP BY table_name"
+        timestamps.update(dict(db.query_as_list(query)))
+
+    return timestamps
+
+
+def _producers() -> dict:
+    """
+    {table name: command that writes it}
+    """
+    return {table: step["command"] for step in PIPELINE_STEPS for table in step_tables(step)}
+
+
+def _stale_reason(step: dict, reasons: dict, timestamps: dict, existing: set) -> str:
+    """
+    Say why a step has to run, or return None if it's up to date.
+    ``reasons`` holds what's been decided so far for the other steps.
+    """
+
+    for table in step.get("outputs", []):
+        if table not in existing:
+            return f"{table} is missing"
+
+    written = [timestamps.get(table) for table in step_tables(step)]
+    if None in written:
+        return "never recorded"
+
+    producers = _producers()
+    for table in step.get("inputs", []):
+        producer = producers.get(table)
+
+        # Steps that always run have already finished by the time the plan is made
+        if producer and reasons.get(producer) and not pipeline_step(producer).get("always"):
+            return f"{producer} will run"
+
+    for table in step.get("inputs", []):
+        if timestamps.get(table) and timestamps[table] > min(written):
+            return f"{table} changed"
+
+    return None
+
+
+def plan_steps(timestamps: dict, existing: set, force: bool = False) -> dict:
+    """
+    Work out which steps have to run, and why.
+
+    A step runs if one of its outputs is missing or was never recorded,
+    if an input is newer than its oldest output, or if a step it reads
+    from runs. A missing intermediate is only rebuilt when a step that
+    reads it runs.
+
+    :param timestamps: when each table was last written (see ``table_timestamps()``)
+    :type timestamps: dict
+    :param existing: tables that exist in the database, as named in ``PIPELINE_STEPS``
+    :type existing: set
+    :param force: run every step, defaults to False
+    :type force: bool, optional
+    :return: {command: reason it runs, or None if it's up to date}
+    :rtype: dict
+    """
+
+    if force:
+        return {step["command"]: "forced" for step in PIPELINE_STEPS}
+
+    producers = _producers()
+
+    reasons = {step["command"]: "always runs" for step in PIPELINE_STEPS if step.get("always")}
+
+    # Repeat until nothing changes, since rebuilding a missing
+    # intermediate means the steps that read it run too
+    changed = True
+    while changed:
+        changed = False
+
+        # PIPELINE_STEPS is in order, so upstream steps are decided first
+        for step in PIPELINE_STEPS:
+            if reasons.get(step["command"]):
+                continue
+
+            reasons[step["command"]] = _stale_reason(step, reasons, timestamps, existing)
+            changed = changed or reasons[step["command"]] is not None
+
+        for step in PIPELINE_STEPS:
+            if not reasons.get(step["command"]):
+                continue
+
+            for table in step.get("inputs", []):
+                producer = producers.get(table)
+
+                if producer and table not in existing and not reasons.get(producer):
+                    reasons[producer] = f"{step['command']} needs {table}"
+                    changed = True
+
+    return reasons
+
+
+def plan_pipeline(db: PostgreSQL, force: bool = False) -> dict:
+    """
+    Work out which steps have to run, and why (see ``plan_steps()``).
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param force: run every step, defaults to False
+    :type force: bool, optional
+    :return: {command: reason it runs, or None if it's up to date}
+    :rtype: dict
+    """
+
+    if force:
+        return plan_steps({}, set(), force=True)
+
+    all_tables = {
+        table for step in PIPELINE_STEPS for table in step.get("inputs", []) + step_tables(step)
+    }
+
+    return plan_steps(table_timestamps(db), existing_tables(db, all_tables))
+
+
+def _run_timed(run_step, command: str, tables: list) -> float:
+    start = time.perf_counter()
+    run_step(command, tables)
+    return time.perf_counter() - start
+
+
+def run_pipeline(
+    db: PostgreSQL, run_step, workers: int = 2, dry_run: bool = False, force: bool = False
+) -> dict:
+    """
+    Run every step that isn't up to date, ``workers`` steps at a time.
+
+    Steps that always run go first, on their own. The rest are planned
+    once those are done, and each one starts as soon as the steps it reads
+    from have finished. A step that fails stops the steps downstream of it,
+    but not the other branches. The failures are raised together at the end.
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param run_step: function that runs one CLI command,
+                     called with the command name and the
+                     "schema.table" names it writes
+    :type run_step: callable
+    :param workers: number of steps run at the same time, defaults to 2
+    :type workers: int, optional
+    :param dry_run: only print the plan, defaults to False
+    :type dry_run: bool, optional
+    :param force: run every step, even the ones that are up to date
+    :type force: bool, optional
+    :return: {command: (status, seconds, error)} for each step
+    :rtype: dict
+    """
+
+    print("-" * 80, "\nRUNNING THE PIPELINE")
+
+    db.db_create()
+
+    results = {}
+
+    def tables_written(step):
+        # Resolving the names also creates the scratch schema, before any threads start
+        return [sql_table_name(db, table) for table in step_tables(step)]
+
+    for step in PIPELINE_STEPS:
+        if step.get("always") and not dry_run:
+            seconds = _run_timed(run_step, step["command"], tables_written(step))
+            results[step["command"]] = ("ran", seconds, None)
+
+    reasons = plan_pipeline(db, force=force)
+
+    print("-" * 80, "\nPIPELINE PLAN")
+    for step in PIPELINE_STEPS:
+        reason = reasons[step["command"]]
+        action = "run" if reason else "skip"
+        print(f"\t -> {action:<5} {step['command']:<30} {reason or 'up to date'}")
+
+    if dry_run:
+        return {
+            command: ("planned" if reason else "up to date", None, None)
+            for command, reason in reasons.items()
+        }
+
+    to_run = [
+        step for step in PIPELINE_STEPS if reasons[step["command"]] and not step.get("always")
+    ]
+    commands = {step["command"] for step in to_run}
+
+    producers = _producers()
+    upstream = {
+        step["command"]: {producers[t] for t in step.get("inputs", []) if t in producers} & commands
+        for step in to_run
+    }
+
+    for step in PIPELINE_STEPS:
+        if not reasons[step["command"]]:
+            results[step["command"]] = ("up to date", None, None)
+
+    pending = list(to_run)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+
+            # Start every step whose upstream steps are done
+            for step in list(pending):
+                waits_on = upstream[step["command"]]
+
+                if any(results.get(c, (None,))[0] in ("FAILED", "not run") for c in waits_on):
+                    results[step["command"]] = ("not run", None, None)
+                    pending.remove(step)
+
+                elif all(c in results for c in waits_on):
+                    print(f"\t -> Starting {step['command']}")
+                    future = executor.submit(
+                        _run_timed, run_step, step["command"], tables_written(step)
+                    )
+                    running[future] = step["command"]
+                    pending.remove(step)
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                command = running.pop(future)
+                try:
+                    results[command] = ("ran", future.result(), None)
+                except Exception as e:
+                    results[command] = ("FAILED", None, e)
+
+    print("-" * 80, "\nPIPELINE RESULTS")
+    for step in PIPELINE_STEPS:
+        status, seconds, error = results[step["command"]]
+        if seconds is not None:
+            print(f"\t -> {status:<10} {seconds:8.1f} s  {step['command']}")
+        elif error is not None:
+            print(f"\t -> {status:<10}   {'':8}    {step['command']}: {error}")
+        else:
+            print(f"\t -> {status:<10}   {'':8}    {step['command']}")
+
+    failures = [command for command, (_, _, error) in results.items() if error is not None]
+    if failures:
+        raise RuntimeError(f"{len(failures)} step(s) failed: {failures}")
+
+    return results
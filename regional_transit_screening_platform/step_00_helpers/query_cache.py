@@ -0,0 +1,116 @@
+"""
+On-disk cache for query results, stored as (Geo)Parquet files.
+
+Each result is keyed on the normalized SQL text plus the modification state
+of every table the query reads. When one of those tables changes, the key
+changes with it and the query runs again. Files that haven't been used
+recently are deleted once the cache grows past its size cap.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import geopandas as gpd
+
+
+class QueryCache:
+    """
+    A folder of cached query results with a size cap.
+
+    :param cache_dir: folder to hold the cached files
+    :type cache_dir: Union[Path, str]
+    :param max_bytes: total size allowed before the least recently
+                      used files are removed, defaults to 2 GB
+    :type max_bytes: int, optional
+    """
+
+    def __init__(self, cache_dir: Union[Path, str], max_bytes: int = 2 * 1024 ** 3):
+
+        self.CACHE_DIR = Path(cache_dir).expanduser()
+        self.MAX_BYTES = max_bytes
+
+        self.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def normalize_sql(query: str) -> str:
+        """
+        Collapse whitespace and drop any trailing semicolon, so that
+        the same query written with different formatting shares a key
+        """
+        return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+    def key(self, query: str, table_state: list, **options) -> str:
+        """
+        Build the cache key for a query.
+
+        :param query: SQL query
+        :type query: str
+        :param table_state: modification state of the tables the query reads
+        :type table_state: list
+        :param options: anything else that changes the result, e.g. geom_col
+        :return: hex digest used as the file name
+        :rtype: str
+        """
+        payload = json.dumps(
+            {"sql": self.normalize_sql(query), "tables": table_state, "options": options},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.CACHE_DIR / f"{key}.parquet"
+
+    def get(self, key: str, geo: bool = False) -> Union[pd.DataFrame, gpd.GeoDataFrame, None]:
+        """
+        Load a cached result, or return None if there isn't one
+        """
+        path = self._path(key)
+
+        if not path.exists():
+            return None
+
+        # The modified time doubles as the 'last used' time for eviction
+        os.utime(path)
+
+        if geo:
+            return gpd.read_parquet(path)
+        return pd.read_parquet(path)
+
+    def put(self, key: str, df: Union[pd.DataFrame, gpd.GeoDataFrame]) -> None:
+        """
+        Save a result to the cache, then trim the cache back under its size cap
+        """
+        path = self._path(key)
+
+        # Write to a temporary file first so a half-written file is never read
+        tmp_path = path.with_suffix(".tmp")
+        df.to_parquet(tmp_path)
+        tmp_path.replace(path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used files until the cache fits under ``MAX_BYTES``
+        """
+        files = sorted(self.CACHE_DIR.glob("*.parquet"), key=lambda f: f.stat().st_mtime)
+
+        total = sum(f.stat().st_size for f in files)
+
+        for f in files:
+            if total <= self.MAX_BYTES:
+                break
+            total -= f.stat().st_size
+            f.unlink()
+
+    def clear(self) -> None:
+        """
+        Delete every cached result
+        """
+        for f in self.CACHE_DIR.glob("*.parquet"):
+            f.unlink()
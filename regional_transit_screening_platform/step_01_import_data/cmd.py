@@ -1,42 +1,126 @@
 """
 Command-Line Interface for the database setup
 """
-import click
+import pathlib
 
-from .main import (
-    import_files,
-    import_osm,
-    import_from_daisy_db,
-    feature_engineering,
-    # scrape_septa_report
-)
+import click
 
 
 @click.command()
-def db_setup_from_shp():
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    help="Number of files to import at the same time",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Re-import every file, even the ones that haven't changed",
+)
+@click.option(
+    "--chunk-size",
+    default=100000,
+    show_default=True,
+    help="Number of features read at a time from each shapefile",
+)
+def db_setup_from_shp(workers, full, chunk_size):
     """Create a local SQL db & import .shp and .csv datasets"""
-    import_files()
+    from .main import import_files
+
+    import_files(workers=workers, full=full, chunk_size=chunk_size)
 
 
 @click.command()
-def db_import_osm():
+@click.option(
+    "--source",
+    type=click.Path(exists=True, file_okay=True, dir_okay=True),
+    help="Local .osm/.osm.pbf extract, GraphML graph, or GeoParquet snapshot (file or folder)",
+)
+@click.option(
+    "--snapshot",
+    type=click.Path(file_okay=True, dir_okay=True),
+    help="Where to save & look for the processed edges (a folder of GeoParquet parts)",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Rebuild the edges even if a snapshot exists",
+)
+@click.option(
+    "--batch-size",
+    default=50000,
+    show_default=True,
+    help="Number of edges written to the db at a time",
+)
+def db_import_osm(source, snapshot, refresh, batch_size):
     """Import OpenStreetMap edges to the SQL db"""
-    import_osm()
+    from .main import import_osm
+
+    import_osm(
+        source=pathlib.Path(source) if source else None,
+        snapshot=pathlib.Path(snapshot) if snapshot else None,
+        refresh=refresh,
+        batch_size=batch_size,
+    )
 
 
 @click.command()
-def db_import_from_daisy_db():
+@click.option(
+    "--workers",
+    default=3,
+    show_default=True,
+    help="Number of tables to copy at the same time",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Copy every table from daisy, even if a saved dump exists",
+)
+def db_import_from_daisy_db(workers, refresh):
     """Import data from the daisy 'GTFS' db """
-    import_from_daisy_db()
+    from .main import import_from_daisy_db
+
+    import_from_daisy_db(workers=workers, refresh=refresh)
 
 
 @click.command()
-def db_feature_engineering():
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    help="Number of tables reprojected at the same time",
+)
+def db_feature_engineering(workers):
     """Clean up source data for analysis"""
-    feature_engineering()
+    from .main import feature_engineering
+
+    feature_engineering(reproject_limit=workers)
 
 
-# @click.command()
-# def db_scrape_septa_report():
-#     """Scrape SEPTA's annual stats report"""
-#     scrape_septa_report()
+@click.command()
+@click.option(
+    "--pdf",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Report to scrape, instead of the 2019 report in the project folder",
+)
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    help="Number of processes extracting page text",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Where to keep the extracted page text (defaults to next to the PDF)",
+)
+def db_scrape_septa_report(pdf, workers, cache_dir):
+    """Scrape SEPTA's annual stats report"""
+    from .main import scrape_septa_report
+
+    scrape_septa_report(
+        filepath=pathlib.Path(pdf) if pdf else None,
+        workers=workers,
+        cache_dir=pathlib.Path(cache_dir) if cache_dir else None,
+    )
@@ -1,11 +1,28 @@
 import os
 import pathlib
-import osmnx as ox
-import pg_data_etl as pg
-
-from regional_transit_screening_platform import db, file_root
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# from .scrape_septa_route_statistics import scrape_septa_report
+import osmnx as ox
+import pandas as pd
+
+from regional_transit_screening_platform import (
+    db,
+    file_root,
+    input_mirror,
+    DAISY_DB_HOST,
+    DAISY_DB_NAME,
+    DAISY_DB_USER,
+    DAISY_DB_PW,
+)
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+from .manifest import file_changed, read_manifest, record_in_manifest
+from .mirror import input_file_size
+from .osm_edges import copy_edges_to_db, iter_edge_batches, read_edge_snapshot
+from .reproject import reproject_layers
+from .scrape_septa_route_statistics import scrape_septa_report
+from .transfer import DAISY_TABLES, transfer_tables
 
 
 def make_sql_tablename(path: pathlib.Path) -> str:
@@ -28,134 +45,311 @@ def make_sql_tablename(path: pathlib.Path) -> str:
     return sql_table_name
 
 
-def import_files():
-    """Set up the analysis database:
-    1) Create the PostgreSQL database and path to input data
-    2) Import all shapefiles
-    3) Import all CSVs
+def import_one_file(
+    path: pathlib.Path,
+    key: str,
+    manifest_row: tuple = None,
+    profile: str = None,
+    full: bool = False,
+    chunk_size: int = 100000,
+) -> tuple:
+    """
+    Import a single shapefile or CSV into the 'raw' schema, unless the
+    manifest shows it hasn't changed since the last import.
+
+    The file is loaded into a shadow table first, which then replaces the
+    existing table in the same transaction that updates the manifest.
+    If ``input_mirror`` is set, the data is read from its local Parquet copy.
+
+    :param path: the .shp or .csv file
+    :type path: pathlib.Path
+    :param key: the file's path relative to the inputs folder
+    :type key: str
+    :param manifest_row: (size, mtime, sha256) from the last import, if any
+    :type manifest_row: tuple, optional
+    :param full: import the file even if it hasn't changed
+    :type full: bool, optional
+    :param chunk_size: number of features read at a time from spatial files
+    :type chunk_size: int, optional
+    :return: ("imported" or "unchanged", number of seconds it took)
+    :rtype: tuple
     """
 
-    replace_if_exists = {"if_exists": "replace"}
+    sql_table_name = make_sql_tablename(path)
 
-    # 1) Create the project database
-    # ------------------------------
-    db.create_db()
+    start = time.perf_counter()
 
-    input_data_path = file_root / "inputs"
+    changed = file_changed(db, path, key, f"raw.{sql_table_name}", manifest_row, full=full)
+    if changed is None:
+        return "unchanged", time.perf_counter() - start
 
-    # 2) Import each input shapefile
-    # ------------------------------
-    for shp_path in input_data_path.rglob("*.shp"):
+    size, mtime, sha256 = changed
 
-        sql_table_name = make_sql_tablename(shp_path)
+    print("-" * 80, f"\nImporting raw.{sql_table_name} from {path}")
 
-        print("-" * 80, f"\nImporting raw.{sql_table_name} from {shp_path}")
+    # Leave room for the suffix within PostgreSQL's 63 character limit
+    shadow_table = f"{sql_table_name[:55]}__shadow"
 
-        db.import_geo_file(shp_path, f"raw.{sql_table_name}", gpd_kwargs=replace_if_exists)
+    # Read the local Parquet copy instead of the synced folder, if there is one
+    source = path
+    if input_mirror:
+        source = input_mirror.convert(path, sha256=sha256, chunk_size=chunk_size)
 
-    # 3) Import each input CSV
-    # ------------------------
+    # Worker threads don't inherit the caller's tuning profile, so pass it along
+    with db.stage(f"import raw.{sql_table_name}", profile=profile):
+        if path.suffix == ".shp":
+            db.import_geodata(
+                shadow_table, source, if_exists="replace", schema="raw", chunk_size=chunk_size
+            )
+        elif input_mirror:
+            df = pd.read_parquet(source)
+            db.import_dataframe(df, shadow_table, if_exists="replace", schema="raw")
+        else:
+            db.import_csv(shadow_table, path, if_exists="replace", schema="raw")
 
-    for csv_path in input_data_path.rglob("*.csv"):
+        with db.transaction():
+            db.swap_table(shadow_table, sql_table_name, schema="raw")
+            record_in_manifest(db, key, size, mtime, sha256, f"raw.{sql_table_name}")
 
-        sql_table_name = make_sql_tablename(csv_path)
+    return "imported", time.perf_counter() - start
 
-        print("-" * 80, f"\nImporting raw.{sql_table_name} from {csv_path}")
 
-        db.import_tabular_file(
-            csv_path, f"raw.{sql_table_name}", df_import_kwargs=replace_if_exists
-        )
+def import_files(workers: int = 1, full: bool = False, chunk_size: int = 100000):
+    """Set up the analysis database:
+    1) Create the PostgreSQL database and path to input data
+    2) Import all shapefiles and CSVs that changed since the last
+       import, using ``workers`` threads
 
+    The size, modified time and hash of each file are kept in
+    ``manifest.MANIFEST_TABLE``. Files that haven't changed are skipped,
+    unless ``full`` is True.
 
-def import_osm():
-    """
-    Import OpenStreetMap data to the database with osmnx.
-    This bounding box overshoots the region and takes a bit to run.
+    Spatial files are streamed in ``chunk_size`` features at a time,
+    so each worker's memory use doesn't grow with the size of its file.
+
+    Files are imported largest first, so that a big file isn't
+    left running on its own at the end. Each worker borrows its own
+    connection from the pool, so more workers than ``db.POOL_SIZE``
+    will wait on each other. A file that fails to import doesn't
+    stop the rest, and the failures are raised together at the end.
     """
 
-    print("-" * 80, "\nIMPORTING OpenStreetMap DATA")
+    # 1) Create the project database
+    # ------------------------------
+    db.db_create()
 
-    north, south, east, west = 40.601963, 39.478606, -73.885803, -76.210785
+    input_data_path = file_root / "inputs"
+
+    # Create the schema up front, so the workers don't race to make it
+    db.add_schema("raw")
+
+    manifest = read_manifest(db)
+
+    # 2) Import each input shapefile and CSV
+    # --------------------------------------
+    input_files = list(input_data_path.rglob("*.shp")) + list(input_data_path.rglob("*.csv"))
+    input_files.sort(key=input_file_size, reverse=True)
+
+    results = []
+
+    profile = db.active_profile
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for path in input_files:
+            key = path.relative_to(input_data_path).as_posix()
+            future = executor.submit(
+                import_one_file,
+                path,
+                key,
+                manifest.get(key),
+                profile=profile,
+                full=full,
+                chunk_size=chunk_size,
+            )
+            futures[future] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                status, seconds = future.result()
+                results.append((path, status, seconds, None))
+            except Exception as e:
+                results.append((path, "FAILED", None, e))
+
+    # 3) Summarize the timing of each file
+    # ------------------------------------
+    imported = sum(1 for _, status, _, _ in results if status == "imported")
+    print("-" * 80, f"\nIMPORTED {imported} OF {len(input_files)} FILES WITH {workers} WORKER(S)")
+
+    for path, status, seconds, error in sorted(results, key=lambda r: -(r[2] or 0)):
+        size_mb = input_file_size(path) / 1024 ** 2
+        if error is None:
+            print(f"\t -> {status:<10} {seconds:8.1f} s  {size_mb:8.1f} MB  {path.name}")
+        else:
+            print(f"\t -> {status:<10}   {'':8} {size_mb:8.1f} MB  {path.name}: {error}")
+
+    # Clear out the local copies of files that have since changed
+    if input_mirror:
+        input_mirror.prune()
+
+    failures = [path.name for path, _, _, error in results if error is not None]
+    if failures:
+        raise RuntimeError(f"{len(failures)} file(s) failed to import: {failures}")
+
+
+# This bounding box overshoots the region
+OSM_BBOX = {"north": 40.601963, "south": 39.478606, "east": -73.885803, "west": -76.210785}
+
+
+def default_osm_snapshot() -> pathlib.Path:
+    """
+    Where the processed OSM edges are saved after the first build
+    """
+    return file_root / "osm" / "osm_edges_drive.parquet"
 
-    print("\t -> Beginning to download...")
-    G = ox.graph_from_bbox(north, south, east, west, network_type="drive")
-    print("\t -> ... download complete")
 
-    # Force the graph to undirected, which removes duplicate edges
-    print("\t -> Forcing graph to undirected edges")
-    G = G.to_undirected()
+def load_osm_graph(source: pathlib.Path = None):
+    """
+    Build the drivable OSM network as a graph.
+
+    :param source: a local ``.osm``/``.xml`` extract, an ``.osm.pbf`` extract,
+                   or a ``.graphml`` file saved by osmnx. Defaults to None,
+                   which downloads ``OSM_BBOX`` from the Overpass API.
+                   ``.osm`` extracts must already be filtered to drivable roads.
+    :type source: pathlib.Path, optional
+    :return: the OSM network
+    :rtype: networkx.MultiDiGraph
+    """
 
-    # Convert to geodataframes and save to DB
-    print("\t -> Converting graph to geodataframes")
-    nodes, edges = ox.graph_to_gdfs(G)
+    if source is None:
+        print("\t -> Beginning to download...")
+        G = ox.graph_from_bbox(
+            OSM_BBOX["north"],
+            OSM_BBOX["south"],
+            OSM_BBOX["east"],
+            OSM_BBOX["west"],
+            network_type="drive",
+        )
+        print("\t -> ... download complete")
 
-    edges = edges.to_crs(epsg=26918)
+    elif source.suffix == ".graphml":
+        print(f"\t -> Loading graph from {source}")
+        G = ox.load_graphml(source)
 
-    sql_tablename = "osm_edges_drive"
+    elif source.name.endswith(".pbf"):
+        # pyrosm is only needed for .pbf extracts
+        import pyrosm
 
-    db.import_geodataframe(edges, sql_tablename)
+        print(f"\t -> Reading drivable network from {source}")
+        bbox = [OSM_BBOX["west"], OSM_BBOX["south"], OSM_BBOX["east"], OSM_BBOX["north"]]
+        osm = pyrosm.OSM(str(source), bounding_box=bbox)
+        nodes, edges = osm.get_network(network_type="driving", nodes=True)
+        G = osm.to_graph(nodes, edges, graph_type="networkx")
 
-    # Make sure uuid extension is available
-    db.execute_via_psycopg2('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
+    elif source.suffix in [".osm", ".xml"]:
+        print(f"\t -> Building graph from {source}")
+        G = ox.graph_from_xml(source)
 
-    # Make a uuid column
-    make_id_query = f"""
-        alter table {sql_tablename} add column osmuuid uuid;
+    else:
+        raise ValueError(f"Can't build an OSM graph from {source}")
 
-        update {sql_tablename} set osmuuid = uuid_generate_v4();
-    """
-    db.execute_via_psycopg2(make_id_query)
+    return G
 
 
-def import_from_daisy_db():
+def import_osm(
+    source: pathlib.Path = None,
+    snapshot: pathlib.Path = None,
+    refresh: bool = False,
+    batch_size: int = 50000,
+):
     """
-    Pipe data directly from the GTFS database on 'daisy'
+    Import OpenStreetMap data to the database with osmnx.
+
+    Edges are streamed from the graph ``batch_size`` at a time, reprojected
+    and written with ``COPY``, with their ``uid``, ``edge_id`` and ``osmuuid``
+    already filled in.
+
+    Each batch is also saved to ``snapshot`` the first time the edges are
+    built, and later imports load that folder of GeoParquet parts instead
+    of downloading the region again. The downloaded graph is saved next to
+    it as GraphML.
+
+    :param source: a local extract or cached graph to build from
+                   (see ``load_osm_graph()``), or a GeoParquet snapshot
+                   to load as-is. Defaults to None.
+    :type source: pathlib.Path, optional
+    :param snapshot: where to save & look for the processed edges,
+                     defaults to ``default_osm_snapshot()``
+    :type snapshot: pathlib.Path, optional
+    :param refresh: rebuild the edges even if the snapshot exists
+    :type refresh: bool, optional
+    :param batch_size: number of edges written at a time, defaults to 50000
+    :type batch_size: int, optional
     """
 
-    daisy_db = pg.Database(
-        "gtfs_from_daisy",
-        pg_dump_path="/Applications/Postgres.app/Contents/Versions/latest/bin/pg_dump",
-        **pg.connections["localhost"],
-    )
+    print("-" * 80, "\nIMPORTING OpenStreetMap DATA")
 
-    # Setting this prevents version conflicts: geopandas installs its own pg_dump
-    # pg_dump is not installed in base, so this uses the system pg_dump
+    if snapshot is None:
+        snapshot = default_osm_snapshot()
 
-    # Tables to copy
-    # (table name, spatial_update_needed)
-    tables = [
-        ("bus_ridership_spring2019", True),
-        ("trolley_ridership_spring2018", True),
-        ("lineroutes", False),
-        ("stoppoints", False),
-        ('"2015base_link"', False),
-    ]
+    save_snapshot_to = None
 
-    for tbl, spatial_update_needed in tables:
+    # Snapshots are folders of GeoParquet parts, or a single file from older runs
+    if source is not None and (source.suffix == ".parquet" or source.is_dir()):
+        print(f"\t -> Loading edges from {source}")
+        batches = read_edge_snapshot(source, batch_size)
 
-        # Pipe data from 'daisy' via pg_dump directly into analysis db on localhost
-        daisy_db.copy_table_to_another_db(tbl, db)
+    elif source is None and snapshot.exists() and not refresh:
+        print(f"\t -> Loading edges from {snapshot}")
+        batches = read_edge_snapshot(snapshot, batch_size)
 
-        sql_updates = []
+    else:
+        G = load_osm_graph(source)
 
-        # Some spatial tables have an undefined SRID of 4326.
-        # This sets is properly to 26918
-        if spatial_update_needed:
-            db.project_spatial_table(tbl, 4326, 26918, "POINT")
+        # Keep the raw download, so the edges can be rebuilt offline
+        if source is None:
+            snapshot.parent.mkdir(parents=True, exist_ok=True)
+            ox.save_graphml(G, snapshot.with_suffix(".graphml"))
 
-        # Each table needs to be moved from public to the 'raw' schema
-        query_update_schema = f"ALTER TABLE {tbl} SET SCHEMA raw;"
-        sql_updates.append(query_update_schema)
+        print("\t -> Streaming undirected edges to the database")
+        batches = iter_edge_batches(G, batch_size, epsg=26918)
+        save_snapshot_to = snapshot
 
-        # SQL tables shouldn't start with numbers. Rename the model links table
-        if tbl == '"2015base_link"':
-            query_rename_table = 'ALTER TABLE raw."2015base_link" RENAME TO model_2015base_link;'
-            sql_updates.append(query_rename_table)
+    copy_edges_to_db(db, batches, "osm_edges_drive", epsg=26918, snapshot=save_snapshot_to)
 
-        # Execute the SQL updates in the local analysis database
-        for sql_cmd in sql_updates:
-            print("\t----", sql_cmd)
-            db.execute_via_psycopg2(sql_cmd)
+
+def import_from_daisy_db(workers: int = 3, refresh: bool = False, dump_dir: pathlib.Path = None):
+    """
+    Copy the GTFS tables from the database on 'daisy' into the 'raw' schema.
+
+    Tables are copied ``workers`` at a time with ``COPY``. The rows are kept
+    in checksummed dump files under ``dump_dir``, so later runs restore from
+    disk instead of reading from 'daisy' again, unless ``refresh`` is True.
+
+    :param workers: number of tables copied at once, defaults to 3
+    :type workers: int, optional
+    :param refresh: read every table from 'daisy' even if a dump exists
+    :type refresh: bool, optional
+    :param dump_dir: folder for the dump files,
+                     defaults to ``{file_root}/daisy_dumps``
+    :type dump_dir: pathlib.Path, optional
+    """
+
+    # Only connect to 'daisy' if a table has to be read from it
+    def connect_to_daisy():
+        return PostgreSQL(
+            DAISY_DB_NAME,
+            un=DAISY_DB_USER,
+            pw=DAISY_DB_PW,
+            host=DAISY_DB_HOST,
+            pool_size=workers,
+        )
+
+    if dump_dir is None:
+        dump_dir = file_root / "daisy_dumps"
+
+    transfer_tables(connect_to_daisy, db, DAISY_TABLES, dump_dir, workers=workers, refresh=refresh)
 
 
 def feature_engineering(
@@ -163,10 +357,14 @@ def feature_engineering(
     speed_mode_input: str = "linkspeedbylinenamecode",
     septa_ridership_input: str = "passloads_segmentlevel_2020_07",
     njt_ridership_input: str = "statsbyline_allgeom",
+    reproject_limit: int = 4,
 ):
     """
     For all input datasets:
         Filter, rename, add necessary columns (/etc.) as needed.
+
+    Spatial layers that aren't in epsg:26918 are reprojected first,
+    ``reproject_limit`` tables at a time.
     """
 
     default_kwargs = {"geom_type": "LINESTRING", "epsg": 26918}
@@ -175,10 +373,8 @@ def feature_engineering(
         db.add_schema(schema)
 
     # Project any spatial layers that aren't in epsg:26918
-    query = "select concat(f_table_schema, '.', f_table_name), srid, type from geometry_columns where srid != 26918"
-    for table_to_project in db.query_via_psycopg2(query):
-        tbl, srid, geom_type = table_to_project
-        db.project_spatial_table(tbl, srid, 26918, geom_type)
+    with db.stage("reproject_spatial_data", profile="index-build"):
+        reproject_layers(db, limit=reproject_limit)
 
     # Define names of the tables that we'll create
     sql_tbl = {
@@ -209,7 +405,7 @@ def feature_engineering(
         and
             avgspeed > 0
     """
-    db.make_geotable_from_query(speed_query, sql_tbl["speed"], **default_kwargs)
+    db.make_geotable_from_query(speed_query, "rtsp_input_speed", schema="speed", **default_kwargs)
 
     # Make a new speed column that forces values over 75 down to 75
     query_over75 = f"""
@@ -220,7 +416,7 @@ def feature_engineering(
             case when avgspeed < 75 then avgspeed else 75 end
         );
     """
-    db.execute_via_psycopg2(query_over75)
+    db.execute(query_over75)
 
     # SEPTA RIDERSHIP
     # ---------------
@@ -230,7 +426,9 @@ def feature_engineering(
         SELECT * FROM raw.{septa_ridership_input}
         WHERE round IS NOT NULL and round > 0;
     """
-    db.make_geotable_from_query(septa_query, sql_tbl["ridership_septa"], **default_kwargs)
+    db.make_geotable_from_query(
+        septa_query, "rtsp_input_ridership_septa", schema="ridership", **default_kwargs
+    )
 
     # NJT RIDERSHIP
     # -------------
@@ -238,10 +436,12 @@ def feature_engineering(
     # Select NJT routes with at least 1 rider
     njt_query = f"""
         SELECT * FROM raw.{njt_ridership_input} t
-        WHERE t.name LIKE 'njt%%' AND dailyrider > 0;
+        WHERE t.name LIKE 'njt%' AND dailyrider > 0;
     """
     njt_kwargs = {"geom_type": "MULTILINESTRING", "epsg": 26918}
-    db.make_geotable_from_query(njt_query, sql_tbl["ridership_njt"], **njt_kwargs)
+    db.make_geotable_from_query(
+        njt_query, "rtsp_input_ridership_njt", schema="ridership", **njt_kwargs
+    )
 
 
 if __name__ == "__main__":
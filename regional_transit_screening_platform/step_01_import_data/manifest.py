@@ -0,0 +1,119 @@
+"""
+Keep track of what was imported from each input file.
+
+``db-setup-from-shp`` saves the size, modified time and SHA-256 of every
+file it imports to ``MANIFEST_TABLE``, so files that haven't changed are
+skipped the next time. ``rtsp run`` reads when each table was imported from
+the same table.
+
+Kept apart from ``main.py`` so the pipeline can read the manifest, and
+the checks can be tested, without importing osmnx.
+"""
+import pathlib
+
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+from .mirror import input_file_hash, input_file_mtime, input_file_size
+
+
+# Records what was imported from each input file, so unchanged files can be skipped
+MANIFEST_TABLE = "raw.import_manifest"
+
+
+def read_manifest(db: PostgreSQL) -> dict:
+    """
+    Get the manifest, creating the table if it doesn't exist yet
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :return: {path: (size, mtime, sha256)}
+    :rtype: dict
+    """
+    db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            path text PRIMARY KEY,
+            size bigint,
+            mtime double precision,
+            sha256 text,
+            table_name text,
+            imported_at timestamptz DEFAULT now()
+        );
+    """
+    )
+
+    rows = db.query_as_list(f"SELECT path, size, mtime, sha256 FROM {MANIFEST_TABLE}")
+
+    return {path: (size, mtime, sha256) for path, size, mtime, sha256 in rows}
+
+
+def record_in_manifest(
+    db: PostgreSQL, key: str, size: int, mtime: float, sha256: str, table_name: str
+):
+    """
+    Add or update the manifest row for one input file.
+
+    ``imported_at`` only moves forward when the contents changed, since
+    ``rtsp run`` uses it to decide if the steps downstream are out of date.
+    """
+    db.execute(
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (path, size, mtime, sha256, table_name, imported_at)
+        VALUES (%s, %s, %s, %s, %s, now())
+        ON CONFLICT (path) DO UPDATE
+        SET size = EXCLUDED.size,
+            mtime = EXCLUDED.mtime,
+            sha256 = EXCLUDED.sha256,
+            table_name = EXCLUDED.table_name,
+            imported_at = CASE
+                WHEN {MANIFEST_TABLE}.sha256 = EXCLUDED.sha256
+                THEN {MANIFEST_TABLE}.imported_at
+                ELSE EXCLUDED.imported_at
+            END;
+    """,
+        params=(key, size, mtime, sha256, table_name),
+    )
+
+
+def file_changed(
+    db: PostgreSQL,
+    path: pathlib.Path,
+    key: str,
+    table_name: str,
+    manifest_row: tuple = None,
+    full: bool = False,
+) -> tuple:
+    """
+    Check an input file against its manifest row.
+
+    A matching size & modified time is enough to skip the file without
+    reading it. Otherwise the file is hashed, and if only the modified time
+    changed, the manifest is updated (keeping ``imported_at``) and it's skipped.
+
+    :param db: the analysis database
+    :type db: PostgreSQL
+    :param path: the .shp or .csv file
+    :type path: pathlib.Path
+    :param key: the file's path relative to the inputs folder
+    :type key: str
+    :param table_name: "schema.table" the file is imported to
+    :type table_name: str
+    :param manifest_row: (size, mtime, sha256) from the last import, if any
+    :type manifest_row: tuple, optional
+    :param full: treat the file as changed no matter what, defaults to False
+    :type full: bool, optional
+    :return: (size, mtime, sha256) of the file if it has to be imported, otherwise None
+    :rtype: tuple
+    """
+
+    size, mtime = input_file_size(path), input_file_mtime(path)
+    if not full and manifest_row and manifest_row[:2] == (size, mtime):
+        return None
+
+    # The file was touched, but the contents may still be the same
+    sha256 = input_file_hash(path)
+    if not full and manifest_row and manifest_row[2] == sha256:
+        record_in_manifest(db, key, size, mtime, sha256, table_name)
+        return None
+
+    return size, mtime, sha256
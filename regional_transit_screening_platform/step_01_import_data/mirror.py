@@ -0,0 +1,265 @@
+"""
+Local copy of the input folder, converted to Parquet.
+
+The inputs live in a synced Google Drive folder, which is slow to read.
+The first time a file is used it's converted to Parquet (GeoParquet for
+spatial data) under the mirror folder, keyed by the hash of its contents.
+Later imports and notebooks read the local copy instead, and can ask for
+only the columns they need.
+
+Usage:
+    mirror = InputMirror("~/rtsp_mirror")
+    stops = mirror.read(file_root / "inputs" / "stops.shp", columns=["stop_id"])
+"""
+import hashlib
+import itertools
+import json
+import pathlib
+import shutil
+import threading
+import uuid
+from typing import Union
+
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+
+def input_file_parts(path: pathlib.Path) -> list:
+    """
+    All files that make up one input. Shapefiles include
+    their sidecar files (.dbf, .shx, .prj, etc.)
+    """
+    if path.suffix == ".shp":
+        return sorted(path.parent.glob(f"{path.stem}.*"))
+
+    return [path]
+
+
+def input_file_size(path: pathlib.Path) -> int:
+    """
+    Size of an input file in bytes, including any sidecar files
+    """
+    return sum(f.stat().st_size for f in input_file_parts(path))
+
+
+def input_file_mtime(path: pathlib.Path) -> float:
+    """
+    Most recent modification time of an input file or its sidecars
+    """
+    return max(f.stat().st_mtime for f in input_file_parts(path))
+
+
+def input_file_hash(path: pathlib.Path) -> str:
+    """
+    SHA-256 of the contents of an input file and its sidecars
+    """
+    sha256 = hashlib.sha256()
+
+    for part in input_file_parts(path):
+        sha256.update(part.name.encode())
+        with open(part, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def part_dtypes(path: pathlib.Path) -> dict:
+    """
+    Column types shared by every Parquet part of a spatial file, from its
+    field definitions. Without them each part gets the types of its own
+    slice: an integer column with a null turns into float64, and a text
+    column that's all null has no type at all.
+    """
+    info = pyogrio.read_info(path)
+    dtypes = dict(zip(info["fields"], info["dtypes"]))
+
+    fixed = {col: "string" for col, dtype in dtypes.items() if dtype == "object"}
+    fixed.update(PostgreSQL._nullable_dtypes(dtypes))
+
+    return fixed
+
+
+class InputMirror:
+    """
+    A folder of input files converted to Parquet.
+
+    Each source is stored as ``{sha256}/part-00000.parquet``, ``part-00001...``,
+    one part per ``chunk_size`` features, so large layers can be read back
+    one part at a time. Every part has the same schema (see ``part_dtypes()``).
+    ``index.json`` remembers the size, modified time and hash of each source,
+    so an unchanged file isn't hashed again.
+
+    :param mirror_dir: folder to hold the converted files
+    :type mirror_dir: Union[pathlib.Path, str]
+    """
+
+    def __init__(self, mirror_dir: Union[pathlib.Path, str]):
+
+        self.MIRROR_DIR = pathlib.Path(mirror_dir).expanduser()
+        self.MIRROR_DIR.mkdir(parents=True, exist_ok=True)
+
+        self._index_path = self.MIRROR_DIR / "index.json"
+        self._lock = threading.Lock()
+
+    def _read_index(self) -> dict:
+        if not self._index_path.exists():
+            return {}
+
+        with open(self._index_path) as f:
+            return json.load(f)
+
+    def _update_index(self, path: pathlib.Path, size: int, mtime: float, sha256: str) -> None:
+        """
+        Remember the state of one source file
+        """
+        with self._lock:
+            index = self._read_index()
+            index[str(path.resolve())] = {"size": size, "mtime": mtime, "sha256": sha256}
+
+            # Write to a temporary file first so a half-written index is never read
+            tmp_path = self._index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2)
+            tmp_path.replace(self._index_path)
+
+    def source_hash(self, path: pathlib.Path) -> str:
+        """
+        Hash of a source file, reusing the stored hash if the
+        file's size and modified time haven't changed
+        """
+        size, mtime = input_file_size(path), input_file_mtime(path)
+
+        entry = self._read_index().get(str(path.resolve()))
+        if entry and (entry["size"], entry["mtime"]) == (size, mtime):
+            return entry["sha256"]
+
+        sha256 = input_file_hash(path)
+        self._update_index(path, size, mtime, sha256)
+
+        return sha256
+
+    def mirror_path(self, sha256: str) -> pathlib.Path:
+        """
+        Folder holding the Parquet parts for a source hash
+        """
+        return self.MIRROR_DIR / sha256
+
+    def convert(
+        self, path: pathlib.Path, sha256: str = None, chunk_size: int = 100000
+    ) -> pathlib.Path:
+        """
+        Make sure a source file has a Parquet copy, converting it if needed.
+
+        :param path: the .shp or .csv file
+        :type path: pathlib.Path
+        :param sha256: hash of the source, if the caller already has it
+        :type sha256: str, optional
+        :param chunk_size: number of features per Parquet part, defaults to 100000
+        :type chunk_size: int, optional
+        :return: folder holding the Parquet parts
+        :rtype: pathlib.Path
+        """
+        if sha256 is None:
+            sha256 = self.source_hash(path)
+        else:
+            self._update_index(path, input_file_size(path), input_file_mtime(path), sha256)
+
+        output_dir = self.mirror_path(sha256)
+        if output_dir.exists():
+            return output_dir
+
+        print(f"\t -> Mirroring {path.name} to {output_dir}")
+
+        # Convert into a temporary folder so a half-written copy is never read
+        tmp_dir = self.MIRROR_DIR / f"{sha256}.tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+
+        try:
+            if path.suffix == ".shp":
+                dtypes = part_dtypes(path)
+
+                for part in itertools.count():
+                    start = part * chunk_size
+                    batch = gpd.read_file(path, rows=slice(start, start + chunk_size))
+                    batch = batch.astype(dtypes)
+
+                    # An empty layer still gets one part, so its columns are kept
+                    if batch.empty and part > 0:
+                        break
+
+                    batch.to_parquet(tmp_dir / f"part-{part:05d}.parquet", index=False)
+
+                    if len(batch) < chunk_size:
+                        break
+            else:
+                df = pd.read_csv(path, low_memory=False)
+                df.to_parquet(tmp_dir / "part-00000.parquet", index=False)
+
+        except Exception:
+            shutil.rmtree(tmp_dir)
+            raise
+
+        try:
+            tmp_dir.rename(output_dir)
+
+        except OSError:
+            # Another worker converted the same file first. Renaming onto a
+            # folder that isn't empty raises ENOTEMPTY on Linux, not FileExistsError.
+            shutil.rmtree(tmp_dir)
+            if not output_dir.exists():
+                raise
+
+        return output_dir
+
+    def read(
+        self, path: pathlib.Path, columns: list = None
+    ) -> Union[pd.DataFrame, gpd.GeoDataFrame]:
+        """
+        Read a source file from its Parquet copy, converting it first if needed.
+
+        :param path: the .shp or .csv file
+        :type path: pathlib.Path
+        :param columns: only read these columns, defaults to None (all)
+        :type columns: list, optional
+        """
+        mirrored = self.convert(path)
+
+        if path.suffix == ".shp":
+            if columns is not None and "geometry" not in columns:
+                columns = list(columns) + ["geometry"]
+            parts = [gpd.read_parquet(p, columns=columns) for p in self.parts(mirrored)]
+            return gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=parts[0].crs)
+
+        return pd.read_parquet(mirrored, columns=columns)
+
+    @staticmethod
+    def parts(mirrored: pathlib.Path) -> list:
+        """
+        The Parquet parts of a mirrored source, in order
+        """
+        return sorted(mirrored.glob("part-*.parquet"))
+
+    def prune(self) -> None:
+        """
+        Delete the copies of sources that have since changed
+        """
+        with self._lock:
+            index = self._read_index()
+
+            # Drop index entries for files that no longer exist
+            index = {p: entry for p, entry in index.items() if pathlib.Path(p).exists()}
+
+            tmp_path = self._index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2)
+            tmp_path.replace(self._index_path)
+
+        in_use = {entry["sha256"] for entry in index.values()}
+
+        for folder in self.MIRROR_DIR.iterdir():
+            if folder.is_dir() and folder.name not in in_use and ".tmp-" not in folder.name:
+                shutil.rmtree(folder)
@@ -0,0 +1,261 @@
+"""
+Stream the edges of an OSM graph into the database.
+
+The graph is never converted to one big GeoDataFrame. Edges are read from
+the graph a batch at a time, reprojected with a single vectorized call,
+given their ids and written with ``COPY`` before the next batch is built.
+Each batch can also be saved as a GeoParquet part, so later imports can
+load the parts without building the graph at all.
+"""
+import itertools
+import pathlib
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import sqlalchemy
+from geoalchemy2 import Geometry
+from pyproj import Transformer
+from shapely.geometry import LineString
+from sqlalchemy.dialects.postgresql import UUID
+
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+
+# The pandas dtype used for an edge attribute, by the kinds of values it holds
+COLUMN_DTYPES = {"bool": "boolean", "int": "Int64", "float": "float64", "text": "object"}
+
+
+def _value_kind(value) -> str:
+    """
+    Classify one attribute value as "bool", "int", "float" or "text".
+    Lists, like the several 'highway' values on a merged edge, count as text.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    return "text"
+
+
+def _as_text(value):
+    """
+    Store a value as text, keeping missing values as None
+    """
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, (list, set, tuple)) and pd.isna(value):
+        return None
+    return str(value)
+
+
+def edge_attribute_dtypes(G) -> dict:
+    """
+    Scan every edge once to find the attributes and a dtype that fits
+    all of each attribute's values, so every batch shares one schema.
+
+    :return: {attribute: pandas dtype}
+    :rtype: dict
+    """
+    kinds = {}
+
+    for _, _, data in G.edges(data=True):
+        for name, value in data.items():
+            if name == "geometry" or value is None:
+                continue
+            kinds.setdefault(name, set()).add(_value_kind(value))
+
+    dtypes = {}
+    for name, seen in kinds.items():
+        if seen == {"bool"}:
+            dtypes[name] = COLUMN_DTYPES["bool"]
+        elif seen == {"int"}:
+            dtypes[name] = COLUMN_DTYPES["int"]
+        elif seen <= {"int", "float"}:
+            dtypes[name] = COLUMN_DTYPES["float"]
+        else:
+            dtypes[name] = COLUMN_DTYPES["text"]
+
+    return dtypes
+
+
+def unique_edges(G):
+    """
+    Yield (u, v, key, data) once per undirected edge. The two directions
+    of a two-way street share a key, so the second one seen is skipped,
+    the same way ``G.to_undirected()`` collapses them.
+    """
+    seen = set()
+
+    for u, v, key, data in G.edges(keys=True, data=True):
+        edge = (min(u, v), max(u, v), key)
+        if edge in seen:
+            continue
+        seen.add(edge)
+
+        yield u, v, key, data
+
+
+def iter_edge_batches(G, batch_size: int = 50000, epsg: int = 26918):
+    """
+    Yield the graph's undirected edges as GeoDataFrames of up to
+    ``batch_size`` rows, reprojected to ``epsg``.
+
+    Edges without a geometry get a straight line between their nodes,
+    as ``ox.graph_to_gdfs()`` does.
+    """
+
+    dtypes = edge_attribute_dtypes(G)
+
+    transformer = Transformer.from_crs(G.graph["crs"], f"epsg:{epsg}", always_xy=True)
+
+    def reproject(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    edges = unique_edges(G)
+
+    for batch in iter(lambda: list(itertools.islice(edges, batch_size)), []):
+
+        columns = {"u": [], "v": [], "key": []}
+        columns.update({name: [] for name in dtypes})
+        geoms = []
+
+        for u, v, key, data in batch:
+            columns["u"].append(u)
+            columns["v"].append(v)
+            columns["key"].append(key)
+
+            for name in dtypes:
+                columns[name].append(data.get(name))
+
+            geom = data.get("geometry")
+            if geom is None:
+                start, end = G.nodes[u], G.nodes[v]
+                geom = LineString([(start["x"], start["y"]), (end["x"], end["y"])])
+            geoms.append(geom)
+
+        df = pd.DataFrame({"u": columns["u"], "v": columns["v"], "key": columns["key"]})
+
+        for name, dtype in dtypes.items():
+            values = pd.Series(columns[name], dtype=object)
+            if dtype == COLUMN_DTYPES["text"]:
+                df[name] = values.map(_as_text)
+            elif dtype == COLUMN_DTYPES["float"]:
+                df[name] = pd.to_numeric(values).astype(dtype)
+            else:
+                df[name] = values.astype(dtype)
+
+        # Reproject every coordinate in the batch with one call
+        geoms = shapely.transform(np.array(geoms, dtype=object), reproject)
+
+        yield gpd.GeoDataFrame(df, geometry=geoms, crs=f"epsg:{epsg}")
+
+
+def read_edge_snapshot(snapshot: pathlib.Path, batch_size: int = 50000):
+    """
+    Yield the edges saved in a snapshot, one batch at a time.
+    A folder is read one GeoParquet part at a time.
+    """
+
+    if snapshot.is_dir():
+        for part in sorted(snapshot.glob("part-*.parquet")):
+            yield gpd.read_parquet(part)
+        return
+
+    # A single GeoParquet file, e.g. from ox.graph_to_gdfs(), with (u, v, key) as the index
+    edges = gpd.read_parquet(snapshot)
+    if "u" not in edges.columns:
+        edges = edges.reset_index()
+
+    for start in range(0, len(edges), batch_size):
+        yield edges.iloc[start : start + batch_size]
+
+
+def copy_edges_to_db(
+    db: PostgreSQL,
+    batches,
+    table_name: str,
+    epsg: int = 26918,
+    snapshot: pathlib.Path = None,
+) -> int:
+    """
+    Write batches of edges to a new table, with ``uid``, ``edge_id`` and
+    ``osmuuid`` assigned as the rows are written.
+
+    :param db: database to write to
+    :type db: PostgreSQL
+    :param batches: GeoDataFrames in EPSG ``epsg`` with u, v, key columns
+    :param table_name: table to replace
+    :type table_name: str
+    :param snapshot: also save each batch as a GeoParquet part in this folder
+    :type snapshot: pathlib.Path, optional
+    :return: number of edges written
+    :rtype: int
+    """
+
+    dtype = {
+        "geom": Geometry("LINESTRING", srid=epsg),
+        "uid": sqlalchemy.Integer,
+        "edge_id": sqlalchemy.Integer,
+        "osmuuid": UUID,
+    }
+
+    # Build the snapshot in a temporary folder, so a failed run never replaces a good one
+    if snapshot is not None:
+        tmp_snapshot = snapshot.parent / f"{snapshot.name}.tmp-{uuid.uuid4().hex}"
+        tmp_snapshot.mkdir(parents=True)
+
+    written = 0
+
+    for part, batch in enumerate(batches):
+
+        if snapshot is not None:
+            batch.to_parquet(tmp_snapshot / f"part-{part:05d}.parquet", index=False)
+
+        ids = np.arange(written + 1, written + len(batch) + 1)
+
+        geoms = shapely.set_srid(np.asarray(batch.geometry.values), epsg)
+
+        df = pd.DataFrame(batch.drop(columns=batch.geometry.name))
+        df["geom"] = shapely.to_wkb(geoms, hex=True, include_srid=True)
+        df["uid"] = ids
+        df["edge_id"] = ids
+        df["osmuuid"] = [str(uuid.uuid4()) for _ in ids]
+
+        if_exists = "replace" if part == 0 else "append"
+        db.import_dataframe(df, table_name, if_exists=if_exists, index=False, dtype=dtype)
+
+        written += len(batch)
+        print(f"\t -> ... {written} edges loaded")
+
+    if snapshot is not None:
+        if snapshot.is_dir():
+            shutil.rmtree(snapshot)
+        elif snapshot.exists():
+            snapshot.unlink()
+        tmp_snapshot.rename(snapshot)
+
+        print(f"\t -> Saved snapshot to {snapshot}")
+
+    # Keys and the spatial index are built once all the rows are in.
+    # uid gets an identity (like the serial it used to be) that carries on
+    # from the ids assigned above, so rows added later don't need one.
+    db.execute(
+        f"""
+        alter table {table_name}
+            add primary key (uid),
+            alter column edge_id set not null,
+            add constraint {table_name}_edge_id_key unique (edge_id);
+        alter table {table_name}
+            alter column uid add generated by default as identity (start with {written + 1});
+    """
+    )
+    db.table_add_spatial_index(table_name)
+
+    return written
@@ -0,0 +1,99 @@
+"""
+Get the text of a PDF's pages with pdfminer, in parallel, with an on-disk cache.
+
+The pages are split into chunks, and each chunk is laid out by pdfminer in
+its own process. The text of every page is cached in a JSON file named
+after the PDF's hash, so a rerun doesn't extract anything again.
+
+This module doesn't touch the database, so the worker processes it starts
+only import what they need.
+"""
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+def pdf_sha256(filepath: Path) -> str:
+    """
+    SHA-256 of the PDF, used to name its cache file
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def extract_page_chunk(filepath: str, page_numbers: list) -> dict:
+    """
+    Use pdfminer to get the text of several pages in one pass over the file.
+
+    pdfminer ends every page with a form feed, which is used
+    to split the text back into pages.
+
+    Returns:
+        - dictionary keyed on zero-indexed page number
+        - values are the page text
+    """
+
+    # Imported here so that each worker process loads it on its own
+    from pdfminer.high_level import extract_text
+
+    text = extract_text(filepath, page_numbers=page_numbers)
+    pages = text.split("\f")
+
+    return dict(zip(page_numbers, pages))
+
+
+def extract_pages(
+    filepath: Path,
+    page_range: range,
+    cache_dir: Path = None,
+    workers: int = 4,
+    chunk_size: int = 20,
+) -> dict:
+    """
+    Get the text of every page in ``page_range``, from the cache if possible.
+
+    Returns:
+        - dictionary keyed on zero-indexed page number
+        - values are the page text
+    """
+
+    if cache_dir is None:
+        cache_dir = filepath.parent / "page_text_cache"
+
+    cache_file = cache_dir / f"{pdf_sha256(filepath)}.json"
+
+    pages = {}
+    if cache_file.exists():
+        with open(cache_file) as f:
+            pages = {int(k): v for k, v in json.load(f).items()}
+
+    missing = [n for n in page_range if n not in pages]
+
+    if missing:
+        print(f"\t -> Extracting text from {len(missing)} pages with {workers} worker(s)")
+
+        chunks = [missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)]
+
+        # Spawn rather than fork: under ``rtsp run`` this runs in a worker thread,
+        # and a fork could copy locks that other threads hold at that moment
+        spawn = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=spawn) as executor:
+            for chunk_pages in executor.map(
+                extract_page_chunk, [str(filepath)] * len(chunks), chunks
+            ):
+                pages.update(chunk_pages)
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(pages, f)
+
+    else:
+        print(f"\t -> Using cached page text from {cache_file}")
+
+    return {n: pages[n] for n in page_range}
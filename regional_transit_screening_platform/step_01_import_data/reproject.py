@@ -0,0 +1,211 @@
+"""
+Bring every spatial table into the analysis projection, EPSG:26918.
+
+Each reprojection rewrites the whole table, so they run at the same time
+on separate connections. Spatial indexes are dropped before the rewrites
+and rebuilt once they're done, instead of being rebuilt inside each one.
+
+Some layers are already in EPSG:26918 but labeled with another SRID (or
+none at all). Their extent gives them away, and they only need the label
+fixed with ``ST_SetSRID``, not a coordinate transform.
+"""
+from regional_transit_screening_platform.step_00_helpers.async_database import (
+    execute_concurrently,
+)
+from regional_transit_screening_platform.step_00_helpers.database import (
+    PostgreSQL,
+    TUNING_PROFILES,
+)
+
+
+ANALYSIS_EPSG = 26918
+
+# Rough bounds of the region, with a wide margin: (xmin, ymin, xmax, ymax)
+REGION_BOUNDS = {
+    26918: (300000, 4200000, 800000, 4650000),
+    4326: (-78.0, 38.0, -72.0, 42.0),
+}
+
+# The real SRID of layers whose label can't be trusted: {"schema.table": srid}
+SRID_OVERRIDES = {}
+
+
+def layers_to_reproject(db: PostgreSQL) -> list:
+    """
+    Get every geometry column that isn't labeled with ``ANALYSIS_EPSG``
+
+    :return: dicts with schema, table, column, srid and geom_type
+    :rtype: list
+    """
+    query = f"""
+        SELECT f_table_schema, f_table_name, f_geometry_column, srid, type
+        FROM geometry_columns
+        WHERE srid != {ANALYSIS_EPSG}
+    """
+    return [
+        {"schema": schema, "table": table, "column": column, "srid": srid, "geom_type": geom_type}
+        for schema, table, column, srid, geom_type in db.query_as_list(query)
+    ]
+
+
+def estimated_extent(db: PostgreSQL, layer: dict) -> tuple:
+    """
+    Get (xmin, ymin, xmax, ymax) of a layer from the planner's statistics.
+    Tables that haven't been analyzed yet are analyzed first.
+    Returns None for an empty table.
+    """
+
+    def read_extent():
+        query = f"""
+            SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+            FROM ST_EstimatedExtent(
+                '{layer["schema"]}', '{layer["table"]}', '{layer["column"]}'
+            ) AS e
+        """
+        try:
+            extent = db.query_as_list(query)[0]
+        except Exception:
+            return None
+        return None if extent[0] is None else extent
+
+    extent = read_extent()
+
+    if extent is None:
+        db.execute(f'ANALYZE {layer["schema"]}."{layer["table"]}";')
+        extent = read_extent()
+
+    return extent
+
+
+def _within(extent: tuple, bounds: tuple) -> bool:
+    xmin, ymin, xmax, ymax = extent
+    return xmin >= bounds[0] and ymin >= bounds[1] and xmax <= bounds[2] and ymax <= bounds[3]
+
+
+def true_srid(db: PostgreSQL, layer: dict) -> int:
+    """
+    Work out which SRID a layer's coordinates are really in.
+
+    In order: ``SRID_OVERRIDES``, then an extent that only makes sense
+    in ``ANALYSIS_EPSG``, then lon/lat coordinates with no SRID at all,
+    and otherwise the layer's own label.
+    """
+
+    full_name = f'{layer["schema"]}.{layer["table"]}'
+    if full_name in SRID_OVERRIDES:
+        return SRID_OVERRIDES[full_name]
+
+    extent = estimated_extent(db, layer)
+    if extent is None:
+        return layer["srid"]
+
+    if _within(extent, REGION_BOUNDS[ANALYSIS_EPSG]):
+        return ANALYSIS_EPSG
+
+    if layer["srid"] == 0 and _within(extent, REGION_BOUNDS[4326]):
+        return 4326
+
+    return layer["srid"]
+
+
+def spatial_indexes(db: PostgreSQL, layer: dict) -> list:
+    """
+    Get (index name, CREATE INDEX statement) for each index on the layer's
+    geometry column that isn't backing a constraint
+    """
+    query = f"""
+        SELECT ic.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = '{layer["schema"]}."{layer["table"]}"'::regclass
+          AND a.attname = '{layer["column"]}'
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+    """
+    return db.query_as_list(query)
+
+
+def _with_profile(statement: str, profile: str) -> str:
+    """
+    Wrap a statement in a transaction that uses a tuning profile's settings.
+    The async connections don't go through ``db.connection()``, so the
+    profile has to be set here.
+    """
+    settings = "".join(
+        f"SET LOCAL {name} = '{value}';\n" for name, value in TUNING_PROFILES[profile].items()
+    )
+    statement = statement.strip().rstrip(";")
+    return f"BEGIN;\n{settings}{statement};\nCOMMIT;"
+
+
+def reproject_layers(db: PostgreSQL, limit: int = 4) -> list:
+    """
+    Reproject every spatial table that isn't in ``ANALYSIS_EPSG``,
+    ``limit`` tables at a time.
+
+    :param db: database to update
+    :type db: PostgreSQL
+    :param limit: maximum number of tables rewritten at once, defaults to 4
+    :type limit: int, optional
+    :return: one dict per layer, with the true srid and "transform" or "relabel"
+    :rtype: list
+    """
+
+    layers = layers_to_reproject(db)
+
+    if not layers:
+        return layers
+
+    print("-" * 80, f"\nREPROJECTING {len(layers)} LAYER(S) TO EPSG:{ANALYSIS_EPSG}")
+
+    rewrites = []
+    indexes = []
+
+    for layer in layers:
+        layer["true_srid"] = true_srid(db, layer)
+
+        table = f'{layer["schema"]}."{layer["table"]}"'
+        column = f'"{layer["column"]}"'
+
+        # Coordinates already in the right projection only need their label fixed
+        if layer["true_srid"] == ANALYSIS_EPSG:
+            layer["action"] = "relabel"
+            using = f"ST_SetSRID({column}, {ANALYSIS_EPSG})"
+        else:
+            layer["action"] = "transform"
+            using = f"ST_Transform(ST_SetSRID({column}, {layer['true_srid']}), {ANALYSIS_EPSG})"
+
+        print(
+            f"\t -> {layer['action']:<9} {layer['schema']}.{layer['table']}"
+            f" (labeled {layer['srid']}, really {layer['true_srid']})"
+        )
+
+        rewrites.append(
+            f"""
+            ALTER TABLE {table}
+            ALTER COLUMN {column} TYPE geometry({layer['geom_type']}, {ANALYSIS_EPSG})
+            USING {using};
+        """
+        )
+
+        # Drop the spatial indexes so the rewrite doesn't rebuild them one by one
+        existing = spatial_indexes(db, layer)
+        for index_name, _ in existing:
+            db.execute(f'DROP INDEX {layer["schema"]}."{index_name}";')
+
+        if existing:
+            indexes.extend(index_sql for _, index_sql in existing)
+        else:
+            indexes.append(f"CREATE INDEX ON {table} USING GIST ({column});")
+
+    try:
+        execute_concurrently(db, [_with_profile(q, "index-build") for q in rewrites], limit=limit)
+    finally:
+        # Put the indexes back even if a rewrite failed
+        print("\t -> Rebuilding spatial indexes")
+        execute_concurrently(db, [_with_profile(q, "index-build") for q in indexes], limit=limit)
+
+    for layer in layers:
+        db.execute(f'ANALYZE {layer["schema"]}."{layer["table"]}";')
+
+    return layers
@@ -1,186 +1,188 @@
-# """
-# `scrape_septa_route_statistics.py`
-# ----------------------------------
+"""
+`scrape_septa_route_statistics.py`
+----------------------------------
 
-# This script exists to scrape data from SEPTA's Route Statistics report.
-# As of 9/25/2020, the latest version available is the 2019 report as a PDF.
+This script exists to scrape data from SEPTA's Route Statistics report.
+As of 9/25/2020, the latest version available is the 2019 report as a PDF.
 
-# Dependencies:
-# -------------
+Dependencies:
+-------------
 
-# pypdf2 - extracts quickly but destroys any semblance of formatting
-# pdfminer - much slower, but is more respectful of the original format
+pdfminer.six - slow, but respectful of the original format
 
-# """
-# import pandas as pd
-# from tqdm import tqdm
-# import PyPDF2
-# from pdfminer.high_level import extract_text
-# from pathlib import Path
+The report is parsed once (see ``pdf_text.py``): the pages are split into
+chunks, and each chunk is laid out by pdfminer in its own process. The same
+text is used to tell the data pages from the others and to pull the stats
+out of them. The text of every page is cached in a JSON file named after
+the PDF's hash, so rerunning the scrape (e.g. after changing the parsing
+below) doesn't extract anything again.
+"""
+from pathlib import Path
 
-# from regional_transit_screening_platform import db, file_root
+import pandas as pd
 
+from regional_transit_screening_platform import db, file_root
 
-# # We need this to be a string instead of pathlib.Path
-# septa_file = file_root / "other data" / "2019 Route Statistics.pdf"
-# septa_file = str(septa_file)
+from .pdf_text import extract_pages
 
 
-# def classify_pages(
-#         filepath: str = septa_file,
-#         start_page: int = 9,
-#         end_page: int = 324):
-#     """
-#         Use pypdf2 to classify each page as 'data' or 'other'
+def default_septa_file() -> Path:
+    """
+    Location of the 2019 report in the project folder
+    """
+    return file_root / "other data" / "2019 Route Statistics.pdf"
 
-#         Returns:
-#             - dictionary keyed on classification
-#             - values are lists of page numbers
 
-#         Note: pypdf2 zero-indexes the pages, so they'll
-#         be one off from the actual PDF page number
-#     """
+def classify_pages(pages: dict):
+    """
+    Classify each page as 'data' or 'other'
 
-#     page_number_classification = {"data": [], "other": []}
-#     page_range = range(start_page, end_page)
+    Returns:
+        - dictionary keyed on classification
+        - values are lists of zero-indexed page numbers
+    """
 
-#     print("Classifying pages ")
+    page_number_classification = {"data": [], "other": []}
 
-#     with open(septa_file, 'rb') as open_pdf:
-#         pdf = PyPDF2.PdfFileReader(open_pdf)
+    for page_number, text in pages.items():
 
-#         for page_number in tqdm(page_range, total=len(page_range)):
-#             page = pdf.getPage(page_number)
+        # Data pages seem to all have "®SEPTA"
+        if "®SEP" in text:
+            status = "data"
+        else:
+            status = "other"
 
-#             text = page.extractText()
+        page_number_classification[status].append(page_number)
 
-#             # Data pages seem to all have "®SEPTA"
-#             if "®SEP" in text:
-#                 status = "data"
-#             else:
-#                 status = "other"
+    return page_number_classification
 
-#             page_number_classification[status].append(page_number)
 
-#     return page_number_classification
+def find_stats_in_list(data: list):
 
+    slice_start = "OPERATING STATISTICS"
 
-# def extract_data(filepath: Path, page_numbers: list):
-#     """
-#         Use pdfminer to extract data from the pages in the page_numbers list
+    if slice_start not in data:
+        # Try adding a trailing space. Some have these
+        slice_start += " "
+        if slice_start not in data:
+            return {}
 
-#         Returns:
-#             - dictionary keyed on PDF page number
-#             - values are the page text as a list, split by '\n'
-#     """
+    # The data we want is between "OPERATING STATISTICS" and "CHARACTERISTICS"
+    start_idx = data.index(slice_start)
+    end_idx = data.index("CHARACTERISTICS")
 
-#     data = {}
-#     for page_number in tqdm(page_numbers, total=len(page_numbers)):
-#         text = extract_text(septa_file, page_numbers=[page_number])
-#         data[page_number + 1] = text.split("\n")
+    # Make a subset that ONLY includes the data to extract
+    subset = data[start_idx : end_idx - 1]
 
-#     return data
+    # Get the index value of the empty lines. There should be 2
+    idx_list = [i for i, x in enumerate(subset) if x == ""]
 
+    if len(idx_list) < 2:
+        return dict(subset)
+    else:
+        labels = subset[idx_list[0] + 1 : idx_list[1]]
+        values = subset[idx_list[1] + 1 :]
 
-# def find_stats_in_list(data: list):
+        return dict(zip(labels, values))
 
-#     slice_start = "OPERATING STATISTICS"
 
-#     if slice_start not in data:
-#         # Try adding a trailing space. Some have these
-#         slice_start += " "
-#         if slice_start not in data:
-#             return {}
+def find_route_name(data: list):
 
-#     # The data we want is between "OPERATING STATISTICS" and "CHARACTERISTICS"
-#     start_idx = data.index(slice_start)
-#     end_idx = data.index("CHARACTERISTICS")
+    if "SERVICE LEVELS" not in data:
+        return "QAQC - different format"
 
-#     # Make a subset that ONLY includes the data to extract
-#     subset = data[start_idx: end_idx - 1]
+    end_idx = data.index("SERVICE LEVELS")
+    header = data[:end_idx]
 
-#     # Get the index value of the empty lines. There should be 2
-#     idx_list = [i for i, x in enumerate(subset) if x == ""]
+    possible_route_names = []
 
-#     if len(idx_list) < 2:
-#         return dict(subset)
-#     else:
-#         labels = subset[idx_list[0] + 1: idx_list[1]]
-#         values = subset[idx_list[1] + 1:]
+    for item in header:
+        if 0 < len(item) <= 5 or item == "Direct":
+            possible_route_names.append(item)
 
-#         return dict(zip(labels, values))
+    if len(possible_route_names) == 0:
+        return "QAQC - no route name options"
+    elif len(possible_route_names) > 1:
+        return "QAQC - multiple possible route names: " + ", ".join(possible_route_names)
 
+    else:
+        return possible_route_names[0]
 
-# def find_route_name(data: list):
 
-#     if "SERVICE LEVELS" not in data:
-#         return "QAQC - different format"
+def scrape_septa_report(
+    filepath: Path = None,
+    start_page: int = 9,
+    end_page: int = 324,
+    workers: int = 4,
+    cache_dir: Path = None,
+):
+    """
+    Scrape the route statistics out of SEPTA's report and save them to SQL.
 
-#     end_idx = data.index("SERVICE LEVELS")
-#     header = data[:end_idx]
+    :param filepath: the report PDF, defaults to ``default_septa_file()``
+    :type filepath: Path, optional
+    :param start_page: first zero-indexed page to read, defaults to 9
+    :type start_page: int, optional
+    :param end_page: zero-indexed page to stop before, defaults to 324
+    :type end_page: int, optional
+    :param workers: number of processes extracting text, defaults to 4
+    :type workers: int, optional
+    :param cache_dir: folder for the page text cache, defaults to
+                      a 'page_text_cache' folder next to the PDF
+    :type cache_dir: Path, optional
+    """
 
-#     possible_route_names = []
+    if filepath is None:
+        filepath = default_septa_file()
 
-#     for item in header:
-#         if 0 < len(item) <= 5 or item == "Direct":
-#             possible_route_names.append(item)
+    print("-" * 80, f"\nSCRAPING {filepath.name}")
 
-#     if len(possible_route_names) == 0:
-#         return "QAQC - no route name options"
-#     elif len(possible_route_names) > 1:
-#         return "QAQC - multiple possible route names: " + ", ".join(possible_route_names)
+    all_stats = []
 
-#     else:
-#         return possible_route_names[0]
+    # Read every page once, then sort out which ones have data
+    pages = extract_pages(
+        filepath, range(start_page, end_page), cache_dir=cache_dir, workers=workers
+    )
+    data_pages = classify_pages(pages)["data"]
 
+    # For each data page, try to extract stats and route name
+    for page_number in data_pages:
+        full_dataset = pages[page_number].split("\n")
 
-# def scrape_septa_report(filepath: str = septa_file):
+        route_name = find_route_name(full_dataset)
+        stats = find_stats_in_list(full_dataset)
 
-#     all_stats = []
+        stats["route_name"] = route_name
 
-#     # Figure out which pages have data we want quickly
-#     page_classification = classify_pages(septa_file)
-#     data_pages = page_classification["data"]
+        # Report the page number as it's printed in the PDF
+        stats["page_number"] = page_number + 1
 
-#     # Scrape the pages with data using a slower but better method
-#     data = extract_data(septa_file, data_pages)
+        all_stats.append(stats)
 
-#     # For each scraped page, try to extract stats and route name
-#     for page_number in data:
-#         full_dataset = data[page_number]
+    # Combine results from each page into a single dataframe
+    df = pd.DataFrame(all_stats)
 
-#         route_name = find_route_name(full_dataset)
-#         stats = find_stats_in_list(full_dataset)
+    # We end up with a few extra columns from some of the more
+    # messy pages, so let's be specific about which columns to keep
+    columns = [
+        "ONE WAY ROUTE MILES (AVG.)",
+        "DAILY AVERAGE (WK) RIDERSHIP",
+        "VEHICLE HOURS (ANNUAL)",
+        "VEHICLE MILES (ANNUAL)",
+        "PEAK VEHICLES",
+        "FULLY ALLOCATED EXPENSES",
+        "PASSENGER REVENUE",
+        "OPERATING RATIO",
+        "ON TIME % (SEASON)",
+        "route_name",
+        "page_number",
+    ]
 
-#         stats["route_name"] = route_name
-#         stats["page_number"] = page_number
+    df = df.reindex(columns=columns)
 
-#         all_stats.append(stats)
+    # Save the dataframe to SQL
+    db.import_dataframe(df, "septa_report_scrape_2019", if_exists="replace")
 
-#     # Combine results from each page into a single dataframe
-#     df = pd.DataFrame(all_stats)
 
-#     # We end up with a few extra columns from some of the more
-#     # messy pages, so let's be specific about which columns to keep
-#     columns = [
-#         'ONE WAY ROUTE MILES (AVG.)',
-#         'DAILY AVERAGE (WK) RIDERSHIP',
-#         'VEHICLE HOURS (ANNUAL)',
-#         'VEHICLE MILES (ANNUAL)',
-#         'PEAK VEHICLES',
-#         'FULLY ALLOCATED EXPENSES',
-#         'PASSENGER REVENUE',
-#         'OPERATING RATIO',
-#         'ON TIME % (SEASON)',
-#         'route_name',
-#         'page_number'
-#     ]
-
-#     df = df[columns]
-
-#     # Save the dataframe to SQL
-#     db.import_dataframe(df, "septa_report_scrape_2019", if_exists="replace")
-
-
-# if __name__ == "__main__":
-#     scrape_septa_report()
+if __name__ == "__main__":
+    scrape_septa_report()
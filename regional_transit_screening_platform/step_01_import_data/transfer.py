@@ -0,0 +1,470 @@
+"""
+Copy tables from another PostgreSQL database into the analysis database.
+
+Each table is read with ``COPY (SELECT ...) TO STDOUT`` on a source
+connection and written with ``COPY ... FROM STDIN`` on a target connection,
+several tables at a time. SRID fixes are part of the SELECT and the target
+table is created directly in its final schema, so nothing needs to be
+updated after the load. The source's primary key, NOT NULL constraints,
+column defaults, serial and identity sequences and other indexes (e.g. GiST)
+are rebuilt on the target, the way ``pg_dump`` would.
+
+The rows pass through a dump file on local disk. Its SHA-256 and the DDL
+needed to rebuild the table are saved next to it, so a rerun restores
+from disk without connecting to the source at all. Pass a function that
+connects to the source instead of a ``PostgreSQL`` object, and it's only
+called when a table is missing or its dump doesn't match.
+"""
+import hashlib
+import json
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Union
+
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+
+# Tables to copy from the GTFS database on 'daisy'
+#   source: table name in the source db's public schema
+#   target: "schema.table" in the analysis db
+#   srid: (epsg the data is really in, epsg to transform it to), for tables
+#         whose geometry was saved without an SRID
+#   geom_type: geometry type to declare when the SRID is fixed
+DAISY_TABLES = [
+    {
+        "source": "bus_ridership_spring2019",
+        "target": "raw.bus_ridership_spring2019",
+        "srid": (4326, 26918),
+        "geom_type": "POINT",
+    },
+    {
+        "source": "trolley_ridership_spring2018",
+        "target": "raw.trolley_ridership_spring2018",
+        "srid": (4326, 26918),
+        "geom_type": "POINT",
+    },
+    {"source": "lineroutes", "target": "raw.lineroutes"},
+    {"source": "stoppoints", "target": "raw.stoppoints"},
+    # SQL tables shouldn't start with numbers, so the model links table is renamed
+    {"source": "2015base_link", "target": "raw.model_2015base_link"},
+]
+
+
+class _HashingWriter:
+    """
+    File wrapper that keeps a running SHA-256 of everything written to it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.f.write(data)
+
+
+def file_sha256(path: pathlib.Path) -> str:
+    """
+    SHA-256 of a dump file
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def source_columns(source_db: PostgreSQL, table: dict) -> list:
+    """
+    Get (column name, SQL type, SELECT expression) for each column of a source table.
+    Geometry columns of tables with an ``srid`` fix are transformed in the SELECT.
+    """
+
+    query = """
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """
+    rows = source_db.query_as_list(query, params=(f'public."{table["source"]}"',))
+
+    columns = []
+    for name, sql_type in rows:
+        expression = f'"{name}"'
+
+        if "srid" in table and sql_type.startswith("geometry"):
+            old_epsg, new_epsg = table["srid"]
+            sql_type = f"geometry({table['geom_type']}, {new_epsg})"
+            expression = f'ST_Transform(ST_SetSRID("{name}", {old_epsg}), {new_epsg})'
+
+        columns.append((name, sql_type, expression))
+
+    return columns
+
+
+def source_primary_key(source_db: PostgreSQL, table: dict) -> list:
+    """
+    Get the primary key columns of a source table, if it has one
+    """
+
+    query = """
+        SELECT a.attname::text
+        FROM pg_index i
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = %s::regclass
+          AND i.indisprimary
+        ORDER BY k.ord
+    """
+    rows = source_db.query_as_list(query, params=(f'public."{table["source"]}"',))
+
+    return [name for (name,) in rows]
+
+
+def source_constraints(source_db: PostgreSQL, table: dict) -> dict:
+    """
+    Get the NOT NULL columns, defaults and sequences of a source table.
+
+    Columns fed by a sequence the table owns are listed under ``serial``
+    (or ``identity``, with ALWAYS or BY DEFAULT), and get a new sequence on
+    the target. Defaults that use any other sequence can't be rebuilt, so
+    they're left out.
+
+    :return: {"not_null": [names], "defaults": {name: expression},
+              "serial": [names], "identity": {name: "ALWAYS" or "BY DEFAULT"}}
+    :rtype: dict
+    """
+
+    source = f'public."{table["source"]}"'
+
+    query = """
+        SELECT a.attname::text,
+               a.attnotnull,
+               a.attidentity::text,
+               pg_get_expr(d.adbin, d.adrelid),
+               pg_get_serial_sequence(%s, a.attname) IS NOT NULL
+        FROM pg_attribute a
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = %s::regclass
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """
+    rows = source_db.query_as_list(query, params=(source, source))
+
+    constraints = {"not_null": [], "defaults": {}, "serial": [], "identity": {}}
+
+    for name, not_null, identity, default, owns_sequence in rows:
+        if not_null:
+            constraints["not_null"].append(name)
+
+        if identity:
+            constraints["identity"][name] = "ALWAYS" if identity == "a" else "BY DEFAULT"
+        elif owns_sequence:
+            constraints["serial"].append(name)
+        elif default and "nextval(" in default:
+            print(f"\t -> Not copying the default of {table['source']}.{name}: {default}")
+        elif default:
+            constraints["defaults"][name] = default
+
+    return constraints
+
+
+def source_indexes(source_db: PostgreSQL, table: dict) -> list:
+    """
+    Get every index of a source table other than its primary key.
+
+    :return: [index name, is it unique, definition from "USING" on] for each index
+    :rtype: list
+    """
+
+    query = """
+        SELECT c.relname::text, i.indisunique, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT i.indisprimary
+        ORDER BY c.relname
+    """
+    rows = source_db.query_as_list(query, params=(f'public."{table["source"]}"',))
+
+    # e.g. 'CREATE INDEX stoppoints_geom_idx ON public.stoppoints USING gist (geom)'
+    return [[name, unique, definition.split(" USING ", 1)[1]] for name, unique, definition in rows]
+
+
+def dump_table(source_db: PostgreSQL, table: dict, dump_dir: pathlib.Path) -> dict:
+    """
+    Write a source table to ``{target}.copy`` in ``dump_dir``, with the
+    details needed to restore it saved to ``{target}.json``.
+
+    :return: the saved details: select, columns, primary_key,
+             constraints, indexes, sha256, bytes
+    :rtype: dict
+    """
+
+    columns = source_columns(source_db, table)
+
+    select = "SELECT {} FROM public.\"{}\"".format(
+        ", ".join(f'{expression} AS "{name}"' for name, _, expression in columns),
+        table["source"],
+    )
+
+    dump_path = dump_dir / f"{table['target']}.copy"
+    tmp_path = dump_path.with_suffix(".tmp")
+
+    with source_db.connection() as connection:
+        cursor = connection.cursor()
+        with open(tmp_path, "wb") as f:
+            writer = _HashingWriter(f)
+            cursor.copy_expert(f"COPY ({select}) TO STDOUT", writer)
+        cursor.close()
+
+    tmp_path.replace(dump_path)
+
+    details = {
+        "table": table,
+        "select": select,
+        "columns": [[name, sql_type] for name, sql_type, _ in columns],
+        "primary_key": source_primary_key(source_db, table),
+        "constraints": source_constraints(source_db, table),
+        "indexes": source_indexes(source_db, table),
+        "sha256": writer.sha256.hexdigest(),
+        "bytes": writer.bytes,
+        "dumped_at": datetime.now().isoformat(),
+    }
+
+    with open(dump_path.with_suffix(".json"), "w") as f:
+        json.dump(details, f, indent=2)
+
+    return details
+
+
+def saved_dump(table: dict, dump_dir: pathlib.Path) -> dict:
+    """
+    Get the details of a table's dump if it's on disk, was made from the
+    same spec and its checksum still matches, otherwise None
+    """
+
+    dump_path = dump_dir / f"{table['target']}.copy"
+    details_path = dump_path.with_suffix(".json")
+
+    if not dump_path.exists() or not details_path.exists():
+        return None
+
+    with open(details_path) as f:
+        details = json.load(f)
+
+    # A dump made with a different spec (e.g. another SRID fix) can't be reused,
+    # and neither can one saved before the constraints and indexes were kept
+    same_spec = details.get("table") == json.loads(json.dumps(table))
+    complete = "constraints" in details and "indexes" in details
+
+    if not same_spec or not complete or details["sha256"] != file_sha256(dump_path):
+        return None
+
+    return details
+
+
+def load_table(target_db: PostgreSQL, table: dict, details: dict, dump_dir: pathlib.Path) -> None:
+    """
+    Recreate the target table from its dump file, in one transaction.
+    The indexes are built after the rows are loaded.
+    """
+
+    schema, table_name = table["target"].split(".")
+    constraints = details["constraints"]
+
+    columns = []
+    for name, sql_type in details["columns"]:
+        column = f'"{name}" {sql_type}'
+
+        if name in constraints["identity"]:
+            column += f" GENERATED {constraints['identity'][name]} AS IDENTITY"
+        elif name in constraints["defaults"]:
+            column += f" DEFAULT {constraints['defaults'][name]}"
+
+        if name in constraints["not_null"]:
+            column += " NOT NULL"
+
+        columns.append(column)
+
+    column_list = ", ".join(columns)
+    sql_copy = f"COPY {schema}.{table_name} FROM STDIN"
+
+    target_db.add_schema(schema)
+
+    with target_db.transaction() as connection:
+        target_db.execute(f"DROP TABLE IF EXISTS {schema}.{table_name};")
+        target_db.execute(f"CREATE TABLE {schema}.{table_name} ({column_list});")
+
+        with target_db.metrics.timed(sql_copy, "copy") as record:
+            cursor = connection.cursor()
+            with open(dump_dir / f"{table['target']}.copy", "rb") as f:
+                cursor.copy_expert(sql_copy, f)
+            record["rows"] = cursor.rowcount
+            cursor.close()
+
+        for name in constraints["serial"]:
+            sequence = f'{schema}."{table_name}_{name}_seq"'
+            target_db.execute(
+                f"""
+                CREATE SEQUENCE {sequence} OWNED BY {schema}.{table_name}."{name}";
+                ALTER TABLE {schema}.{table_name}
+                    ALTER COLUMN "{name}" SET DEFAULT nextval('{sequence}');
+            """
+            )
+
+        # COPY writes the values as they are, so move each sequence past them
+        for name in constraints["serial"] + list(constraints["identity"]):
+            target_db.execute(
+                f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{schema}.{table_name}', '{name}'),
+                    coalesce(max("{name}"), 0) + 1,
+                    false
+                )
+                FROM {schema}.{table_name};
+            """
+            )
+
+        if details["primary_key"]:
+            key = ", ".join(f'"{name}"' for name in details["primary_key"])
+            target_db.execute(f"ALTER TABLE {schema}.{table_name} ADD PRIMARY KEY ({key});")
+
+        for name, unique, definition in details["indexes"]:
+            unique = "UNIQUE " if unique else ""
+            target_db.execute(
+                f'CREATE {unique}INDEX "{name}" ON {schema}.{table_name} USING {definition};'
+            )
+
+    target_db.execute(f"ANALYZE {schema}.{table_name};")
+
+
+def transfer_table(
+    source_db: PostgreSQL,
+    target_db: PostgreSQL,
+    table: dict,
+    dump_dir: pathlib.Path,
+    details: dict = None,
+    profile: str = None,
+) -> tuple:
+    """
+    Copy one table into the target db, from its saved dump if there's a good one.
+
+    :param details: the table's saved dump (see ``saved_dump()``), or None
+                    to read it from ``source_db`` first
+    :type details: dict, optional
+    :return: ("restored" or "copied", number of seconds it took)
+    :rtype: tuple
+    """
+
+    start = time.perf_counter()
+
+    status = "restored"
+
+    # Worker threads don't inherit the caller's tuning profile, so pass it along
+    with target_db.stage(f"transfer {table['target']}", profile=profile):
+        if details is None:
+            details = dump_table(source_db, table, dump_dir)
+            status = "copied"
+
+        load_table(target_db, table, details, dump_dir)
+
+    return status, time.perf_counter() - start
+
+
+def transfer_tables(
+    source_db: Union[PostgreSQL, Callable[[], PostgreSQL]],
+    target_db: PostgreSQL,
+    tables: list,
+    dump_dir: pathlib.Path,
+    workers: int = 3,
+    refresh: bool = False,
+) -> list:
+    """
+    Copy several tables at the same time, using ``workers`` threads.
+    A table that fails doesn't stop the rest, and the failures
+    are raised together at the end.
+
+    The saved dumps are checked first. The source is only needed for the
+    tables without a good dump, so when every dump can be reused a
+    ``source_db`` function is never called.
+
+    :param source_db: database to copy from, or a function that connects to it
+    :type source_db: Union[PostgreSQL, Callable[[], PostgreSQL]]
+    :param target_db: database to copy into
+    :type target_db: PostgreSQL
+    :param tables: specs like the ones in ``DAISY_TABLES``
+    :type tables: list
+    :param dump_dir: folder for the dump files
+    :type dump_dir: pathlib.Path
+    :param workers: number of tables copied at once, defaults to 3
+    :type workers: int, optional
+    :param refresh: ignore saved dumps and read everything from the source
+    :type refresh: bool, optional
+    :return: (target table, status, seconds, error) for each table
+    :rtype: list
+    """
+
+    print("-" * 80, f"\nTRANSFERRING {len(tables)} TABLES")
+
+    dump_dir.mkdir(parents=True, exist_ok=True)
+
+    # Two workers running CREATE SCHEMA IF NOT EXISTS at once can still collide
+    for schema in sorted({table["target"].split(".")[0] for table in tables}):
+        target_db.add_schema(schema)
+
+    profile = target_db.active_profile
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        # Hashing the dumps takes a while for big tables, so check them side by side
+        if refresh:
+            dumps = [None] * len(tables)
+        else:
+            dumps = list(executor.map(lambda table: saved_dump(table, dump_dir), tables))
+
+        to_copy = [table["target"] for table, details in zip(tables, dumps) if details is None]
+
+        if to_copy and callable(source_db):
+            source_db = source_db()
+
+        if to_copy:
+            print(f"\t -> Reading {len(to_copy)} table(s) from {source_db.DATABASE}")
+
+        futures = {
+            executor.submit(
+                transfer_table, source_db, target_db, table, dump_dir, details, profile
+            ): table
+            for table, details in zip(tables, dumps)
+        }
+
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                status, seconds = future.result()
+                results.append((table["target"], status, seconds, None))
+            except Exception as e:
+                results.append((table["target"], "FAILED", None, e))
+
+    for target, status, seconds, error in results:
+        if error is None:
+            print(f"\t -> {status:<10} {seconds:8.1f} s  {target}")
+        else:
+            print(f"\t -> {status:<10}   {'':8}    {target}: {error}")
+
+    failures = [target for target, _, _, error in results if error is not None]
+    if failures:
+        raise RuntimeError(f"{len(failures)} table(s) failed to transfer: {failures}")
+
+    return results
@@ -3,16 +3,18 @@ CLI for the speed data analysis
 """
 import click
 
-from .main import match_speed_features_with_osm, analyze_speed
-
 
 @click.command()
 def speed_match_osm():
     """Match speed segments to OSM features"""
+    from .main import match_speed_features_with_osm
+
     match_speed_features_with_osm()
 
 
 @click.command()
 def speed_analysis():
     """Calculate a weighted average speed for OSM features"""
+    from .main import analyze_speed
+
     analyze_speed()
@@ -22,14 +22,18 @@ def analyze_speed(
     match_table: str = "osm_matched_speed_rtsp_input_speed",
 ):
 
-    # Make a table of all OSM features that matched a speed feature
-    new_tbl = "osm_speed"
+    match_table = db.intermediate(match_table)
+
+    # Make a table of all OSM features that matched a speed feature.
+    # In staging mode it's built in the scratch schema and promoted at the end.
+    new_tbl = db.intermediate("osm_speed")
+    qaqc_tbl = db.intermediate("osm_speed_qaqc")
 
     query = f"""
         select *
         from  osm_edges_drive
-        where osmuuid in (
-            select distinct osmuuid::uuid
+        where edge_id in (
+            select edge_id
             from {match_table}
         )
     """
@@ -43,38 +47,44 @@ def analyze_speed(
         alter table {new_tbl} drop column if exists num_obs;
         alter table {new_tbl} add column num_obs float;
     """
-    db.execute_via_psycopg2(make_speed_col)
-
-    # Analyze each speed feature
-    query = f"select distinct osmuuid from {match_table}"
-    osmid_list = db.query_via_psycopg2(query)
-    for osmuuid in tqdm(osmid_list, total=len(osmid_list)):
-        osmuuid = osmuuid[0]
-
-        speed_query = f"""
-            select
-                sum(cnt * speed) / sum(cnt) as avgspeed,
-                count(speed) as num_obs
-            from {speed_table}
-            where uid in (select distinct data_uid
-                          from {match_table} m
-                          where m.osmuuid = '{osmuuid}')
-        """
-        result = db.query_via_psycopg2(speed_query)
+    db.execute(make_speed_col)
+
+    # Analyze each speed feature. The per-feature query is prepared once
+    # and the updates are sent back to the database in batches.
+    speed_query = f"""
+        select
+            sum(cnt * speed) / sum(cnt) as avgspeed,
+            count(speed) as num_obs
+        from {speed_table}
+        where uid in (select distinct data_uid
+                      from {match_table} m
+                      where m.edge_id = $1)
+    """
+
+    updates = []
+
+    query = f"select distinct edge_id from {match_table}"
+    edge_id_list = db.query_as_list(query)
+    for edge_id in tqdm(edge_id_list, total=len(edge_id_list)):
+        edge_id = edge_id[0]
+
+        result = db.query_prepared("speed_by_osm_feature", speed_query, (edge_id,))
         avgspeed, num_obs = result[0]
 
-        update_query = f"""
-            UPDATE {new_tbl}
-            SET avgspeed = {avgspeed},
-                num_obs = {num_obs}
-            WHERE osmuuid = '{osmuuid}';
-        """
-        db.execute_via_psycopg2(update_query)
+        updates.append((avgspeed, num_obs, edge_id))
+
+    update_query = f"""
+        UPDATE {new_tbl}
+        SET avgspeed = $1,
+            num_obs = $2
+        WHERE edge_id = $3;
+    """
+    db.execute_batch("update_osm_speed", update_query, updates)
 
     # Draw a line from the centroid of the speed feature to the OSM centroid
     qaqc = f"""
         select
-            m.osmuuid,
+            m.edge_id,
             m.data_uid,
             st_makeline(
                 ST_LineInterpolatePoint(f.geom, 0.5),
@@ -83,19 +93,21 @@ def analyze_speed(
         from {match_table} m
         left join
             {new_tbl} s
-            on s.osmuuid = m.osmuuid::uuid
+            on s.edge_id = m.edge_id
         left join
             {speed_table} f
             on f.uid = m.data_uid
     """
-    db.make_geotable_from_query(qaqc, "osm_speed_qaqc", "LINESTRING", 26918)
+    db.make_geotable_from_query(qaqc, qaqc_tbl, "LINESTRING", 26918)
 
     # Add a length column to the QAQC table
     length_col = f"""
-        alter table {new_tbl}_qaqc add column feat_len float;
-        update {new_tbl}_qaqc set feat_len = st_length(geom);
+        alter table {qaqc_tbl} add column feat_len float;
+        update {qaqc_tbl} set feat_len = st_length(geom);
     """
-    db.execute_via_psycopg2(length_col)
+    db.execute(length_col)
+
+    db.promote_table(new_tbl, "osm_speed")
 
 
 if __name__ == "__main__":
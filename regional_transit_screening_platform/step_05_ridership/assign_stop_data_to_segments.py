@@ -1,15 +1,21 @@
 import pandas as pd
 from regional_transit_screening_platform import db
 
+from .seasons import RIDERSHIP_SEASONS, SEASON_TABLES, SHARED_TABLES
 
-def step_01_combine_ridership():
+
+def combined_ridership_query(season: str) -> str:
     """
-    Merge the raw trolley & bus datasets together
+    Build the SQL that merges the bus & trolley stop tables for one season
+    and calculates running boardings, alightings and loads.
     """
-    query = """
+    tables = RIDERSHIP_SEASONS[season]
+
+    return f"""
     WITH
     bus_data AS (
         SELECT
+            '{season}' AS season,
             stop_id,
             stop_name,
             route,
@@ -23,7 +29,7 @@ def step_01_combine_ridership():
             weekday_bo - weekday_le AS change,
             geom
         FROM
-            raw.bus_ridership_spring2019
+            {tables["bus"]}
         WHERE
             mode != 'Trolley'
     ),
@@ -39,6 +45,7 @@ def step_01_combine_ridership():
 
     trolley_data AS (
         SELECT
+            '{season}' AS season,
             stop_id,
             stop_name,
             route,
@@ -51,7 +58,7 @@ def step_01_combine_ridership():
             weekday_le,
             weekday_bo - weekday_le AS change,
             geom
-        FROM raw.trolley_ridership_spring2018
+        FROM {tables["trolley"]}
         ),
 
     trolley_running_sum AS (
@@ -61,36 +68,64 @@ def step_01_combine_ridership():
             SUM(weekday_le) OVER (PARTITION BY route, direction ORDER BY sequence) weekday_tle
         FROM trolley_data
         ORDER BY sequence
-    ),
+    )
 
-    combined_table AS(
-        SELECT
-            *,
-            weekday_tbo - weekday_tle AS weekday_lo
-        FROM bus_running_sum
+    SELECT
+        *,
+        weekday_tbo - weekday_tle AS weekday_lo
+    FROM bus_running_sum
 
-        UNION ALL
+    UNION ALL
 
-        SELECT
-            *,
-            weekday_tbo - weekday_tle AS weekday_lo
-        FROM trolley_running_sum
+    SELECT
+        *,
+        weekday_tbo - weekday_tle AS weekday_lo
+    FROM trolley_running_sum
+    """
+
+
+def step_01_combine_ridership(seasons: tuple = ("rider2019",)):
+    """
+    Merge the raw trolley & bus datasets together,
+    stacking one set of rows per ridership season
+    """
+    season_queries = "\n    UNION ALL\n".join(
+        f"({combined_ridership_query(season)})" for season in seasons
     )
 
+    query = f"""
     SELECT *
-    FROM combined_table
-    ORDER BY route, direction, sequence
+    FROM ({season_queries}) combined_table
+    ORDER BY season, route, direction, sequence
     """
 
     kwargs = {"geom_type": "Point", "epsg": 4326}
 
-    db.make_geotable_from_query(query, "ridership.surface_transit_loads", **kwargs)
+    db.make_geotable_from_query(query, "surface_transit_loads", schema="ridership", **kwargs)
+
+
+def ridership_intermediates(season: str = None) -> dict:
+    """
+    Map each intermediate table to the name used in SQL. In staging mode
+    these are UNLOGGED tables in the scratch schema (see ``db.intermediate()``).
+
+    Without a season, the shared tables are returned.
+    """
+    if season is None:
+        return {name: db.intermediate(f"ridership.{name}") for name in SHARED_TABLES}
+
+    return {name: db.intermediate(f"ridership.{name}_{season}") for name in SEASON_TABLES}
 
 
-def step_02_assign_loads_to_links():
+def step_02_assign_loads_to_links(seasons: tuple = ("rider2019",)):
     """
     Assign loads to model links. Ported over from mega SQL script.
 
+    The line route sequences and the lookup of stops onto links do not
+    depend on the ridership season, so they are built once and shared.
+    Everything downstream of the stop-level loads is then created once
+    per season, with the season as the table name suffix.
+
     Notes:
     -----
         - It's unclear if the code within 'query_prep_stoppoints'
@@ -99,12 +134,15 @@ def step_02_assign_loads_to_links():
           already executed on the database hosted on Daisy.
     """
 
-    query_lineroutes = """
+    tbl = ridership_intermediates()
+
+    query_lineroutes = f"""
         -- need rank column for line routes to use a number to identify the fromto links in order for each line route
         -- need to create an unnested intermediate table, then can add a new SERIAL identifier which will be in the correct order (call it order)
 
-        CREATE TABLE
-        ridership.lineroutes_unnest AS(
+        DROP TABLE IF EXISTS {tbl["lineroutes_unnest"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["lineroutes_unnest"]} AS(
             WITH temp_table AS(
                 SELECT
                     lrid, tsys, linename, lrname, direction, stopsserved, numvehjour,
@@ -120,48 +158,51 @@ def step_02_assign_loads_to_links():
         );
         COMMIT;
 
-        ALTER TABLE ridership.lineroutes_unnest
+        ALTER TABLE {tbl["lineroutes_unnest"]}
         ADD COLUMN total_order SERIAL;
         COMMIT;
 
-        CREATE TABLE
-        ridership.lineroutes_linkseq AS(
+        DROP TABLE IF EXISTS {tbl["lineroutes_linkseq"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["lineroutes_linkseq"]} AS(
             SELECT
                 lrid,
                 tsys,
                 linename,
                 lrname,
                 direction,
-                stoppsserved,
+                stopsserved,
                 numvehjour,
                 fromto,
                 RANK() OVER(
                     PARTITION BY lrid
                     ORDER BY total_order
                 ) AS lrseq
-            FROM ridership.lineroutes_unnest
+            FROM {tbl["lineroutes_unnest"]}
         );
         COMMIT;
     """
 
-    query_gtfs = """
+    query_gtfs = f"""
         --also need to split out LR GTFSid seq and create rank column too
 
-        CREATE TABLE
-        ridership.lineroutes_unnest_gtfs AS(
+        DROP TABLE IF EXISTS {tbl["lineroutes_unnest_gtfs"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["lineroutes_unnest_gtfs"]} AS(
             SELECT
                 lrid, tsys, linename, lrname, direction, stopsserved, numvehjour,
                 UNNEST(gtfsidseq) AS gtfs
-            FROM lineroutes
+            FROM raw.lineroutes
         );
         COMMIT;
 
-        ALTER TABLE ridership.lineroutes_unnest_gtfs
+        ALTER TABLE {tbl["lineroutes_unnest_gtfs"]}
         ADD COLUMN total_order SERIAL;
         COMMIT;
 
-        CREATE TABLE
-        ridership.lineroutes_gtfs AS(
+        DROP TABLE IF EXISTS {tbl["lineroutes_gtfs"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["lineroutes_gtfs"]} AS(
             SELECT
                 lrid,
                 tsys,
@@ -175,19 +216,21 @@ def step_02_assign_loads_to_links():
                     PARTITION BY lrid
                     ORDER BY total_order
                 ) AS gtfsseq
-            FROM ridership.lineroutes_unnest_gtfs
+            FROM {tbl["lineroutes_unnest_gtfs"]}
         );
         COMMIT;
     """
 
-    query_apportion_percentages_to_route_lines = """
+    query_apportion_percentages_to_route_lines = f"""
 
         -- divide ridership across line routes by number of vehicle journeys (evenly to start)
+        -- vehicle journeys come from the model's line routes, so this is the same for every season
 
-        CREATE TABLE
-        ridership.lrid_portions_rider2019 AS(
+        DROP TABLE IF EXISTS {tbl["lrid_portions"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["lrid_portions"]} AS(
             WITH temp_table AS(
-                SELECT 
+                SELECT
                     linename,
                     direction,
                     SUM(numvehjour)::NUMERIC as sum_vehjour
@@ -196,7 +239,7 @@ def step_02_assign_loads_to_links():
             ),
 
             all_lineroutes AS(
-                SELECT 
+                SELECT
                     lrid,
                     linename,
                     direction,
@@ -215,8 +258,8 @@ def step_02_assign_loads_to_links():
                 all_lineroutes
 
             INNER JOIN temp_table
-                    ON temp_table.linename = tblB.linename
-                    AND temp_table.direction = tblB.direction
+                    ON temp_table.linename = all_lineroutes.linename
+                    AND temp_table.direction = all_lineroutes.direction
 
             WHERE
                 temp_table.sum_vehjour <> 0
@@ -284,132 +327,184 @@ def step_02_assign_loads_to_links():
 
     """
 
-    query_assign_link_loads = """
+    query_link_stops = f"""
         --get stoppoints ready to join to line route links with fromto field
         --first manually updated 7 recrods; tonode field had 2 values. In each case, one was a repeat of the fromnode, so it was removed.
         --then line up stop points with links they are on and the portion of the passenger load they should receive
-        CREATE TABLE
-        ridership.linkseq_withloads_bus_rider2019 AS(
+        DROP TABLE IF EXISTS {tbl["linkseq_stops_bus"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_stops_bus"]} AS(
             WITH tblA AS(
                 SELECT spid, gtfsid, linkno, CONCAT(fromonode, CAST(tonode AS numeric)) AS fromto
                 FROM raw.stoppoints
                 WHERE gtfsid <> 0
             ),
             tblB AS(
-                SELECT 
+                SELECT
                     l.*,
                     p.portion
-                FROM ridership.lineroutes_linkseq l
-                INNER JOIN ridership.lrid_portions_rider2019 p
+                FROM {tbl["lineroutes_linkseq"]} l
+                INNER JOIN {tbl["lrid_portions"]} p
                 ON l.lrid = p.lrid
-            ),
-            tblC AS(
+            )
+            SELECT
+                l.lrid,
+                l.tsys,
+                l.linename,
+                l.lrname,
+                l.direction,
+                l.stopsserved,
+                l.numvehjour,
+                l.fromto,
+                l.lrseq,
+                l.portion,
+                a.spid,
+                a.gtfsid,
+                a.linkno
+            FROM tblB l
+            LEFT JOIN tblA a
+            ON a.fromto = l.fromto
+            --for buses only (will repeat later for trolleys)
+            WHERE l.tsys = 'Bus'
+            AND l.lrname LIKE 'sepb%'
+            ORDER BY lrid, lrseq
+            );
+        COMMIT;
+
+        --repeating above for Trolleys
+        DROP TABLE IF EXISTS {tbl["linkseq_stops_trl"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_stops_trl"]} AS(
+            WITH tblA AS(
+                SELECT spid, gtfsid, linkno, CONCAT(fromonode, CAST(tonode AS numeric)) AS fromto
+                FROM raw.stoppoints
+                ),
+            tblB AS(
                 SELECT
-                    l.lrid,
-                    l.tsys,
-                    l.linename,
-                    l.lrname,
-                    l.direction,
-                    l.stopsserved,
-                    l.numvehjour,
-                    l.fromto,
-                    l.lrseq,
-                    l.portion,
-                    a.spid, 
-                    a.gtfsid,
-                    a.linkno
-                FROM tblB l
-                LEFT JOIN tblA a
-                ON a.fromto = l.fromto
-                --for buses only (will repeat later for trolleys)
-                WHERE l.tsys = 'Bus'
-                ORDER BY lrid, lrseq
-            ),
-            tblD AS(
+                    l.*,
+                    p.portion
+                FROM {tbl["lineroutes_linkseq"]} l
+                INNER JOIN {tbl["lrid_portions"]} p
+                ON l.lrid = p.lrid
+                )
+            SELECT
+                l.lrid,
+                l.tsys,
+                l.linename,
+                l.lrname,
+                l.direction,
+                l.stopsserved,
+                l.numvehjour,
+                l.fromto,
+                l.lrseq,
+                l.portion,
+                a.spid,
+                a.gtfsid,
+                a.linkno
+            FROM tblB l
+            LEFT JOIN tblA a
+            ON a.fromto = l.fromto
+            --for trolleys only
+            WHERE (l.tsys = 'Trl' OR l.tsys = 'LRT')
+            AND l.lrname LIKE 'sepb%'
+            ORDER BY lrid, lrseq
+            );
+        COMMIT;
+    """
+
+    shared_queries = [
+        query_lineroutes,
+        query_gtfs,
+        query_apportion_percentages_to_route_lines,
+        # query_prep_stoppoints,
+        query_link_stops,
+    ]
+
+    with db.stage("assign_loads_shared_tables"):
+        for idx, q in enumerate(shared_queries):
+            print("-" * 80)
+            print(f"Shared query # {idx + 1} \n\n")
+            print(q)
+            db.execute(q)
+            db.analyze_scratch_tables()
+
+    for season in seasons:
+        with db.stage(f"assign_loads_{season}"):
+            for idx, q in enumerate(season_load_queries(season)):
+                print("-" * 80)
+                print(f"Season {season}: query # {idx + 1} \n\n")
+                print(q)
+                db.execute(q)
+                db.analyze_scratch_tables()
+
+    ######### incorporate fill_in_linkloads.py
+
+
+def season_load_queries(season: str) -> list:
+    """
+    SQL that attaches one season's stop-level loads to the shared
+    link sequences and averages them by link
+    """
+
+    tbl = {**ridership_intermediates(), **ridership_intermediates(season)}
+
+    query_assign_link_loads = f"""
+        DROP TABLE IF EXISTS {tbl["linkseq_withloads_bus"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_withloads_bus"]} AS(
+            WITH tblD AS(
                 SELECT *
                 FROM ridership.surface_transit_loads
                 WHERE weekday_lo > 0
+                AND season = '{season}'
                 )
             SELECT
                 c.*,
                 d.weekday_lo,
                 (d.weekday_lo * c.portion) AS load_portion
-            FROM tblC c
+            FROM {tbl["linkseq_stops_bus"]} c
             LEFT JOIN tblD d
             ON c.gtfsid = d.stop_id
             AND c.linename = d.route
-            WHERE c.lrname LIKE 'sepb%'
             ORDER BY lrid, lrseq
             );
         COMMIT;
 
         --repeating above for Trolleys
-        CREATE TABLE 
-        ridership.linkseq_withloads_trl_rider2019 AS(
-            WITH tblA AS(
-                SELECT spid, gtfsid, linkno, CONCAT(fromonode, CAST(tonode AS numeric)) AS fromto
-                FROM raw.stoppoints
-                ),
-            tblB AS(
-                SELECT 
-                    l.*,
-                    p.portion
-                FROM ridership.lineroutes_linkseq l
-                INNER JOIN ridership.lrid_portions_rider2019 p
-                ON l.lrid = p.lrid
-                ),
-            tblC AS(
-                SELECT
-                    l.lrid,
-                    l.tsys,
-                    l.linename,
-                    l.lrname,
-                    l.direction,
-                    l.stopsserved,
-                    l.numvehjour,
-                    l.fromto,
-                    l.lrseq,
-                    l.portion,
-                    a.spid, 
-                    a.gtfsid,
-                    a.linkno
-                FROM tblB l
-                LEFT JOIN tblA a
-                ON a.fromto = l.fromto
-                --for trolleys only
-                WHERE l.tsys = 'Trl' OR l.tsys = 'LRT'
-                ORDER BY lrid, lrseq
-                ),
-            tblD AS(
+        DROP TABLE IF EXISTS {tbl["linkseq_withloads_trl"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_withloads_trl"]} AS(
+            WITH tblD AS(
                 SELECT *
                 FROM ridership.surface_transit_loads
                 WHERE weekday_lo > 0
+                AND season = '{season}'
                 )
             SELECT
                 c.*,
                 d.weekday_lo,
                 (d.weekday_lo*c.portion) AS load_portion
-            FROM tblC c
+            FROM {tbl["linkseq_stops_trl"]} c
             LEFT JOIN tblD d
             ON c.spid = (d.stop_id + 100000)
             AND c.linename = d.route
-            WHERE c.lrname LIKE 'sepb%'
             ORDER BY lrid, lrseq
             );
         COMMIT;
 
-        CREATE TABLE 
-        ridership.linkseq_withloads_rider2019 AS(
+        DROP TABLE IF EXISTS {tbl["linkseq_withloads"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_withloads"]} AS(
             SELECT *
-            FROM ridership.linkseq_withloads_bus_rider2019
+            FROM {tbl["linkseq_withloads_bus"]}
             UNION ALL
             SELECT *
-            FROM ridership.linkseq_withloads_trl_rider2019
+            FROM {tbl["linkseq_withloads_trl"]}
             );
         COMMIT;
     """
 
-    query_distribute_loads = """
+    query_distribute_loads = f"""
 
         --Assumption: ridership distributed across line routes by number of vehicle journeys
         --Assumption: if more than one stop is on a link (sometimes up to 6), the load is averaged - it is usually very similar
@@ -417,16 +512,17 @@ def step_02_assign_loads_to_links():
         --clean up repeats from links that have multiple stops (average loads)
         --requires losing detail on gtfsid, but can always get it from the previous table
 
-        CREATE TABLE
-        ridership.linkseq_cleanloads_rider2019 AS(
+        DROP TABLE IF EXISTS {tbl["linkseq_cleanloads"]};
+        CREATE {db.unlogged} TABLE
+        {tbl["linkseq_cleanloads"]} AS(
             WITH tblA AS(
                 SELECT lrid, tsys, linename, direction, stopsserved, numvehjour, fromto, lrseq, COUNT(DISTINCT(gtfsid)), sum(load_portion)
-                FROM ridership.linkseq_withloads_rider2019
+                FROM {tbl["linkseq_withloads"]}
                 GROUP BY lrid, tsys, linename, direction, stopsserved, numvehjour, fromto, lrseq
             )
-            SELECT 
+            SELECT
                 lrid,
-                tsys, 
+                tsys,
                 linename,
                 direction,
                 stopsserved,
@@ -441,29 +537,21 @@ def step_02_assign_loads_to_links():
         COMMIT;
     """
 
-    queries = [
-        query_lineroutes,
-        query_gtfs,
-        query_apportion_percentages_to_route_lines,
-        # query_prep_stoppoints,
-        query_assign_link_loads,
-        query_distribute_loads,
-    ]
+    return [query_assign_link_loads, query_distribute_loads]
 
-    for idx, q in enumerate(queries):
-        print("-" * 80)
-        print(f"Query # {idx + 1} \n\n")
-        print(q)
-        db.execute(q)
 
-    ######### incorporate fill_in_linkloads.py
+def join_loads_to_geom_query(season: str) -> str:
+    """
+    SQL that summarizes one season's filled-in link loads
+    and joins them to the model link geometries
+    """
 
-    query_join_loads_to_geom = """
+    return f"""
 
        ---AFTER PYTHON
         --summarize and join to geometries to view
         --line level results
-        CREATE TABLE loaded_links_linelevel_rider2019 AS(
+        CREATE TABLE loaded_links_linelevel_{season} AS(
             WITH tblA AS(
                 SELECT 
                     no,
@@ -484,7 +572,7 @@ def step_02_assign_loads_to_links():
                     fromto,
                     COUNT(fromto) AS times_used,
                     SUM(CAST(load_portion_avg AS numeric)) AS total_load
-                FROM loaded_links_rider2019
+                FROM loaded_links_{season}
                 WHERE tsys = 'Bus'
                 OR tsys = 'Trl'
                 OR tsys = 'LRT'
@@ -520,7 +608,7 @@ def step_02_assign_loads_to_links():
 
         --aggregate further (and loose line level attributes) for segment level totals
 
-        CREATE TABLE loaded_links_segmentlevel_rider2019 AS(
+        CREATE TABLE loaded_links_segmentlevel_{season} AS(
             WITH tblA AS(
                 SELECT 
                     no,
@@ -535,7 +623,7 @@ def step_02_assign_loads_to_links():
                     fromto,
                     COUNT(fromto) AS times_used,
                     SUM(CAST(load_portion_avg AS numeric)) AS total_load
-                FROM loaded_links_rider2019
+                FROM loaded_links_{season}
                 WHERE tsys = 'Bus'
                 OR tsys = 'Trl'
                 OR tsys = 'LRT'
@@ -566,7 +654,7 @@ def step_02_assign_loads_to_links():
         ---segment level totals with split from/to to allow for summing directionsal segment level loads
         --added 01/06/20 to help Al with Frankford Ave project mapping
         --updated 07/07/2020
-        CREATE TABLE loaded_links_segmentlevel_test_rider2019 AS(
+        CREATE TABLE loaded_links_segmentlevel_test_{season} AS(
             WITH tblA AS(
                 SELECT 
                     no,
@@ -585,7 +673,7 @@ def step_02_assign_loads_to_links():
                     fromto,
                     COUNT(fromto) AS times_used,
                     SUM(CAST(load_portion_avg AS numeric)) AS total_load
-                FROM loaded_links_rider2019
+                FROM loaded_links_{season}
                 WHERE tsys = 'Bus'
                 OR tsys = 'Trl'
                 OR tsys = 'LRT'
@@ -638,12 +726,12 @@ def step_02_assign_loads_to_links():
     """
 
 
-def inner_step_2_fill_in_linkloads():
+def inner_step_2_fill_in_linkloads(season: str = "rider2019"):
 
     loads = db.query_as_list(
-        """
+        f"""
         SELECT *
-        FROM linkseq_cleanloads_rider2019
+        FROM {db.intermediate(f"ridership.linkseq_cleanloads_{season}")}
         ORDER BY lrid, lrseq
         """
     )
@@ -706,7 +794,7 @@ def inner_step_2_fill_in_linkloads():
         "load_portion_avg",
     ]
 
-    db.import_dataframe(df, "loaded_links_rider2019", if_exists="replace", schema="ridership")
+    db.import_dataframe(df, f"loaded_links_{season}", if_exists="replace", schema="ridership")
 
 
 if __name__ == "__main__":
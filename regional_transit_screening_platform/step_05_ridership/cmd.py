@@ -3,22 +3,82 @@ Command-Line Interface for the ridership analysis
 """
 import click
 
-from .main import match_septa_ridership_with_osm, match_njt_ridership_with_osm, analyze_ridership
+from .seasons import RIDERSHIP_SEASONS, SHARED_TABLES, season_tables
 
 
 @click.command()
 def ridership_match_osm_w_septa():
     """Match SEPTA ridership segments with OSM features"""
+    from .main import match_septa_ridership_with_osm
+
     match_septa_ridership_with_osm()
 
 
 @click.command()
 def ridership_match_osm_w_njt():
     """Match SEPTA ridership segments with OSM features"""
+    from .main import match_njt_ridership_with_osm
+
     match_njt_ridership_with_osm()
 
 
 @click.command()
 def ridership_analysis():
     """Calculate an average ridership value for OSM features"""
+    from .main import analyze_ridership
+
     analyze_ridership()
+
+
+@click.command()
+@click.option(
+    "--season",
+    "seasons",
+    multiple=True,
+    default=list(RIDERSHIP_SEASONS),
+    type=click.Choice(list(RIDERSHIP_SEASONS)),
+    help="Ridership season to process. Repeat to process several. Defaults to every season.",
+)
+@click.option(
+    "--engine",
+    default="sql",
+    type=click.Choice(["sql", "numpy"]),
+    help="Calculate running loads with SQL window functions or in memory",
+)
+@click.option("--no-check", is_flag=True, help="Skip the SQL equality check (numpy engine)")
+def ridership_combine_loads(seasons, engine, no_check):
+    """Combine bus & trolley stops and calculate running loads"""
+    if engine == "numpy":
+        from .cumulative_loads import combine_ridership_in_memory
+
+        combine_ridership_in_memory(tuple(seasons), check=not no_check)
+    else:
+        from .assign_stop_data_to_segments import step_01_combine_ridership
+
+        step_01_combine_ridership(tuple(seasons))
+
+    # The table only holds the seasons that were asked for, so it's
+    # only up to date for ``rtsp run`` when every season was
+    if set(seasons) != set(RIDERSHIP_SEASONS):
+        return []
+
+
+@click.command()
+@click.option(
+    "--season",
+    "seasons",
+    multiple=True,
+    default=list(RIDERSHIP_SEASONS),
+    type=click.Choice(list(RIDERSHIP_SEASONS)),
+    help="Ridership season to process. Repeat to process several. Defaults to every season.",
+)
+def ridership_assign_loads(seasons):
+    """Assign stop-level loads to model links, by season"""
+    from .assign_stop_data_to_segments import step_02_assign_loads_to_links
+
+    step_02_assign_loads_to_links(tuple(seasons))
+
+    # Only the seasons that were asked for are recorded for ``rtsp run``
+    return [f"ridership.{name}" for name in SHARED_TABLES] + [
+        table for season in seasons for table in season_tables(season)
+    ]
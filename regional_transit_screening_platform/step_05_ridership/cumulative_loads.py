@@ -0,0 +1,228 @@
+"""
+In-memory alternative to ``step_01_combine_ridership``.
+
+The stop tables for each season are pulled into memory once, and the
+running boardings / alightings are calculated with grouped cumulative
+sums in NumPy instead of SQL window functions. The result is loaded
+into ``ridership.surface_transit_loads`` in bulk.
+"""
+import numpy as np
+import pandas as pd
+
+from regional_transit_screening_platform import db
+
+from .assign_stop_data_to_segments import RIDERSHIP_SEASONS, combined_ridership_query
+
+
+# Columns of ``ridership.surface_transit_loads``, in the same
+# order that the SQL version of this step creates them
+LOAD_COLUMNS = [
+    "season",
+    "stop_id",
+    "stop_name",
+    "route",
+    "direction",
+    "sequence",
+    "sign_up",
+    "mode",
+    "source",
+    "weekday_bo",
+    "weekday_le",
+    "change",
+    "geom",
+    "weekday_tbo",
+    "weekday_tle",
+    "weekday_lo",
+]
+
+# Columns used to line up the NumPy and SQL results during the check
+CHECK_KEYS = ["season", "route", "direction", "sequence", "stop_id"]
+CHECK_VALUES = ["weekday_tbo", "weekday_tle", "weekday_lo"]
+
+
+def read_stop_tables(season: str) -> pd.DataFrame:
+    """
+    Pull the bus & trolley stop tables for one season into a single dataframe.
+
+    The 'partition' column records which source table each row came from,
+    since the running sums are calculated separately for buses and trolleys.
+    """
+    tables = RIDERSHIP_SEASONS[season]
+
+    columns = """
+        stop_id, stop_name, route, direction, sequence,
+        sign_up, mode, source, weekday_bo, weekday_le, geom
+    """
+
+    query = f"""
+        SELECT '{season}' AS season, 'bus' AS partition, {columns}
+        FROM {tables["bus"]}
+        WHERE mode != 'Trolley'
+
+        UNION ALL
+
+        SELECT '{season}' AS season, 'trolley' AS partition, {columns}
+        FROM {tables["trolley"]}
+    """
+
+    return db.query_as_df(query)
+
+
+def grouped_running_sum(
+    group_ids: np.ndarray, sequence: np.ndarray, values: np.ndarray
+) -> np.ndarray:
+    """
+    Calculate a running sum of ``values`` within each group, ordered by ``sequence``.
+
+    This mirrors ``SUM(x) OVER (PARTITION BY group ORDER BY sequence)`` in SQL:
+        - rows that share a sequence number within a group get the same total
+        - nulls are skipped, and groups with no values yet stay null
+
+    :param group_ids: integer code for each row's group
+    :type group_ids: np.ndarray
+    :param sequence: sort order within each group
+    :type sequence: np.ndarray
+    :param values: values to sum
+    :type values: np.ndarray
+    :return: running totals, in the same row order as the inputs
+    :rtype: np.ndarray
+    """
+    order = np.lexsort((sequence, group_ids))
+
+    groups = group_ids[order]
+    seq = sequence[order]
+    vals = values[order].astype(float)
+
+    has_value = ~np.isnan(vals)
+    filled = np.where(has_value, vals, 0.0)
+
+    running = np.cumsum(filled)
+    count = np.cumsum(has_value)
+
+    # Subtract whatever accumulated before the start of each group
+    group_start = np.r_[True, groups[1:] != groups[:-1]]
+    group_idx = np.cumsum(group_start) - 1
+    starts = np.flatnonzero(group_start)
+
+    running = running - (running - filled)[starts][group_idx]
+    count = count - (count - has_value)[starts][group_idx]
+
+    # Rows with the same sequence number are peers and share the final total
+    same_seq = (seq[1:] == seq[:-1]) | (np.isnan(seq[1:]) & np.isnan(seq[:-1]))
+    peer_start = np.r_[True, (groups[1:] != groups[:-1]) | ~same_seq]
+    peer_idx = np.cumsum(peer_start) - 1
+    peer_ends = np.flatnonzero(np.r_[peer_start[1:], True])
+
+    running = running[peer_ends][peer_idx]
+    count = count[peer_ends][peer_idx]
+
+    running[count == 0] = np.nan
+
+    result = np.empty_like(running)
+    result[order] = running
+
+    return result
+
+
+def calculate_loads(stops: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add running boardings, alightings and loads to a dataframe of stops
+    """
+    group_ids = (
+        stops.groupby(["season", "partition", "route", "direction"], sort=False, dropna=False)
+        .ngroup()
+        .to_numpy()
+    )
+    sequence = stops["sequence"].to_numpy(dtype=float)
+
+    df = stops.copy()
+    df["change"] = df["weekday_bo"] - df["weekday_le"]
+
+    for col in ["bo", "le"]:
+        df[f"weekday_t{col}"] = grouped_running_sum(
+            group_ids, sequence, df[f"weekday_{col}"].to_numpy(dtype=float)
+        )
+
+    df["weekday_lo"] = df["weekday_tbo"] - df["weekday_tle"]
+
+    df = df.sort_values(["season", "route", "direction", "sequence"], kind="stable")
+
+    return df[LOAD_COLUMNS].reset_index(drop=True)
+
+
+def compare_with_sql_loads(loads: pd.DataFrame, seasons: tuple) -> pd.DataFrame:
+    """
+    Run the SQL version of the calculation and compare it to ``loads``.
+
+    :return: rows where the running totals don't match. Empty if all match.
+    :rtype: pd.DataFrame
+    :raises ValueError: if the two versions don't have the same number of rows
+    """
+    season_queries = " UNION ALL ".join(
+        f"({combined_ridership_query(season)})" for season in seasons
+    )
+    sql_loads = db.query_as_df(
+        f"""
+        SELECT {", ".join(CHECK_KEYS + CHECK_VALUES)}
+        FROM ({season_queries}) combined_table
+    """
+    )
+
+    left = loads[CHECK_KEYS + CHECK_VALUES].sort_values(CHECK_KEYS + CHECK_VALUES)
+    right = sql_loads.sort_values(CHECK_KEYS + CHECK_VALUES)
+
+    # Rows can only be lined up one-to-one if both sides have the same number
+    if len(left) != len(right):
+        raise ValueError(f"{len(left)} rows in memory vs. {len(right)} rows from SQL")
+
+    left = left.reset_index(drop=True)
+    right = right.reset_index(drop=True)
+
+    matches = np.ones(len(left), dtype=bool)
+    for col in CHECK_VALUES:
+        matches &= np.isclose(
+            left[col].to_numpy(dtype=float), right[col].to_numpy(dtype=float), equal_nan=True
+        )
+
+    return left[~matches]
+
+
+def combine_ridership_in_memory(seasons: tuple = ("rider2019",), check: bool = True):
+    """
+    Build ``ridership.surface_transit_loads`` for one or more seasons
+    without using SQL window functions.
+
+    :param seasons: keys of ``RIDERSHIP_SEASONS`` to process
+    :type seasons: tuple
+    :param check: compare the result against the SQL calculation
+                  before writing anything, defaults to True
+    :type check: bool, optional
+    """
+
+    print("-" * 80, "\nCOMBINING RIDERSHIP IN MEMORY")
+
+    stops = pd.concat([read_stop_tables(season) for season in seasons], ignore_index=True)
+    print(f"\t -> {len(stops)} stops across {len(seasons)} season(s)")
+
+    loads = calculate_loads(stops)
+
+    if check:
+        print("\t -> Comparing running totals against the SQL result")
+        mismatches = compare_with_sql_loads(loads, seasons)
+        if len(mismatches) > 0:
+            raise ValueError(f"{len(mismatches)} rows don't match the SQL result")
+
+    # The geometry comes back from the database as hex EWKB text.
+    # Load it as-is and cast it back to a typed geometry column afterwards.
+    schema, table_name = "ridership", "surface_transit_loads"
+    db.import_dataframe(loads, table_name, if_exists="replace", schema=schema, index=False)
+
+    db.execute(
+        f"""
+        ALTER TABLE {schema}.{table_name}
+        ALTER COLUMN geom TYPE geometry(POINT, 4326)
+        USING ST_SetSRID(geom::geometry, 4326);
+    """
+    )
+    db.table_add_uid_column(table_name, schema=schema)
+    db.table_add_spatial_index(table_name, schema=schema)
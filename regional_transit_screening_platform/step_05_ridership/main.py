@@ -15,54 +15,67 @@ def match_njt_ridership_with_osm(ridership_table: str = "rtsp_input_ridership_nj
 
 def analyze_ridership():
 
-    # Make a table of all OSM features that matched a ridership feature
-    query = """
+    septa_match_table = db.intermediate("osm_matched_rtsp_input_ridership_septa")
+    njt_match_table = db.intermediate("osm_matched_rtsp_input_ridership_njt")
+
+    # Make a table of all OSM features that matched a ridership feature.
+    # In staging mode it's built in the scratch schema and promoted at the end.
+    new_tbl = db.intermediate("osm_ridership")
+
+    query = f"""
         select *
-        from  osm_edges
-        where osmuuid in (
-            select distinct osmuuid::uuid from osm_matched_rtsp_input_ridership_septa
+        from  osm_edges_drive
+        where edge_id in (
+            select edge_id from {septa_match_table}
             UNION
-            select distinct osmuuid::uuid from osm_matched_rtsp_input_ridership_njt
+            select edge_id from {njt_match_table}
         )
     """
-    db.make_geotable_from_query(query, "osm_ridership", "LINESTRING", 26918)
+    db.make_geotable_from_query(query, new_tbl, "LINESTRING", 26918)
 
     # Add columns to the OSM edge layer called 'avgspeed' and 'num_obs'
-    make_ridership_col = """
-        alter table osm_ridership drop column if exists ridership;
-        alter table osm_ridership add column ridership float;
+    make_ridership_col = f"""
+        alter table {new_tbl} drop column if exists ridership;
+        alter table {new_tbl} add column ridership float;
 
-        alter table osm_ridership drop column if exists num_obs;
-        alter table osm_ridership add column num_obs float;
+        alter table {new_tbl} drop column if exists num_obs;
+        alter table {new_tbl} add column num_obs float;
     """
     db.execute(make_ridership_col)
 
-    # Analyze each SEPTA ridership feature
-    query = "select distinct osmuuid from osm_matched_rtsp_input_ridership_septa"
-    osmid_list = db.query_as_list(query)
-    for osmuuid in tqdm(osmid_list, total=len(osmid_list)):
-        osmuuid = osmuuid[0]
-
-        ridership_query = f"""
-            select
-                sum(round) / count(uid) as ridership,
-                count(uid) as num_obs
-            from rtsp_input_ridership_septa
-            where uid in (select distinct data_uid
-                          from osm_matched_rtsp_input_ridership_septa m
-                          where m.osmuuid = '{osmuuid}')
-        """
-
-        result = db.query_as_list(ridership_query)
+    # Analyze each SEPTA ridership feature. The per-feature query is
+    # prepared once and the updates are sent back to the database in batches.
+    ridership_query = f"""
+        select
+            sum(round) / count(uid) as ridership,
+            count(uid) as num_obs
+        from rtsp_input_ridership_septa
+        where uid in (select distinct data_uid
+                      from {septa_match_table} m
+                      where m.edge_id = $1)
+    """
+
+    updates = []
+
+    query = f"select distinct edge_id from {septa_match_table}"
+    edge_id_list = db.query_as_list(query)
+    for edge_id in tqdm(edge_id_list, total=len(edge_id_list)):
+        edge_id = edge_id[0]
+
+        result = db.query_prepared("septa_ridership_by_osm_feature", ridership_query, (edge_id,))
         ridership, num_obs = result[0]
 
-        update_query = f"""
-            UPDATE osm_ridership
-            SET ridership = {ridership},
-                num_obs = {num_obs}
-            WHERE osmuuid = '{osmuuid}';
-        """
-        db.execute(update_query)
+        updates.append((ridership, num_obs, edge_id))
+
+    update_query = f"""
+        UPDATE {new_tbl}
+        SET ridership = $1,
+            num_obs = $2
+        WHERE edge_id = $3;
+    """
+    db.execute_batch("update_osm_ridership", update_query, updates)
+
+    db.promote_table(new_tbl, "osm_ridership")
 
     # TODO: NJT logic
 
@@ -71,7 +84,7 @@ def analyze_ridership():
     # # Draw a line from the centroid of the ridership feature to OSM
     # qaqc = f"""
     #     select
-    #         m.osmuuid,
+    #         m.edge_id,
     #         m.data_uid,
     #         st_makeline(
     #             ST_LineInterpolatePoint(f.geom, 0.5),
@@ -80,7 +93,7 @@ def analyze_ridership():
     #     from {match_table} m
     #     left join
     #         osm_ridership s
-    #         on s.osmuuid = m.osmuuid::uuid
+    #         on s.edge_id = m.edge_id
     #     left join
     #         {data_table} f
     #         on f.uid = m.data_uid
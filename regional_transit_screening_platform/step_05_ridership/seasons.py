@@ -0,0 +1,55 @@
+"""
+Ridership seasons, keyed on the suffix used in the output table names.
+Each season points at the raw stop-level tables for bus and trolley.
+
+Kept apart from the analysis code so the CLI and ``rtsp run`` can list
+the seasons, and the tables built for each, without importing pandas or
+connecting to the database.
+
+Only one season exists so far. The stop-level ridership in the daisy
+database (see ``step_01_import_data/transfer.py``) is the spring 2019 bus
+counts and the spring 2018 trolley counts, which are analyzed together.
+To add a season, import its stop tables and add an entry below.
+"""
+
+RIDERSHIP_SEASONS = {
+    "rider2019": {
+        "bus": "raw.bus_ridership_spring2019",
+        "trolley": "raw.trolley_ridership_spring2018",
+    },
+}
+
+# Intermediate tables in the 'ridership' schema that are built while
+# assigning loads to links. The season tables get the season as a suffix.
+SHARED_TABLES = [
+    "lineroutes_unnest",
+    "lineroutes_linkseq",
+    "lineroutes_unnest_gtfs",
+    "lineroutes_gtfs",
+    "lrid_portions",
+    "linkseq_stops_bus",
+    "linkseq_stops_trl",
+]
+SEASON_TABLES = [
+    "linkseq_withloads_bus",
+    "linkseq_withloads_trl",
+    "linkseq_withloads",
+    "linkseq_cleanloads",
+]
+
+
+def stop_tables(seasons: list = None) -> list:
+    """
+    The raw stop-level tables read for ``seasons``, defaults to every season
+    """
+    if seasons is None:
+        seasons = list(RIDERSHIP_SEASONS)
+
+    return sorted({table for season in seasons for table in RIDERSHIP_SEASONS[season].values()})
+
+
+def season_tables(season: str) -> list:
+    """
+    "ridership.*" names of the tables built for one season while assigning loads
+    """
+    return [f"ridership.{name}_{season}" for name in SEASON_TABLES]
@@ -0,0 +1,163 @@
+"""
+Shared fixtures for the test suite.
+
+Tests that need a database connect to a throwaway database on a local
+PostgreSQL server, set with these environment variables:
+
+    TEST_DB_HOST      defaults to localhost
+    TEST_DB_PORT      defaults to 5432
+    TEST_DB_USER      defaults to postgres
+    TEST_DB_PW        defaults to postgres
+    TEST_SQL_DB_NAME  defaults to rtsp_test
+
+The database is dropped and created again for every test session, so
+don't point these at a database you care about. PostGIS isn't required;
+tests that need it are skipped when it isn't installed on the server.
+When the server can't be reached, the database tests are skipped.
+"""
+import os
+
+import psycopg2
+import pytest
+
+import regional_transit_screening_platform as rtsp_package
+
+TEST_DB_HOST = os.getenv("TEST_DB_HOST", "localhost")
+TEST_DB_PORT = int(os.getenv("TEST_DB_PORT", 5432))
+TEST_DB_USER = os.getenv("TEST_DB_USER", "postgres")
+TEST_DB_PW = os.getenv("TEST_DB_PW", "postgres")
+TEST_SQL_DB_NAME = os.getenv("TEST_SQL_DB_NAME", "rtsp_test")
+
+
+def _super_connection():
+    connection = psycopg2.connect(
+        host=TEST_DB_HOST,
+        port=TEST_DB_PORT,
+        user=TEST_DB_USER,
+        password=TEST_DB_PW,
+        dbname="postgres",
+        connect_timeout=3,
+    )
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    return connection
+
+
+def _recreate_database(database: str) -> None:
+    connection = _super_connection()
+    cursor = connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE);")
+    cursor.execute(f"CREATE DATABASE {database} TEMPLATE template0 ENCODING 'UTF8';")
+    connection.close()
+
+
+def _drop_database(database: str) -> None:
+    connection = _super_connection()
+    connection.cursor().execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE);")
+    connection.close()
+
+
+def make_test_db(database: str, **kwargs):
+    """
+    Create an empty database on the test server and return a ``PostgreSQL`` for it
+    """
+    from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+    try:
+        _recreate_database(database)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No test database server at {TEST_DB_HOST}:{TEST_DB_PORT} ({e})")
+
+    return PostgreSQL(
+        database,
+        un=TEST_DB_USER,
+        pw=TEST_DB_PW,
+        host=TEST_DB_HOST,
+        port=TEST_DB_PORT,
+        **kwargs,
+    )
+
+
+@pytest.fixture(scope="session")
+def session_db():
+    db = make_test_db(TEST_SQL_DB_NAME)
+    yield db
+    db.close()
+    _drop_database(TEST_SQL_DB_NAME)
+
+
+@pytest.fixture
+def source_db():
+    """
+    A second database on the test server, for tests that copy between two
+    """
+    db = make_test_db(f"{TEST_SQL_DB_NAME}_source")
+    yield db
+    db.close()
+    _drop_database(f"{TEST_SQL_DB_NAME}_source")
+
+
+@pytest.fixture
+def missing_db(session_db):
+    """
+    A ``PostgreSQL`` for a database that doesn't exist yet, as on a fresh install
+    """
+    from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+    database = f"{TEST_SQL_DB_NAME}_missing"
+    _drop_database(database)
+
+    db = PostgreSQL(database, un=TEST_DB_USER, pw=TEST_DB_PW, host=TEST_DB_HOST, port=TEST_DB_PORT)
+    yield db
+    db.close()
+    _drop_database(database)
+
+
+@pytest.fixture
+def db(session_db):
+    """
+    The test database, with the non-public schemas emptied after each test
+    """
+    yield session_db
+
+    for schema in ["raw", "ridership", "speed", "scratch", "tests"]:
+        session_db.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    tables = session_db.query_as_list(
+        """
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = 'public' AND tablename <> 'spatial_ref_sys'
+    """
+    )
+    for (table,) in tables:
+        session_db.execute(f"DROP TABLE IF EXISTS public.{table} CASCADE;")
+
+    session_db.query_cache = None
+    session_db.metrics.reset()
+    session_db._scratch_ready = False
+
+
+@pytest.fixture
+def has_postgis(db):
+    """
+    Skip the test unless PostGIS can be installed in the test database
+    """
+    available = db.query_as_single_item(
+        "SELECT count(*) > 0 FROM pg_available_extensions WHERE name = 'postgis'"
+    )
+    if not available:
+        pytest.skip("PostGIS isn't installed on the test database server")
+
+    db.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+    return True
+
+
+@pytest.fixture
+def offline_package(monkeypatch, tmp_path):
+    """
+    Stand-ins for the package-level ``db`` and ``file_root``, so that modules
+    which import them can be loaded without a database. Tests that need a
+    module's ``db`` patch it on that module.
+    """
+    # Set the module's globals directly: getattr() would build the real ones
+    monkeypatch.setitem(vars(rtsp_package), "db", None)
+    monkeypatch.setitem(vars(rtsp_package), "file_root", tmp_path)
+    return tmp_path
@@ -0,0 +1,59 @@
+import asyncio
+
+import pandas as pd
+
+from regional_transit_screening_platform.step_00_helpers.async_database import AsyncPostgreSQL
+
+
+def table_columns(db, schema: str, table: str) -> list:
+    return db.query_as_list(
+        f"""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = '{schema}' AND table_name = '{table}'
+        ORDER BY ordinal_position
+    """
+    )
+
+
+def async_import(db, *args, **kwargs):
+    async def run():
+        async with AsyncPostgreSQL(db) as adb:
+            await adb.import_dataframe(*args, **kwargs)
+
+    asyncio.run(run())
+
+
+def stops() -> pd.DataFrame:
+    df = pd.DataFrame({"Stop ID": [11, 12], "route": ["17", "33"]})
+    return df.set_index(pd.Index([5, 6], name="line"))
+
+
+def test_async_import_matches_sync_import(db):
+    db.import_dataframe(stops(), "stops_sync", schema="raw")
+    async_import(db, stops(), "raw.stops_async")
+
+    assert table_columns(db, "raw", "stops_async") == table_columns(db, "raw", "stops_sync")
+    assert db.query_as_list("SELECT line, stop_id, route FROM raw.stops_async ORDER BY 1") == [
+        (5, 11, "17"),
+        (6, 12, "33"),
+    ]
+
+
+def test_async_import_can_skip_the_index(db):
+    async_import(db, stops(), "stops_no_index", index=False)
+
+    assert [name for name, _ in table_columns(db, "public", "stops_no_index")] == [
+        "stop_id",
+        "route",
+    ]
+
+
+def test_async_import_analyzes_scratch_tables(db):
+    async_import(db, stops(), "stops", schema=db.SCRATCH_SCHEMA)
+
+    # reltuples stays at -1 until the table is vacuumed or analyzed
+    reltuples = db.query_as_single_item(
+        f"SELECT reltuples FROM pg_class WHERE oid = '{db.SCRATCH_SCHEMA}.stops'::regclass"
+    )
+    assert reltuples == 2
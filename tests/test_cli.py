@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import regional_transit_screening_platform as rtsp_package
+
+# Runs the CLI, then reports whether the heavy libraries or the database handle were loaded
+RUN_CLI = """
+import atexit, sys
+
+import regional_transit_screening_platform as rtsp_package
+from regional_transit_screening_platform.step_00_helpers.cli import main
+
+@atexit.register
+def report():
+    loaded = [name for name in ("pandas", "geopandas", "osmnx") if name in sys.modules]
+    print("loaded:", ",".join(loaded))
+    print("db built:", "db" in vars(rtsp_package))
+
+main(sys.argv[1:])
+"""
+
+
+@pytest.mark.parametrize("args", [["--help"], ["speed-analysis", "--help"], ["run", "--help"]])
+def test_help_is_fast_and_never_connects(args, tmp_path):
+    # A role and database that don't exist, so any connection attempt would fail the command
+    env = {
+        "SQL_DB_NAME": "rtsp_help_never_connects",
+        "DB_USER": "rtsp_nobody",
+        "PYTHONPATH": str(Path(rtsp_package.__file__).parents[1]),
+    }
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_CLI, *args],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=tmp_path,
+        timeout=30,
+    )
+    elapsed = time.perf_counter() - start
+
+    assert result.returncode == 0, result.stderr
+    assert "Usage:" in result.stdout
+    assert "loaded: \n" in result.stdout
+    assert "db built: False" in result.stdout
+    assert elapsed < 1, f"rtsp {' '.join(args)} took {elapsed:.2f} s"
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def cumulative_loads(offline_package):
+    from regional_transit_screening_platform.step_05_ridership import cumulative_loads
+
+    return cumulative_loads
+
+
+def test_running_sum_restarts_for_each_group(cumulative_loads):
+    group_ids = np.array([1, 0, 0, 1, 0])
+    sequence = np.array([1, 2, 1, 2, 3], dtype=float)
+    values = np.array([10, 2, 1, 20, 3], dtype=float)
+
+    result = cumulative_loads.grouped_running_sum(group_ids, sequence, values)
+
+    np.testing.assert_array_equal(result, [10, 3, 1, 30, 6])
+
+
+def test_running_sum_peers_and_nulls_match_sql(cumulative_loads):
+    group_ids = np.array([0, 0, 0, 0, 0])
+    sequence = np.array([1, 2, 2, 3, 4], dtype=float)
+    values = np.array([np.nan, 1, 2, np.nan, 4])
+
+    result = cumulative_loads.grouped_running_sum(group_ids, sequence, values)
+
+    # Rows 2 and 3 are peers and share a total; the group is null until a value shows up
+    np.testing.assert_array_equal(result, [np.nan, 3, 3, 3, 7])
+
+
+def test_running_sum_agrees_with_window_function(cumulative_loads, db):
+    rng = np.random.default_rng(7)
+    n = 500
+    df = pd.DataFrame(
+        {
+            "group_id": rng.integers(0, 12, n),
+            "sequence": rng.integers(0, 30, n).astype(float),
+            "value": rng.integers(0, 50, n).astype(float),
+        }
+    )
+    df.loc[rng.random(n) < 0.2, "value"] = np.nan
+    df.loc[rng.random(n) < 0.05, "sequence"] = np.nan
+    df["row_id"] = np.arange(n)
+
+    db.import_dataframe(df, "running_sum_check", if_exists="replace", index=False)
+    expected = db.query_as_df(
+        """
+        SELECT row_id,
+               SUM(value) OVER (PARTITION BY group_id ORDER BY sequence) AS total
+        FROM running_sum_check
+        ORDER BY row_id
+    """
+    )
+
+    result = cumulative_loads.grouped_running_sum(
+        df["group_id"].to_numpy(), df["sequence"].to_numpy(), df["value"].to_numpy()
+    )
+
+    np.testing.assert_allclose(result, expected["total"].to_numpy(dtype=float))
+
+
+class FakeDb:
+    def __init__(self, result: pd.DataFrame):
+        self.result = result
+
+    def query_as_df(self, query: str) -> pd.DataFrame:
+        return self.result
+
+
+def check_rows(**values) -> pd.DataFrame:
+    df = pd.DataFrame(
+        {
+            "season": "rider2019",
+            "route": "17",
+            "direction": "N",
+            "sequence": [1, 2],
+            "stop_id": [100, 101],
+            "weekday_tbo": [5.0, 8.0],
+            "weekday_tle": [0.0, 2.0],
+            "weekday_lo": [5.0, 6.0],
+        }
+    )
+    return df.assign(**values)
+
+
+def test_compare_returns_the_rows_that_differ(cumulative_loads, monkeypatch):
+    monkeypatch.setattr(cumulative_loads, "db", FakeDb(check_rows(weekday_lo=[5.0, 7.0])))
+
+    mismatches = cumulative_loads.compare_with_sql_loads(check_rows(), ("rider2019",))
+
+    assert mismatches["stop_id"].tolist() == [101]
+
+
+def test_compare_raises_when_row_counts_differ(cumulative_loads, monkeypatch):
+    monkeypatch.setattr(cumulative_loads, "db", FakeDb(check_rows().head(1)))
+
+    with pytest.raises(ValueError, match="2 rows in memory vs. 1 rows from SQL"):
+        cumulative_loads.compare_with_sql_loads(check_rows(), ("rider2019",))
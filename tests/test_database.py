@@ -0,0 +1,259 @@
+import pandas as pd
+import psycopg2
+import pytest
+
+from regional_transit_screening_platform.step_00_helpers.database import TUNING_PROFILES
+
+
+def test_failed_checkout_gives_back_its_pool_slot(db, monkeypatch):
+    def broken_getconn(*args, **kwargs):
+        raise psycopg2.pool.PoolError("connection pool exhausted")
+
+    monkeypatch.setattr(db.pool, "getconn", broken_getconn)
+
+    # One failure per slot: none of them may keep theirs
+    for _ in range(db.POOL_SIZE):
+        with pytest.raises(psycopg2.pool.PoolError):
+            with db.connection():
+                pass
+
+    monkeypatch.undo()
+
+    assert db._pool_slots._value == db.POOL_SIZE
+    assert db.query_as_single_item("SELECT 1") == 1
+
+
+def test_connection_is_returned_when_the_block_raises(db):
+    with pytest.raises(ValueError):
+        with db.connection():
+            raise ValueError
+
+    assert db._pool_slots._value == db.POOL_SIZE
+
+
+def test_copy_keeps_empty_strings_apart_from_nulls(db):
+    df = pd.DataFrame(
+        {
+            "label": ["", None, "x", 'a "quoted", value'],
+            "count": pd.array([1, None, 3, 4], dtype="Int64"),
+        }
+    )
+
+    db.import_dataframe(df, "copy_round_trip", index=False, chunk_size=3)
+
+    rows = db.query_as_list("SELECT label, count FROM public.copy_round_trip ORDER BY count")
+
+    assert rows == [("", 1), ("x", 3), ('a "quoted", value', 4), (None, None)]
+
+
+def prepare_time(db, name: str):
+    query = f"SELECT prepare_time FROM pg_prepared_statements WHERE name = '{name}'"
+    rows = db.query_as_list(query)
+    return rows[0][0] if rows else None
+
+
+def test_prepared_statement_is_reused_on_the_same_connection(db):
+    query = "SELECT $1::int + 1"
+
+    with db.transaction() as connection:
+        assert db.query_prepared("add_one", query, (1,)) == [(2,)]
+        prepared_at = prepare_time(db, "add_one")
+
+        assert db.query_prepared("add_one", query, (41,)) == [(42,)]
+        assert prepare_time(db, "add_one") == prepared_at
+        assert db._prepared[connection] == {"add_one": query}
+
+        # Same name, new query: prepared again
+        assert db.query_prepared("add_one", "SELECT $1::int + 100", (1,)) == [(101,)]
+
+
+def test_execute_batch_runs_every_parameter_set(db):
+    db.execute("CREATE TABLE public.batch_target (uid int PRIMARY KEY, speed float);")
+    db.execute("INSERT INTO public.batch_target SELECT g, 0 FROM generate_series(1, 250) g;")
+
+    updates = [(uid * 2.0, uid) for uid in range(1, 251)]
+    db.execute_batch(
+        "set_speed", "UPDATE public.batch_target SET speed = $1 WHERE uid = $2", updates, 100
+    )
+
+    record = db.metrics.records[-1]
+    assert (record["kind"], record["rows"]) == ("batch", 250)
+    assert db.query_as_single_item("SELECT sum(speed) FROM public.batch_target") == 250 * 251
+
+    # Nothing to send: no round trip, nothing recorded
+    calls = len(db.metrics.records)
+    db.execute_batch("set_speed", "UPDATE public.batch_target SET speed = $1 WHERE uid = $2", [])
+    assert len(db.metrics.records) == calls
+
+
+def test_slow_batch_gets_its_plan_captured(db, monkeypatch):
+    db.execute("CREATE TABLE public.batch_target (uid int PRIMARY KEY, speed float);")
+    db.execute("INSERT INTO public.batch_target VALUES (1, 0), (2, 0);")
+    monkeypatch.setattr(db.metrics, "explain_threshold", 0)
+
+    db.execute_batch(
+        "set_speed", "UPDATE public.batch_target SET speed = $1 WHERE uid = $2", [(5, 1), (6, 2)]
+    )
+
+    # Writes only get a plain EXPLAIN, so they aren't run a second time
+    plan = db.metrics.records[-1]["plan"][0]["Plan"]
+    assert plan["Node Type"] == "ModifyTable"
+    assert "Actual Total Time" not in plan
+    assert db.query_as_list("SELECT speed FROM public.batch_target ORDER BY uid") == [(5,), (6,)]
+
+
+
+def test_slow_query_is_explained_with_analyze(db, monkeypatch):
+    monkeypatch.setattr(db.metrics, "explain_threshold", 0)
+
+    db.query_as_list("SELECT count(*) FROM generate_series(1, 10)")
+
+    assert "Actual Total Time" in db.metrics.records[-1]["plan"][0]["Plan"]
+
+
+def test_slow_create_table_as_is_explained_without_analyze(db, monkeypatch):
+    monkeypatch.setattr(db.metrics, "explain_threshold", 0)
+
+    db.execute("CREATE TABLE public.explained AS SELECT g AS uid FROM generate_series(1, 10) g;")
+
+    plan = db.metrics.records[-1]["plan"][0]["Plan"]
+    assert plan["Node Type"] == "Function Scan"
+    assert "Actual Total Time" not in plan
+
+def test_geo_chunks_cover_every_row(db, has_postgis):
+    db.execute(
+        """
+        CREATE TABLE public.chunk_source AS
+        SELECT g AS uid, ST_SetSRID(ST_MakePoint(g, g), 26918) AS geom
+        FROM generate_series(1, 5) g;
+    """
+    )
+
+    chunks = list(
+        db.query_as_geo_df_chunks("SELECT * FROM public.chunk_source ORDER BY uid", chunk_size=2)
+    )
+
+    assert [len(gdf) for gdf in chunks] == [2, 2, 1]
+    assert all(gdf.crs.to_epsg() == 26918 for gdf in chunks)
+    assert [point.x for gdf in chunks for point in gdf.geometry] == [1, 2, 3, 4, 5]
+
+
+def show(db, setting: str) -> tuple:
+    """
+    The value of a setting, and the backend that answered
+    """
+    with db.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT current_setting('{setting}'), pg_backend_pid()")
+        return cursor.fetchone()
+
+
+def test_profile_is_applied_and_reset_on_return(db):
+    default, _ = show(db, "work_mem")
+    assert default != TUNING_PROFILES["spatial-join"]["work_mem"]
+
+    with db.tuning_profile("spatial-join"):
+        tuned, pid = show(db, "work_mem")
+        assert tuned == TUNING_PROFILES["spatial-join"]["work_mem"]
+        assert show(db, "max_parallel_workers_per_gather")[0] == "4"
+
+    # The pool hands back the connection that was just returned
+    reset, same_pid = show(db, "work_mem")
+    assert same_pid == pid
+    assert reset == default
+
+
+def test_profile_reaches_pandas_connections(db):
+    default = db.query_as_df("SHOW work_mem")["work_mem"].iloc[0]
+
+    with db.stage("tuned", profile="bulk-load"):
+        tuned = db.query_as_df("SHOW work_mem")["work_mem"].iloc[0]
+
+    assert tuned == TUNING_PROFILES["bulk-load"]["work_mem"]
+    assert db.query_as_df("SHOW work_mem")["work_mem"].iloc[0] == default
+    assert db.active_profile is None
+
+
+def test_unknown_profile_is_refused(db):
+    with pytest.raises(ValueError, match="Unknown tuning profile"):
+        with db.tuning_profile("fast"):
+            pass
+
+
+def persistence(db, table_name: str) -> str:
+    """
+    'u' for an UNLOGGED table, 'p' for a normal one, None if it doesn't exist
+    """
+    query = "SELECT relpersistence FROM pg_class WHERE oid = to_regclass(%s)"
+    rows = db.query_as_list(query, params=(table_name,))
+    return rows[0][0] if rows else None
+
+
+def test_intermediates_are_unlogged_in_scratch_when_staging(db, monkeypatch):
+    monkeypatch.setattr(db, "STAGING", True)
+
+    table = db.intermediate("ridership.lrid_portions")
+    assert table == f"{db.SCRATCH_SCHEMA}.ridership_lrid_portions"
+
+    db.execute(f"CREATE {db.unlogged} TABLE {table} AS SELECT 1 AS lrid;")
+    assert persistence(db, table) == "u"
+
+    db.add_schema("ridership")
+    db.promote_table(table, "ridership.portions")
+
+    assert persistence(db, table) is None
+    assert persistence(db, "ridership.portions") == "p"
+    assert db.query_as_single_item("SELECT lrid FROM ridership.portions") == 1
+
+    db.clean_scratch()
+    query = f"SELECT count(*) FROM pg_namespace WHERE nspname = '{db.SCRATCH_SCHEMA}'"
+    assert db.query_as_single_item(query) == 0
+
+    # The schema is made again for the next intermediate
+    db.execute(f"CREATE {db.unlogged} TABLE {db.intermediate('again')} (uid int);")
+
+
+def test_intermediates_are_left_alone_outside_staging(db):
+    assert db.intermediate("ridership.lrid_portions") == "ridership.lrid_portions"
+    assert db.unlogged == ""
+
+    db.execute("CREATE TABLE public.kept (uid int);")
+    db.promote_table("public.kept", "public.renamed")
+
+    assert persistence(db, "public.kept") == "p"
+    assert persistence(db, "public.renamed") is None
+
+
+def load_shadow(db, rows: int) -> None:
+    db.execute(
+        f"""
+        CREATE TABLE raw.parcels__shadow (uid serial PRIMARY KEY, code text);
+        CREATE INDEX parcels__shadow_code_idx ON raw.parcels__shadow (code);
+        INSERT INTO raw.parcels__shadow (code) SELECT 'p' || g FROM generate_series(1, {rows}) g;
+    """
+    )
+
+
+def test_swap_table_renames_indexes_and_sequences(db):
+    db.add_schema("raw")
+
+    load_shadow(db, 3)
+    db.swap_table("parcels__shadow", "parcels", schema="raw")
+
+    # The next load can reuse the shadow names
+    load_shadow(db, 5)
+    db.swap_table("parcels__shadow", "parcels", schema="raw")
+
+    assert db.query_as_single_item("SELECT count(*) FROM raw.parcels") == 5
+    assert db.query_as_single_item("SELECT to_regclass('raw.parcels__shadow')") is None
+
+    indexes = db.query_as_list(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'raw' ORDER BY indexname"
+    )
+    assert indexes == [("parcels_code_idx",), ("parcels_pkey",)]
+
+    # The uid sequence moved with the table and keeps counting from the new rows
+    sequence = db.query_as_single_item("SELECT pg_get_serial_sequence('raw.parcels', 'uid')")
+    assert sequence == "raw.parcels_uid_seq"
+    db.execute("INSERT INTO raw.parcels (code) VALUES ('new');")
+    assert db.query_as_single_item("SELECT uid FROM raw.parcels WHERE code = 'new'") == 6
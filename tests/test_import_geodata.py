@@ -0,0 +1,86 @@
+import io
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from regional_transit_screening_platform.step_00_helpers.database import PostgreSQL
+
+
+def stops(n: int = 6) -> gpd.GeoDataFrame:
+    # The only null stop_id is in the last batch of two
+    stop_id = pd.array([10, 11, 12, 13, None, 15], dtype="Int64")[:n]
+    return gpd.GeoDataFrame(
+        {
+            "stop_id": stop_id,
+            "name": [f"stop {i}" for i in range(n)],
+            "accessible": [True] * n,
+        },
+        geometry=[Point(i, i) for i in range(n)],
+        crs="EPSG:4326",
+    )
+
+
+def copy_text(df: pd.DataFrame) -> str:
+    buffer = io.StringIO()
+    df.drop(columns="geometry").to_csv(buffer, header=False, index=False)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def stops_file(tmp_path):
+    path = tmp_path / "stops.gpkg"
+    stops().to_file(path, engine="pyogrio")
+    return path
+
+
+def test_file_batches_share_one_set_of_types(stops_file):
+    batches = [batch for _, batch in PostgreSQL._read_geodata_batches(stops_file, chunk_size=2)]
+
+    assert len(batches) == 3
+    for batch in batches:
+        assert str(batch["stop_id"].dtype) == "Int64"
+        assert str(batch["accessible"].dtype) == "boolean"
+
+    # What COPY gets for the batch with the null
+    assert copy_text(batches[2]).splitlines() == [",stop 4,True", "15,stop 5,True"]
+
+
+def test_parquet_parts_are_cast_to_the_first_part(tmp_path):
+    parts = tmp_path / "stops"
+    parts.mkdir()
+
+    first = stops().iloc[:4].copy()
+    first["stop_id"] = first["stop_id"].astype("int64")
+    first.to_parquet(parts / "part-00000.parquet")
+
+    # A part written from a slice with a null, as float64
+    second = stops().iloc[4:].copy()
+    second["stop_id"] = second["stop_id"].astype("float64")
+    second.to_parquet(parts / "part-00001.parquet")
+
+    batches = dict(PostgreSQL._read_geodata_batches(parts, chunk_size=4))
+
+    assert list(batches) == [0, 4]
+    assert str(batches[4]["stop_id"].dtype) == "Int64"
+    assert copy_text(batches[4]).splitlines() == [",stop 4,True", "15,stop 5,True"]
+
+
+def test_import_geodata_keeps_integer_columns(db, has_postgis, stops_file):
+    db.import_geodata("stops", stops_file, chunk_size=2, schema="raw")
+
+    assert db.query_as_list(
+        """
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'raw' AND table_name = 'stops' AND column_name = 'stop_id'
+    """
+    ) == [("bigint",)]
+    assert db.query_as_list("SELECT stop_id FROM raw.stops ORDER BY uid") == [
+        (10,),
+        (11,),
+        (12,),
+        (13,),
+        (None,),
+        (15,),
+    ]
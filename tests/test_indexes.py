@@ -0,0 +1,56 @@
+from regional_transit_screening_platform.step_00_helpers.cli import start_command
+from regional_transit_screening_platform.step_00_helpers.indexes import (
+    apply_index_registry,
+    registered_indexes,
+    scan_counts,
+)
+
+
+def test_registry_patterns_match_pipeline_tables():
+    assert registered_indexes("raw", "model_2015base_link") == [["fromto"]]
+    assert registered_indexes("public", "osm_edges_drive") == [["edge_id"], ["osmuuid"]]
+    assert registered_indexes("raw", "stoppoints") == [["gtfsid"]]
+
+
+def test_registry_patterns_match_scratch_tables():
+    assert registered_indexes("scratch", "ridership_lineroutes_linkseq") == [
+        ["lrid"],
+        ["fromto"],
+    ]
+    assert registered_indexes("scratch", "ridership_linkseq_cleanloads_rider2019") == [
+        ["lrid", "lrseq"]
+    ]
+
+
+def test_unregistered_table_gets_nothing():
+    assert registered_indexes("public", "septa_report_scrape_2019") == []
+
+
+def test_missing_indexes_are_created_once(db):
+    db.add_schema("raw")
+    db.execute("CREATE TABLE raw.model_2015base_link (no int, fromto text);")
+    db.execute("CREATE TABLE raw.lineroutes (lrid int PRIMARY KEY, linename text);")
+
+    created = apply_index_registry(db, tables=["raw.model_2015base_link", "raw.lineroutes"])
+
+    # lineroutes is already covered by its primary key
+    assert created == ["raw.model_2015base_link (fromto)"]
+    assert apply_index_registry(db, tables=["raw.model_2015base_link"]) == []
+
+
+def test_tables_outside_the_list_are_left_alone(db):
+    db.add_schema("raw")
+    db.execute("CREATE TABLE raw.model_2015base_link (no int, fromto text);")
+
+    assert apply_index_registry(db, tables=["raw.lineroutes"]) == []
+
+
+def test_snapshot_of_a_database_that_does_not_exist_yet_is_empty(missing_db):
+    assert scan_counts(missing_db) == {}
+    assert start_command(missing_db, "db-setup-from-shp") == {}
+
+
+def test_snapshot_counts_scans(db):
+    db.execute("CREATE TABLE public.scanned AS SELECT generate_series(1, 10) AS uid;")
+
+    assert "public.scanned" in scan_counts(db)
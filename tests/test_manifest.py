@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from regional_transit_screening_platform.step_01_import_data import manifest
+from regional_transit_screening_platform.step_01_import_data.manifest import (
+    MANIFEST_TABLE,
+    file_changed,
+    read_manifest,
+    record_in_manifest,
+)
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "stops.csv"
+    path.write_text("stop_id,name\n1,Broad St\n")
+    return path
+
+
+@pytest.fixture
+def manifest_db(db):
+    db.add_schema("raw")
+    read_manifest(db)
+    return db
+
+
+def imported_at(db, key: str):
+    query = f"SELECT imported_at FROM {MANIFEST_TABLE} WHERE path = %s"
+    return db.query_as_list(query, params=(key,))[0][0]
+
+
+def import_and_record(db, path, key: str = "stops.csv") -> tuple:
+    """
+    What a first import does: check the file, then record it
+    """
+    row = file_changed(db, path, key, "raw.stops")
+    record_in_manifest(db, key, *row, "raw.stops")
+    return read_manifest(db)[key]
+
+
+def test_new_file_has_to_be_imported(manifest_db, input_file):
+    size, mtime, sha256 = file_changed(manifest_db, input_file, "stops.csv", "raw.stops")
+
+    assert (size, mtime) == (input_file.stat().st_size, input_file.stat().st_mtime)
+    assert len(sha256) == 64
+
+
+def test_same_size_and_mtime_is_skipped_without_reading(manifest_db, input_file, monkeypatch):
+    row = import_and_record(manifest_db, input_file)
+
+    def no_hashing(path):
+        raise AssertionError("the file shouldn't be read")
+
+    monkeypatch.setattr(manifest, "input_file_hash", no_hashing)
+
+    assert file_changed(manifest_db, input_file, "stops.csv", "raw.stops", row) is None
+
+
+def test_touched_file_with_same_contents_is_skipped(manifest_db, input_file):
+    row = import_and_record(manifest_db, input_file)
+    first_import = imported_at(manifest_db, "stops.csv")
+
+    stat = input_file.stat()
+    os.utime(input_file, (stat.st_atime, stat.st_mtime + 60))
+
+    assert file_changed(manifest_db, input_file, "stops.csv", "raw.stops", row) is None
+
+    # The new mtime is saved, so the next check doesn't hash the file again,
+    # but the table still counts as imported at the first import
+    assert read_manifest(manifest_db)["stops.csv"][1] == stat.st_mtime + 60
+    assert imported_at(manifest_db, "stops.csv") == first_import
+
+
+def test_changed_contents_are_imported(manifest_db, input_file):
+    row = import_and_record(manifest_db, input_file)
+    first_import = imported_at(manifest_db, "stops.csv")
+
+    input_file.write_text("stop_id,name\n1,Broad St\n2,Market St\n")
+    changed = file_changed(manifest_db, input_file, "stops.csv", "raw.stops", row)
+
+    assert changed is not None and changed[2] != row[2]
+
+    record_in_manifest(manifest_db, "stops.csv", *changed, "raw.stops")
+    assert imported_at(manifest_db, "stops.csv") > first_import
+
+
+def test_full_import_ignores_the_manifest(manifest_db, input_file):
+    row = import_and_record(manifest_db, input_file)
+
+    assert file_changed(manifest_db, input_file, "stops.csv", "raw.stops", row, full=True) == row
@@ -0,0 +1,72 @@
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from shapely.geometry import Point
+
+from regional_transit_screening_platform.step_01_import_data import mirror as mirror_module
+from regional_transit_screening_platform.step_01_import_data.mirror import InputMirror
+
+
+@pytest.fixture
+def stops_shp(tmp_path):
+    # The nulls are all in the second part of two
+    stops = gpd.GeoDataFrame(
+        {
+            "stop_id": pd.array([10, 11, 12, None], dtype="Int64"),
+            "name": ["a", "b", None, None],
+        },
+        geometry=[Point(i, i) for i in range(4)],
+        crs="EPSG:4326",
+    )
+    path = tmp_path / "source" / "stops.shp"
+    path.parent.mkdir()
+    stops.to_file(path, engine="pyogrio")
+    return path
+
+
+def test_every_part_has_the_same_schema(tmp_path, stops_shp):
+    mirror = InputMirror(tmp_path / "mirror")
+
+    parts = mirror.parts(mirror.convert(stops_shp, chunk_size=2))
+    schemas = [pq.read_schema(part).remove_metadata() for part in parts]
+
+    assert len(parts) == 2
+    assert schemas[0].equals(schemas[1])
+    assert str(schemas[1].field("stop_id").type) == "int64"
+
+
+def test_read_keeps_integer_columns(tmp_path, stops_shp):
+    mirror = InputMirror(tmp_path / "mirror")
+    mirror.convert(stops_shp, chunk_size=2)
+
+    stops = mirror.read(stops_shp, columns=["stop_id"])
+
+    assert str(stops["stop_id"].dtype) == "Int64"
+    assert stops["stop_id"].tolist()[:3] == [10, 11, 12]
+    assert stops["stop_id"].isna().tolist() == [False, False, False, True]
+
+
+def test_worker_that_loses_the_race_uses_the_other_copy(tmp_path, monkeypatch):
+    source = tmp_path / "stops.csv"
+    source.write_text("stop_id\n1\n2\n")
+
+    mirror = InputMirror(tmp_path / "mirror")
+    sha256 = mirror.source_hash(source)
+    read_csv = pd.read_csv
+
+    def read_while_another_worker_finishes(*args, **kwargs):
+        other = mirror.mirror_path(sha256)
+        other.mkdir()
+        read_csv(source).to_parquet(other / "part-00000.parquet", index=False)
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(mirror_module.pd, "read_csv", read_while_another_worker_finishes)
+
+    output_dir = mirror.convert(source, sha256=sha256)
+
+    assert output_dir == mirror.mirror_path(sha256)
+    assert not list(mirror.MIRROR_DIR.glob("*.tmp-*"))
+
+    monkeypatch.undo()
+    assert mirror.read(source)["stop_id"].tolist() == [1, 2]
@@ -0,0 +1,57 @@
+import sys
+import types
+
+import geopandas as gpd
+from click.testing import CliRunner
+from shapely.geometry import LineString
+
+from regional_transit_screening_platform.step_01_import_data import cmd
+
+
+def test_import_osm_accepts_snapshot_folders(tmp_path, monkeypatch):
+    calls = []
+    fake_main = types.ModuleType("main")
+    fake_main.import_osm = lambda **kwargs: calls.append(kwargs)
+    monkeypatch.setitem(
+        sys.modules, "regional_transit_screening_platform.step_01_import_data.main", fake_main
+    )
+
+    source = tmp_path / "edges"
+    source.mkdir()
+    snapshot = tmp_path / "osm_edges_drive.parquet"
+    snapshot.mkdir()
+
+    result = CliRunner().invoke(
+        cmd.db_import_osm, ["--source", str(source), "--snapshot", str(snapshot)]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert calls[0]["source"] == source
+    assert calls[0]["snapshot"] == snapshot
+
+
+def test_copied_edges_get_new_uids_after_the_last_one(db, has_postgis):
+    from regional_transit_screening_platform.step_01_import_data.osm_edges import (
+        copy_edges_to_db,
+    )
+
+    edges = gpd.GeoDataFrame(
+        {"u": [1, 2, 3], "v": [2, 3, 4], "key": [0, 0, 0]},
+        geometry=[LineString([(i, 0), (i + 1, 0)]) for i in range(3)],
+        crs="EPSG:26918",
+    )
+    copy_edges_to_db(db, [edges.iloc[:2], edges.iloc[2:]], "osm_edges_drive")
+
+    db.execute(
+        """
+        INSERT INTO osm_edges_drive (u, v, key, edge_id)
+        VALUES (4, 5, 0, 4);
+    """
+    )
+
+    assert db.query_as_list("SELECT uid FROM osm_edges_drive ORDER BY uid") == [
+        (1,),
+        (2,),
+        (3,),
+        (4,),
+    ]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from regional_transit_screening_platform.step_01_import_data import pdf_text
+
+
+@pytest.fixture
+def report(tmp_path):
+    """
+    A five page PDF, with "page <n>" written on each page
+    """
+    canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+
+    filepath = tmp_path / "report.pdf"
+    pdf = canvas.Canvas(str(filepath))
+    for n in range(5):
+        pdf.drawString(72, 720, f"page {n}")
+        pdf.showPage()
+    pdf.save()
+
+    return filepath
+
+
+def test_chunk_is_split_back_into_pages(report):
+    pages = pdf_text.extract_page_chunk(str(report), [1, 3, 4])
+
+    assert list(pages) == [1, 3, 4]
+    assert [text.strip() for text in pages.values()] == ["page 1", "page 3", "page 4"]
+
+
+def test_pages_are_the_same_whatever_the_chunk_size(report, tmp_path):
+    one_chunk = pdf_text.extract_pages(report, range(5), cache_dir=tmp_path / "a", workers=1)
+    small_chunks = pdf_text.extract_pages(
+        report, range(5), cache_dir=tmp_path / "b", workers=2, chunk_size=2
+    )
+
+    assert small_chunks == one_chunk
+    assert [one_chunk[n].strip() for n in range(5)] == [f"page {n}" for n in range(5)]
+
+
+def test_cached_pages_are_not_extracted_again(report, tmp_path, capsys):
+    cache_dir = tmp_path / "cache"
+
+    pdf_text.extract_pages(report, range(2), cache_dir=cache_dir, workers=1)
+    cache_file = cache_dir / f"{pdf_text.pdf_sha256(report)}.json"
+    assert cache_file.exists()
+
+    # Only the page that isn't cached yet is extracted
+    capsys.readouterr()
+    pages = pdf_text.extract_pages(report, range(3), cache_dir=cache_dir, workers=1)
+    assert "Extracting text from 1 pages" in capsys.readouterr().out
+    assert pages[2].strip() == "page 2"
+
+    # Everything comes from the cache file now
+    with open(cache_file) as f:
+        cached = json.load(f)
+    cached["0"] = "from the cache"
+    with open(cache_file, "w") as f:
+        json.dump(cached, f)
+
+    pages = pdf_text.extract_pages(report, range(3), cache_dir=cache_dir, workers=1)
+
+    assert "Using cached page text" in capsys.readouterr().out
+    assert pages[0] == "from the cache"
+    assert list(pages) == [0, 1, 2]
+
+
+def test_workers_are_spawned_not_forked(report, tmp_path, monkeypatch):
+    contexts = []
+    executor = pdf_text.ProcessPoolExecutor
+
+    def recording_executor(*args, **kwargs):
+        contexts.append(kwargs.get("mp_context"))
+        return executor(*args, **kwargs)
+
+    monkeypatch.setattr(pdf_text, "ProcessPoolExecutor", recording_executor)
+
+    pdf_text.extract_pages(report, range(2), cache_dir=tmp_path / "cache", workers=1)
+
+    assert [context.get_start_method() for context in contexts] == ["spawn"]
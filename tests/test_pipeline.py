@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+
+import pytest
+from click.testing import CliRunner
+
+import regional_transit_screening_platform as rtsp_package
+from regional_transit_screening_platform.step_00_helpers import cli
+from regional_transit_screening_platform.step_00_helpers.pipeline import (
+    INTERMEDIATE_TABLES,
+    PIPELINE_STATE_TABLE,
+    PIPELINE_STEPS,
+    pipeline_step,
+    plan_steps,
+    record_outputs,
+    step_tables,
+    table_timestamps,
+)
+from regional_transit_screening_platform.step_01_import_data.manifest import (
+    read_manifest,
+    record_in_manifest,
+)
+from regional_transit_screening_platform.step_02_average_speed import cmd as cmd_02
+from regional_transit_screening_platform.step_05_ridership.seasons import (
+    RIDERSHIP_SEASONS,
+    stop_tables,
+)
+
+T0 = datetime(2026, 1, 1)
+
+
+def all_tables() -> set:
+    return {
+        table for step in PIPELINE_STEPS for table in step.get("inputs", []) + step_tables(step)
+    }
+
+
+def up_to_date() -> tuple:
+    """
+    Timestamps and existing tables for a pipeline that has just been run in order
+    """
+    timestamps = {}
+    for i, step in enumerate(PIPELINE_STEPS):
+        for table in step_tables(step):
+            timestamps[table] = T0 + timedelta(minutes=i)
+
+    return timestamps, all_tables()
+
+
+def to_run(reasons: dict) -> set:
+    return {
+        command
+        for command, reason in reasons.items()
+        if reason and not pipeline_step(command).get("always")
+    }
+
+
+def test_nothing_runs_when_everything_is_up_to_date():
+    assert to_run(plan_steps(*up_to_date())) == set()
+
+
+def test_changed_input_runs_the_step_and_everything_downstream():
+    timestamps, existing = up_to_date()
+    timestamps["public.osm_edges_drive"] = T0 + timedelta(days=1)
+
+    reasons = plan_steps(timestamps, existing)
+
+    assert reasons["speed-match-osm"] == "public.osm_edges_drive changed"
+    assert reasons["speed-analysis"] == "speed-match-osm will run"
+    assert "ridership-analysis" in to_run(reasons)
+    assert "ridership-combine-loads" not in to_run(reasons)
+
+
+def test_missing_output_runs_the_step():
+    timestamps, existing = up_to_date()
+    existing.discard("public.osm_speed")
+
+    reasons = plan_steps(timestamps, existing)
+
+    assert reasons["speed-analysis"] == "public.osm_speed is missing"
+    assert to_run(reasons) == {"speed-analysis"}
+
+
+def test_missing_intermediate_is_only_rebuilt_when_it_is_needed():
+    timestamps, existing = up_to_date()
+    existing.discard("osm_matched_speed_rtsp_input_speed")
+
+    assert to_run(plan_steps(timestamps, existing)) == set()
+
+    existing.discard("public.osm_speed")
+    reasons = plan_steps(timestamps, existing)
+
+    assert reasons["speed-match-osm"] == "speed-analysis needs osm_matched_speed_rtsp_input_speed"
+    assert to_run(reasons) == {"speed-match-osm", "speed-analysis"}
+
+
+def test_unrecorded_output_runs_the_step():
+    timestamps, existing = up_to_date()
+    del timestamps["public.osm_ridership"]
+
+    assert plan_steps(timestamps, existing)["ridership-analysis"] == "never recorded"
+
+
+def test_force_runs_every_step():
+    assert set(plan_steps({}, set(), force=True).values()) == {"forced"}
+
+
+def test_ridership_tables_cover_every_season():
+    combine = pipeline_step("ridership-combine-loads")
+    assign = pipeline_step("ridership-assign-loads")
+
+    assert combine["inputs"] == stop_tables()
+    for season in RIDERSHIP_SEASONS:
+        for table in RIDERSHIP_SEASONS[season].values():
+            assert table in combine["inputs"]
+
+        clean_loads = f"ridership.linkseq_cleanloads_{season}"
+        assert clean_loads in assign["outputs"]
+        assert clean_loads in INTERMEDIATE_TABLES
+        assert f"ridership.linkseq_withloads_{season}" in assign["intermediates"]
+
+
+def test_missing_season_runs_assign_loads():
+    timestamps, existing = up_to_date()
+    for season in RIDERSHIP_SEASONS:
+        existing.discard(f"ridership.linkseq_cleanloads_{season}")
+
+    reasons = plan_steps(timestamps, existing)
+
+    assert reasons["ridership-assign-loads"].endswith("is missing")
+
+
+def recorded(db) -> set:
+    if not db.query_as_single_item(f"SELECT to_regclass('{PIPELINE_STATE_TABLE}') IS NOT NULL"):
+        return set()
+    rows = db.query_as_list(f"SELECT table_name FROM {PIPELINE_STATE_TABLE}")
+    return {table for (table,) in rows}
+
+
+def test_record_outputs_can_be_limited_to_some_tables(db):
+    db.execute("CREATE TABLE public.osm_speed (uid int);")
+    db.execute("CREATE TABLE public.osm_speed_qaqc (uid int);")
+
+    record_outputs(db, "speed-analysis", tables=["public.osm_speed"])
+    assert recorded(db) == {"public.osm_speed"}
+
+    record_outputs(db, "speed-analysis", tables=[])
+    record_outputs(db, "speed-analysis")
+    assert recorded(db) == {"public.osm_speed", "osm_speed_qaqc"}
+
+
+def test_timestamps_come_from_the_manifest_and_the_state_table(db):
+    db.add_schema("raw")
+    read_manifest(db)
+    record_in_manifest(db, "speed.shp", 10, 1.0, "abc", "raw.linkspeed_byline")
+
+    db.execute("CREATE TABLE public.osm_speed (uid int);")
+    record_outputs(db, "speed-analysis")
+
+    timestamps = table_timestamps(db)
+
+    assert {"raw.linkspeed_byline", "public.osm_speed"} <= set(timestamps)
+
+
+@pytest.fixture
+def cli_db(db, monkeypatch):
+    """
+    The test database as the package-level ``db`` that the CLI uses
+    """
+    monkeypatch.setitem(vars(rtsp_package), "db", db)
+    db.execute("CREATE TABLE public.osm_speed (uid int);")
+    db.execute("CREATE TABLE public.osm_speed_qaqc (uid int);")
+    return db
+
+
+def test_failed_command_is_not_recorded(cli_db, monkeypatch):
+    def fail():
+        raise RuntimeError("speed analysis failed")
+
+    monkeypatch.setattr(cmd_02.speed_analysis, "callback", fail)
+
+    result = CliRunner().invoke(cli.main, ["speed-analysis"])
+
+    assert isinstance(result.exception, RuntimeError)
+    assert recorded(cli_db) == set()
+
+
+def test_successful_command_is_recorded(cli_db, monkeypatch):
+    monkeypatch.setattr(cmd_02.speed_analysis, "callback", lambda: None)
+
+    result = CliRunner().invoke(cli.main, ["speed-analysis"])
+
+    assert result.exit_code == 0, result.output
+    assert recorded(cli_db) == {"public.osm_speed", "osm_speed_qaqc"}
@@ -0,0 +1,56 @@
+import time
+
+import pandas as pd
+
+
+def wait_for_inserts(db, query: str, inserted: int, timeout: float = 15) -> list:
+    """
+    Table statistics reach pg_stat_user_tables a moment after a commit,
+    so poll until the insert counter catches up (or give up)
+    """
+    deadline = time.monotonic() + timeout
+    state = db._table_state(query)
+    while state[0][4] < inserted and time.monotonic() < deadline:
+        time.sleep(0.2)
+        state = db._table_state(query)
+    return state
+
+
+def test_table_state_finds_tables_outside_public(db):
+    db.add_schema("raw")
+    db.execute("CREATE TABLE raw.cache_source (uid int);")
+    db.execute("CREATE TABLE public.cache_source (uid int);")
+
+    state = db._table_state("SELECT * FROM raw.cache_source")
+
+    assert [row[:2] for row in state] == [["raw", "cache_source"]]
+
+
+def test_write_to_non_public_table_invalidates_cache(db, tmp_path):
+    db.enable_query_cache(tmp_path / "cache")
+    db.add_schema("raw")
+    db.execute("CREATE TABLE raw.cache_source (uid int);")
+    db.execute("INSERT INTO raw.cache_source VALUES (1), (2);")
+
+    query = "SELECT count(*) AS n FROM raw.cache_source"
+    old_state = wait_for_inserts(db, query, 2)
+
+    assert db.query_as_df(query, cache=True)["n"].iloc[0] == 2
+
+    db.execute("INSERT INTO raw.cache_source VALUES (3);")
+    new_state = wait_for_inserts(db, query, 3)
+
+    assert new_state != old_state
+    assert db.query_as_df(query, cache=True)["n"].iloc[0] == 3
+
+
+def test_cached_result_is_reused_when_nothing_changed(db, tmp_path):
+    db.enable_query_cache(tmp_path / "cache")
+    db.add_schema("ridership")
+    db.execute("CREATE TABLE ridership.cache_source (uid int);")
+
+    query = "SELECT uid FROM ridership.cache_source"
+    key = db.query_cache.key(query, db._table_state(query))
+    db.query_cache.put(key, pd.DataFrame({"uid": [42]}))
+
+    assert db.query_as_df(query, cache=True)["uid"].iloc[0] == 42
@@ -0,0 +1,166 @@
+import pytest
+
+from regional_transit_screening_platform.step_01_import_data.transfer import (
+    file_sha256,
+    transfer_tables,
+)
+
+TABLES = [
+    {"source": "lineroutes", "target": "raw.lineroutes"},
+    {"source": "2015base_link", "target": "raw.model_2015base_link"},
+]
+
+
+@pytest.fixture
+def daisy(source_db):
+    source_db.execute(
+        """
+        CREATE TABLE lineroutes (lrid int PRIMARY KEY, linename text);
+        INSERT INTO lineroutes VALUES (1, '17'), (2, '33');
+        CREATE TABLE "2015base_link" (no int, fromnodeno int, tonodeno int);
+        INSERT INTO "2015base_link" VALUES (10, 1, 2), (11, 2, 3), (12, 3, 4);
+    """
+    )
+    return source_db
+
+
+class Connector:
+    """
+    Stands in for the function that connects to the source, and counts the calls
+    """
+
+    def __init__(self, source_db=None):
+        self.source_db = source_db
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.source_db is None:
+            raise AssertionError("the source shouldn't be needed")
+        return self.source_db
+
+
+def statuses(results: list) -> dict:
+    return {target: status for target, status, _, _ in results}
+
+
+def test_first_run_copies_from_the_source(db, daisy, tmp_path):
+    results = transfer_tables(Connector(daisy), db, TABLES, tmp_path)
+
+    assert statuses(results) == {"raw.lineroutes": "copied", "raw.model_2015base_link": "copied"}
+    assert db.query_as_list("SELECT lrid, linename FROM raw.lineroutes ORDER BY lrid") == [
+        (1, "17"),
+        (2, "33"),
+    ]
+    assert db.query_as_single_item("SELECT count(*) FROM raw.model_2015base_link") == 3
+
+    # The primary key comes along
+    assert db.query_as_single_item(
+        "SELECT count(*) FROM pg_index WHERE indrelid = 'raw.lineroutes'::regclass"
+        " AND indisprimary"
+    )
+
+
+def test_saved_dumps_are_reused_without_connecting(db, daisy, tmp_path):
+    transfer_tables(daisy, db, TABLES, tmp_path)
+    db.execute("DROP TABLE raw.lineroutes;")
+
+    connector = Connector()
+    results = transfer_tables(connector, db, TABLES, tmp_path)
+
+    assert connector.calls == 0
+    assert set(statuses(results).values()) == {"restored"}
+    assert db.query_as_single_item("SELECT count(*) FROM raw.lineroutes") == 2
+
+
+def test_dump_with_a_bad_checksum_is_read_again(db, daisy, tmp_path):
+    transfer_tables(daisy, db, TABLES, tmp_path)
+
+    dump = tmp_path / "raw.lineroutes.copy"
+    good_sha256 = file_sha256(dump)
+    dump.write_text("1\tcorrupt\n")
+
+    connector = Connector(daisy)
+    results = transfer_tables(connector, db, TABLES, tmp_path)
+
+    assert connector.calls == 1
+    assert statuses(results) == {
+        "raw.lineroutes": "copied",
+        "raw.model_2015base_link": "restored",
+    }
+    assert file_sha256(dump) == good_sha256
+    assert db.query_as_single_item("SELECT count(*) FROM raw.lineroutes") == 2
+
+
+def test_dump_made_from_another_spec_is_read_again(db, daisy, tmp_path):
+    transfer_tables(daisy, db, TABLES[:1], tmp_path)
+
+    renamed = [{"source": "lineroutes", "target": "raw.lineroutes", "note": "changed"}]
+    results = transfer_tables(Connector(daisy), db, renamed, tmp_path)
+
+    assert statuses(results) == {"raw.lineroutes": "copied"}
+
+
+def test_refresh_always_reads_the_source(db, daisy, tmp_path):
+    transfer_tables(daisy, db, TABLES, tmp_path)
+
+    connector = Connector(daisy)
+    results = transfer_tables(connector, db, TABLES, tmp_path, refresh=True)
+
+    assert connector.calls == 1
+    assert set(statuses(results).values()) == {"copied"}
+
+
+def test_constraints_defaults_sequences_and_indexes_come_along(db, source_db, tmp_path):
+    source_db.execute(
+        """
+        CREATE TABLE stoppoints (
+            uid serial PRIMARY KEY,
+            no int GENERATED BY DEFAULT AS IDENTITY,
+            gtfsid text NOT NULL,
+            status text DEFAULT 'open',
+            code text
+        );
+        CREATE UNIQUE INDEX stoppoints_gtfsid_idx ON stoppoints (gtfsid);
+        CREATE INDEX stoppoints_code_idx ON stoppoints (lower(code)) WHERE code IS NOT NULL;
+        INSERT INTO stoppoints (gtfsid, code) VALUES ('a', 'X'), ('b', NULL);
+    """
+    )
+    tables = [{"source": "stoppoints", "target": "raw.stoppoints"}]
+
+    transfer_tables(source_db, db, tables, tmp_path)
+
+    # Restoring from the dump rebuilds the same table
+    db.execute("DROP TABLE raw.stoppoints;")
+    results = transfer_tables(Connector(), db, tables, tmp_path)
+    assert statuses(results) == {"raw.stoppoints": "restored"}
+
+    query = """
+        SELECT attname, attnotnull
+        FROM pg_attribute
+        WHERE attrelid = 'raw.stoppoints'::regclass AND attnum > 0
+        ORDER BY attnum
+    """
+    assert db.query_as_list(query) == [
+        ("uid", True),
+        ("no", True),
+        ("gtfsid", True),
+        ("status", False),
+        ("code", False),
+    ]
+
+    query = "SELECT indexdef FROM pg_indexes WHERE tablename = 'stoppoints' ORDER BY indexname"
+    assert [indexdef for (indexdef,) in db.query_as_list(query)] == [
+        "CREATE INDEX stoppoints_code_idx ON raw.stoppoints"
+        " USING btree (lower(code)) WHERE (code IS NOT NULL)",
+        "CREATE UNIQUE INDEX stoppoints_gtfsid_idx ON raw.stoppoints USING btree (gtfsid)",
+        "CREATE UNIQUE INDEX stoppoints_pkey ON raw.stoppoints USING btree (uid)",
+    ]
+
+    # The sequences carry on from the copied rows, and the defaults are kept
+    db.execute("INSERT INTO raw.stoppoints (gtfsid) VALUES ('c');")
+    query = "SELECT uid, no, status FROM raw.stoppoints WHERE gtfsid = 'c'"
+    assert db.query_as_list(query) == [(3, 3, "open")]
+
+    with pytest.raises(Exception, match="not-null"):
+        db.execute("INSERT INTO raw.stoppoints (gtfsid) VALUES (NULL);")